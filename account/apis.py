@@ -21,7 +21,7 @@ from label_x import settings
 from subscription.models import UserDataPoints
 from subscription.serializers import UserDataPointsSerializer
 from task.choices import TaskClusterStatusChoices
-from task.models import Task, TaskCluster
+from task.models import ProjectDailyStats, ProjectStats, Task, TaskCluster
 from task.serializers import ListReviewersWithClustersSerializer, ProjectUpdateSerializer
 from task.utils import get_unreleased_reviewer_earnings
 
@@ -323,7 +323,7 @@ class GetReviewersListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated, IsAdminUser]
     serializer_class = ListReviewersWithClustersSerializer
     def get_queryset(self):
-        return User.objects.prefetch_related("assigned_clusters").filter(is_reviewer=True)
+        return User.objects.prefetch_related("assigned_clusters", "quality_scores__domain").filter(is_reviewer=True)
     
     @extend_schema(
         summary="Get a list of reviewers on the platform and task clusters they are assigned to"
@@ -420,40 +420,29 @@ class GetProjectChart(generics.GenericAPIView):
         
         duration = get_duration(time_unit, time_period)
         
-        queryset = Task.objects.filter(created_at__date__gte=duration.date(), created_at__date__lte=datetime.today().date(), cluster__project=project)
-        
-        clusters = TaskCluster.objects.filter(project=project, created_at__date__gte=duration.date(), created_at__date__lte=datetime.today().date())
-        
-        
-        daily_stats = queryset.annotate(
-            date=TruncDate('created_at')
-        ).values('date').annotate(
-            task_count=Count('id'),
-            total_data_points=Sum('used_data_points'),
-            human_reviewed_count = Count('id', filter=Q(human_reviewed=True))
-        ).order_by('date')
-        
-        # cluster_daily_stats = clusters.annotate(date=TruncDate('created_at')).values('date').annotate(
-        #     task_count=Count('id'),
-        #     total_data_points=Sum('tasks__used_data_points'),
-        # ).order_by('date')
-        
-        
-        # pie_chart_data= queryset.aggregate(
-        #     completed = Count('id', filter=Q(final_label__isnull=False)),
-        #     pending = Count('id', filter=Q(processing_status='PENDING')),
-        #     in_progress = Count('id', filter=Q(processing_status='PROCESSING')),
-        # )
-        
-        cluster_pie_chart_data = clusters.aggregate(
-            completed = Count('id', filter=Q(status=TaskClusterStatusChoices.COMPLETED)),
-            pending = Count('id', filter=Q(status=TaskClusterStatusChoices.PENDING)),
-            in_progress = Count('id', filter=Q(status=TaskClusterStatusChoices.IN_REVIEW)),
-        )
-        
-        accuracy_trend = queryset.annotate(date=TruncDate('created_at')).values('date').annotate(
-            average_ai_confidence = Avg('ai_confidence') * 100
+        # read from the daily rollup, which holds at most one row per day for the project
+        daily_rows = ProjectDailyStats.objects.filter(project=project, date__gte=duration.date(), date__lte=datetime.today().date())
+        
+        daily_stats = []
+        accuracy_trend = []
+        for row in daily_rows.filter(task_count__gt=0).values('date', 'task_count', 'total_data_points', 'human_reviewed_count', 'ai_confidence_sum'):
+            daily_stats.append({
+                'date': row['date'],
+                'task_count': row['task_count'],
+                'total_data_points': row['total_data_points'],
+                'human_reviewed_count': row['human_reviewed_count'],
+            })
+            accuracy_trend.append({
+                'date': row['date'],
+                'average_ai_confidence': row['ai_confidence_sum'] / row['task_count'] * 100,
+            })
+        
+        cluster_totals = daily_rows.aggregate(
+            completed=Sum('completed_clusters'),
+            pending=Sum('pending_clusters'),
+            in_progress=Sum('in_review_clusters'),
         )
+        cluster_pie_chart_data = {key: value or 0 for key, value in cluster_totals.items()}
 
         return SuccessResponse(message="Project charts", data={
             'daily_progress': daily_stats,
@@ -504,7 +493,7 @@ class ProjectDetailView(generics.RetrieveAPIView):
         else:
             return Project.objects.filter(created_by=self.request.user)
     
-    @cache_response_decorator('project_detail')
+    @cache_response_decorator('project_detail', per_user=True, tags=['project_detail_{id}'], soft_timeout=60)
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
@@ -1396,41 +1385,30 @@ class ListProjectsView(APIView):
     def get(self, request):
         user = request.user
         
+        # statistics come from the materialized ProjectStats row, so the number of queries does not grow with the number of projects
+        projects = Project.objects.select_related("created_by", "stats").prefetch_related("reviewer_members", "project_members__user")
         if user.is_staff or user.is_superuser:
             # Admin can see all projects
-            projects = Project.objects.prefetch_related("clusters")
+            pass
         elif user.is_reviewer:
             # Reviewer can only see projects they are assigned to
-            projects = Project.objects.prefetch_related("clusters").filter(clusters__assigned_reviewers=user).distinct()
+            projects = projects.filter(clusters__assigned_reviewers=user).distinct()
         else:
             # Organization can only see their own projects
-            projects = Project.objects.prefetch_related("clusters").filter(created_by=user)
+            projects = projects.filter(created_by=user)
                 
         # Get task statistics for each project
         project_data = []
         for project in projects:
             project_dict = ProjectSerializer(project).data
             
-            # Get task statistics
-            total_tasks = project.clusters.count()
-            
-            completed_tasks = project.clusters.filter(status=TaskClusterStatusChoices.COMPLETED).count()
-
-            pending_review = project.clusters.filter(status=TaskClusterStatusChoices.PENDING).count()
-            in_progress = project.clusters.filter(status=TaskClusterStatusChoices.IN_REVIEW).count()
-            
-            # completion_percentage = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
-            
-            completion_percentage = project.get_cluster_label_completion_percentage() or 0
+            try:
+                stats = project.stats
+            except ProjectStats.DoesNotExist:
+                stats = ProjectStats.rebuild(project.id)
             
             # Add task statistics to project data
-            project_dict['task_stats'] = {
-                'total_tasks': total_tasks,
-                'completed_tasks': completed_tasks,
-                'pending_review': pending_review,
-                'in_progress': in_progress,
-                "completion_percentage": round(completion_percentage, 2)
-            }
+            project_dict['task_stats'] = stats.as_task_stats()
             
             project_data.append(project_dict)
         
@@ -10,6 +10,7 @@ from django.contrib.auth import get_user_model
 from urllib.parse import parse_qs
 
 from .models import User
+from common.realtime import EventReplayMixin
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -19,7 +20,7 @@ from channels.exceptions import DenyConnection
 import json
 
 
-class UserActivityConsumer(AsyncWebsocketConsumer):
+class UserActivityConsumer(EventReplayMixin, AsyncWebsocketConsumer):
     async def connect(self):
         logger.info("WebSocket connection attempt received")
         
@@ -39,6 +40,8 @@ class UserActivityConsumer(AsyncWebsocketConsumer):
         self.user_id = user.id
         await self.update_user_status(True)
         logger.info(f"User {user} is now online")
+
+        await self.replay_missed_events(user.id)
         
         # await self.accept()
         logger.info(f"WebSocket connection accepted for user {user}")
@@ -171,7 +171,8 @@ class ProjectDetailSerializer(serializers.ModelSerializer):
         model = Project
 
     def get_project_logs(self, obj):
-        logs = ProjectLog.objects.filter(project=obj)
+        # depth 1 nests the project (with its team members) and the task of every log
+        logs = ProjectLog.objects.filter(project=obj).select_related("project", "task").prefetch_related("project__team_members")
         return ProjectLogSerializer(logs, many=True).data
 
     def get_user_data_points(self, obj):
@@ -1,19 +1,31 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.cache import cache
-from account.models import Project, User, UserBankAccount
+from common.caching import invalidate_cache_tags
+from account.models import Project, ProjectMember, User, UserAPIKey, UserBankAccount
+from account.utils import invalidate_verified_api_key, project_member_role_cache_key, project_owner_cache_key
 
 @receiver([post_save, post_delete], sender=Project)
 def invalidate_project_cache(sender, instance, **kwargs):
-    if instance.created_by:
-        cache.delete_pattern(f"*task_completion_stats_{instance.created_by.id}*")
-    cache.delete_pattern(f"*project_detail_GET_/api/v1/account/projects/{instance.id}/*")
+    if instance.created_by_id:
+        invalidate_cache_tags(f"task_completion_stats_{instance.created_by_id}")
+    invalidate_cache_tags(f"project_detail_{instance.id}")
+    cache.delete(project_owner_cache_key(instance.id))
     
 @receiver([post_save, post_delete], sender=User)
 def invalidate_user_cache(sender, instance, **kwargs):
-    cache.delete_pattern(f"*user_detail_{instance.id}*")
+    invalidate_cache_tags(f"user_detail_{instance.id}")
+    cache.delete(f"ws_auth_user_fields_{instance.id}")
 
 @receiver([post_save, post_delete], sender=UserBankAccount)
 def invalidate_user_bank_account_cache(sender, instance, **kwargs):
-    cache.delete_pattern(f"*user_bank_accounts_{instance.user.id}*")
-    
\ No newline at end of file
+    invalidate_cache_tags(f"user_bank_accounts_{instance.user_id}")
+
+@receiver([post_save, post_delete], sender=UserAPIKey)
+def invalidate_api_key_auth_cache(sender, instance, **kwargs):
+    # revoking or rolling a key saves it, so both http and websocket auth stop accepting it right away
+    invalidate_verified_api_key(instance.prefix)
+
+@receiver([post_save, post_delete], sender=ProjectMember)
+def invalidate_project_member_cache(sender, instance, **kwargs):
+    cache.delete(project_member_role_cache_key(instance.project_id, instance.user_id))
@@ -1,15 +1,23 @@
 from datetime import timedelta, datetime
 import pytz
+from unittest.mock import patch
 
 from django.urls import reverse
 from rest_framework.test import APITransactionTestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from account.models import User, Project
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from account.models import User, Project, ProjectMember
+from account.utils import get_project_access, project_member_role_cache_key, project_owner_cache_key
 from reviewer.models import LabelerDomain
-from task.choices import AnnotationMethodChoices, TaskInputTypeChoices, TaskTypeChoices
-from task.models import Task, TaskCluster
+from task.choices import AnnotationMethodChoices, TaskClusterStatusChoices, TaskInputTypeChoices, TaskTypeChoices
+from task.models import ProjectDailyStats, ProjectStats, Task, TaskCluster
+from task.periodic_tasks import reconcile_project_stats
 
 class RegisterTestCase(APITransactionTestCase):
     def setUp(self):
@@ -595,6 +603,75 @@ class ListProjectsTestCase(APITransactionTestCase):
         self.assertIn('Project 2', project_names)
         self.assertNotIn('Project 3', project_names)
 
+    def test_task_stats_follow_cluster_changes(self):
+        """Test that project statistics are kept up to date as clusters change"""
+        cluster = TaskCluster.objects.get(project=self.project1)
+        cluster.completion_percentage = 100
+        cluster.status = TaskClusterStatusChoices.COMPLETED
+        cluster.save()
+        TaskCluster.objects.create(project=self.project1, created_by=self.organization_user, labeller_per_item_count=1)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.org_token}")
+        response = self.client.get(self.list_projects_url)
+
+        stats = next(p['task_stats'] for p in response.data['projects'] if p['id'] == self.project1.id)
+        self.assertEqual(stats, {
+            'total_tasks': 2,
+            'completed_tasks': 1,
+            'pending_review': 1,
+            'in_progress': 0,
+            'completion_percentage': 50.0,
+        })
+
+        cluster.delete()
+        self.project1.stats.refresh_from_db()
+        self.assertEqual(self.project1.stats.as_task_stats(), ProjectStats.rebuild(self.project1.id).as_task_stats())
+
+    def test_task_stats_survive_saves_of_stale_instances(self):
+        """Test that two copies of a cluster saved one after the other are not both counted as moving from the same values"""
+        first_copy = TaskCluster.objects.get(project=self.project1)
+        second_copy = TaskCluster.objects.get(project=self.project1)
+
+        first_copy.completion_percentage = 40
+        first_copy.status = TaskClusterStatusChoices.IN_REVIEW
+        first_copy.save()
+        second_copy.completion_percentage = 100
+        second_copy.status = TaskClusterStatusChoices.COMPLETED
+        second_copy.save()
+        # a save that writes none of the counted fields leaves the statistics alone
+        first_copy.save(update_fields=['name'])
+
+        self.project1.stats.refresh_from_db()
+        self.assertEqual(self.project1.stats.as_task_stats(), ProjectStats.rebuild(self.project1.id).as_task_stats())
+        self.assertEqual(self.project1.stats.completed_clusters, 1)
+        self.assertEqual(self.project1.stats.in_review_clusters, 0)
+
+    def test_reconcile_repairs_drifted_stats(self):
+        """Test that the nightly reconcile recounts statistics changed behind the signals' back"""
+        TaskCluster.objects.filter(project=self.project1).update(status=TaskClusterStatusChoices.COMPLETED, completion_percentage=100)
+
+        reconcile_project_stats()
+
+        self.project1.stats.refresh_from_db()
+        self.assertEqual(self.project1.stats.completed_clusters, 1)
+        self.assertEqual(self.project1.stats.completion_percentage, 100)
+
+    def test_query_count_does_not_grow_with_projects(self):
+        """Test that listing projects runs the same number of queries however many projects there are"""
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.admin_token}")
+        with CaptureQueriesContext(connection) as few_projects:
+            self.client.get(self.list_projects_url)
+
+        for i in range(5):
+            project = Project.objects.create(name=f'Extra project {i}', created_by=self.organization_user)
+            TaskCluster.objects.create(project=project, created_by=self.organization_user)
+
+        with CaptureQueriesContext(connection) as many_projects:
+            response = self.client.get(self.list_projects_url)
+
+        self.assertEqual(len(response.data['projects']), 8)
+        self.assertEqual(len(many_projects), len(few_projects))
+
     def test_list_projects_without_auth(self):
         """Test listing projects without authentication"""
         self.client.credentials()  # Remove auth credentials
@@ -605,3 +682,175 @@ class ListProjectsTestCase(APITransactionTestCase):
     def tearDown(self):
         Project.objects.all().delete()
         User.objects.all().delete()
+
+
+class ProjectAccessCacheTestCase(APITransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.member = User.objects.create_user(username='member', email='member@example.com', password='Testp@ssword123')
+        self.project = Project.objects.create(name='Project 1', created_by=self.owner)
+        self.membership = ProjectMember.objects.create(project=self.project, user=self.member, role='viewer')
+        cache.delete_many([
+            project_owner_cache_key(self.project.id),
+            project_member_role_cache_key(self.project.id, self.member.id),
+        ])
+
+        self.members_url = reverse('account:list-project-members', kwargs={'project_id': self.project.id})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.member).access_token}")
+
+    def test_warm_permission_checks_do_not_query(self):
+        """Test that project access is served from the cache once loaded"""
+        access = get_project_access(self.project.id, self.member.id)
+        self.assertTrue(access.is_member)
+        self.assertTrue(access.has_permission('view_tasks'))
+        self.assertFalse(access.has_permission('manage_members'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_project_access(self.project.id, self.member.id).role, 'viewer')
+
+    def test_membership_changes_apply_immediately(self):
+        """Test that role changes and removals invalidate the cached membership"""
+        self.assertEqual(self.client.get(self.members_url).status_code, status.HTTP_200_OK)
+
+        self.membership.role = 'admin'
+        self.membership.save()
+        self.assertTrue(get_project_access(self.project.id, self.member.id).has_permission('manage_members'))
+
+        self.membership.delete()
+        self.assertEqual(self.client.get(self.members_url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_unknown_project_is_denied(self):
+        """Test that a project that does not exist is never accessible"""
+        url = reverse('account:list-project-members', kwargs={'project_id': self.project.id + 100})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProjectChartTestCase(APITransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='org',
+            email='org@example.com',
+            password='Testp@ssword123',
+            is_email_verified=True
+        )
+        self.project = Project.objects.create(name='Chart project', created_by=self.user)
+        self.cluster = TaskCluster.objects.create(
+            project=self.project,
+            annotation_method=AnnotationMethodChoices.MANUAL,
+            created_by=self.user,
+        )
+        self.tasks = [
+            Task.objects.create(
+                task_type=TaskTypeChoices.TEXT,
+                data=f'item {i}',
+                cluster=self.cluster,
+                group=self.project,
+                user=self.user,
+                used_data_points=10,
+                ai_confidence=0.5,
+            )
+            for i in range(3)
+        ]
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.chart_url = reverse('account:get-project-chart', kwargs={'project_id': self.project.id, 'time_unit': 'day', 'time_period': 7})
+
+    def get_rollup(self):
+        return list(ProjectDailyStats.objects.filter(project=self.project).values())
+
+    def test_chart_is_served_from_daily_rollup(self):
+        """Test that the chart reports the day's tasks and clusters from the rollup"""
+        self.tasks[0].human_reviewed = True
+        self.tasks[0].ai_confidence = 0.8
+        self.tasks[0].save()
+        self.cluster.status = TaskClusterStatusChoices.IN_REVIEW
+        self.cluster.save()
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        # user, project, rollup rows and cluster totals
+        with self.assertNumQueries(4):
+            response = self.client.get(self.chart_url)
+
+        data = response.data['data']
+        self.assertEqual(data['daily_progress'], [{
+            'date': timezone.localdate(),
+            'task_count': 3,
+            'total_data_points': 30,
+            'human_reviewed_count': 1,
+        }])
+        self.assertEqual(data['pie_chart_data'], {'completed': 0, 'pending': 0, 'in_progress': 1})
+        self.assertAlmostEqual(data['accuracy_trend'][0]['average_ai_confidence'], 60.0)
+
+    def test_incremental_rollup_matches_rebuild(self):
+        """Test that the rollup kept up by the signals is the same as one recomputed from scratch"""
+        self.tasks[1].delete()
+        self.tasks[2].used_data_points = 25
+        self.tasks[2].save()
+        TaskCluster.objects.create(project=self.project, created_by=self.user)
+
+        incremental = self.get_rollup()
+        ProjectDailyStats.rebuild(timezone.localdate(), project_ids=[self.project.id])
+        rebuilt = self.get_rollup()
+
+        strip_ids = lambda rows: [{k: v for k, v in row.items() if k != 'id'} for row in rows]
+        self.assertEqual(strip_ids(incremental), strip_ids(rebuilt))
+        self.assertEqual(rebuilt[0]['task_count'], 2)
+        self.assertEqual(rebuilt[0]['pending_clusters'], 2)
+
+    def test_rebuild_overwrites_rows_created_while_it_runs(self):
+        """Test that a day's row created by a delta while the rebuild writes is overwritten instead of conflicting"""
+        expected = self.get_rollup()
+        yesterday = timezone.localdate() - timedelta(days=1)
+        ProjectDailyStats.objects.filter(project=self.project).delete()
+        ProjectDailyStats.objects.create(project=self.project, date=yesterday, task_count=4)
+        bulk_create = ProjectDailyStats.objects.bulk_create
+
+        def bulk_create_after_concurrent_insert(*args, **kwargs):
+            # the first step of an apply_delta for a day without a row
+            ProjectDailyStats.objects.create(project=self.project, date=timezone.localdate())
+            return bulk_create(*args, **kwargs)
+
+        with patch.object(ProjectDailyStats.objects, 'bulk_create', side_effect=bulk_create_after_concurrent_insert):
+            ProjectDailyStats.rebuild(yesterday, project_ids=[self.project.id])
+
+        strip_ids = lambda rows: [{k: v for k, v in row.items() if k != 'id'} for row in rows]
+        self.assertEqual(strip_ids(self.get_rollup()), strip_ids(expected))
+
+    def test_saves_that_change_no_counted_field_take_no_lock(self):
+        """Test that a status change of a loaded task neither locks the row nor writes back stale counted fields"""
+        stale_task = Task.objects.get(id=self.tasks[0].id)
+        other_task = Task.objects.get(id=self.tasks[0].id)
+        other_task.used_data_points = 40
+        other_task.save()
+
+        stale_task.processing_status = 'PROCESSING'
+        with patch('task.signals._locked_values') as locked_values, CaptureQueriesContext(connection) as queries:
+            stale_task.save()
+
+        locked_values.assert_not_called()
+        self.assertFalse([query['sql'] for query in queries if 'used_data_points' in query['sql']])
+        stored = Task.objects.get(id=self.tasks[0].id)
+        self.assertEqual((stored.processing_status, stored.used_data_points), ('PROCESSING', 40))
+        self.assertEqual(self.get_rollup()[0]['total_data_points'], 60)
+
+    def test_rollup_survives_saves_of_stale_instances(self):
+        """Test that two copies of a task or cluster saved one after the other are each counted from the stored values"""
+        first_task, second_task = Task.objects.get(id=self.tasks[0].id), Task.objects.get(id=self.tasks[0].id)
+        first_task.used_data_points = 20
+        first_task.save()
+        second_task.used_data_points = 35
+        second_task.human_reviewed = True
+        second_task.save()
+
+        first_cluster, second_cluster = TaskCluster.objects.get(id=self.cluster.id), TaskCluster.objects.get(id=self.cluster.id)
+        first_cluster.status = TaskClusterStatusChoices.IN_REVIEW
+        first_cluster.save()
+        second_cluster.status = TaskClusterStatusChoices.COMPLETED
+        second_cluster.save()
+        Task.objects.get(id=self.tasks[1].id).delete()
+
+        incremental = self.get_rollup()
+        ProjectDailyStats.rebuild(timezone.localdate(), project_ids=[self.project.id])
+        strip_ids = lambda rows: [{k: v for k, v in row.items() if k != 'id'} for row in rows]
+        self.assertEqual(strip_ids(incremental), strip_ids(self.get_rollup()))
+        self.assertEqual(incremental[0]['total_data_points'], 45)
+        self.assertEqual((incremental[0]['in_review_clusters'], incremental[0]['completed_clusters']), (0, 1))
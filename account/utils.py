@@ -1,5 +1,8 @@
+import hashlib
+import hmac
 import uuid
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 from django.utils import timezone
 from datetime import timedelta
@@ -9,7 +12,7 @@ import jwt
 from cryptography.fernet import Fernet
 import base64
 import json
-from .models import ApiKeyTypeChoices, UserAPIKey, Project, ProjectMember
+from .models import ApiKeyTypeChoices, User, UserAPIKey, Project, ProjectMember
 from rest_framework_api_key.permissions import BaseHasAPIKey
 
 from subscription.models import UserDataPoints, SubscriptionPlan, UserSubscription
@@ -39,6 +42,17 @@ class IsAdminUser(BasePermission):
         return request.user and request.user.is_authenticated and request.user.is_staff
 
 
+class IsMetricsScraper(BasePermission):
+    """
+    Allow access to requests coming from one of METRICS_ALLOWED_IPS, e.g. a Prometheus on the private network.
+    The address is the REMOTE_ADDR of the connection, behind a reverse proxy every request comes from the proxy's
+    address, which must then not be allowed.
+    """
+
+    def has_permission(self, request, view):
+        return request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS
+
+
 class IsReviewer(BasePermission):
     """
     Allows access only to users marked as reviewers.
@@ -58,20 +72,61 @@ class NotReviewer(BasePermission):
         return bool(
             request.user and request.user.is_authenticated and not request.user.is_reviewer
         )
+def verified_api_key_cache_key(prefix):
+    return f"verified_api_key_{prefix}"
+
+
+def get_verified_api_key(key):
+    """
+    Verify an api key and return a dict with its `id`, `prefix`, `user_id`, `key_type` and `expiry_date`,
+    or None if the key is unknown, revoked or expired.
+
+    The key hasher only runs on a cold cache. Verified keys are kept in redis (API_KEY_CACHE_TIMEOUT seconds)
+    under their prefix together with a sha256 of the full key. There is deliberately no in-process copy, so
+    saving or deleting a key (see account.signals) revokes it in every process at once.
+    """
+    prefix, _, _ = key.partition(".")
+    key_hash = hashlib.sha256(key.encode()).hexdigest()
+
+    entry = cache.get(verified_api_key_cache_key(prefix))
+    if entry is None or not hmac.compare_digest(entry["key_hash"], key_hash):
+        try:
+            api_key = UserAPIKey.objects.get_from_key(key)
+        except UserAPIKey.DoesNotExist:
+            return None
+        entry = {
+            "id": api_key.id,
+            "prefix": api_key.prefix,
+            "key_hash": key_hash,
+            "user_id": api_key.user_id,
+            "key_type": api_key.key_type,
+            "expiry_date": api_key.expiry_date,
+        }
+        cache.set(verified_api_key_cache_key(prefix), entry, timeout=settings.API_KEY_CACHE_TIMEOUT)
+
+    if entry["expiry_date"] is not None and entry["expiry_date"] < timezone.now():
+        return None
+    return entry
+
+
+def invalidate_verified_api_key(prefix):
+    cache.delete(verified_api_key_cache_key(prefix))
+
+
 class HasUserAPIKey(BaseHasAPIKey):
     model = UserAPIKey
     def has_permission(self, request, view):
-        has_api_key_permission = super().has_permission(request, view)
-        if not has_api_key_permission:
-            return False
-        
         key = self.get_key(request)
         if not key:
             return False
 
-        api_key = self.model.objects.get_from_key(key)
-        request.user = api_key.user
-        request.is_test_key = api_key.key_type == ApiKeyTypeChoices.DEVELOPMENT
+        # verified once per request, `get_verified_api_key` only runs the key hasher on a cold cache
+        api_key = get_verified_api_key(key)
+        if api_key is None:
+            return False
+
+        request.user = User.objects.get(id=api_key["user_id"])
+        request.is_test_key = api_key["key_type"] == ApiKeyTypeChoices.TEST
         return True
 
 def generate_stateless_api_key(user, expiry_days=30):
@@ -119,6 +174,94 @@ def assign_default_plan(new_user):
     user_data_points.topup_data_points(50)
 
 
+# Permission matrix
+PROJECT_ROLE_PERMISSIONS = {
+    'owner': ['create_tasks', 'view_tasks', 'manage_members', 'manage_project'],
+    'admin': ['create_tasks', 'view_tasks', 'manage_members'],
+    'member': ['create_tasks', 'view_tasks'],
+    'viewer': ['view_tasks'],
+}
+
+
+def project_owner_cache_key(project_id):
+    return f"project_owner_{project_id}"
+
+
+def project_member_role_cache_key(project_id, user_id):
+    return f"project_member_role_{project_id}_{user_id}"
+
+
+class ProjectAccess:
+    """
+    What a user is allowed to do in a project: whether the project exists, who created it and the
+    user's member role ('' when they are not a member).
+    """
+
+    def __init__(self, user_id, exists, created_by_id, role):
+        self.user_id = user_id
+        self.exists = exists
+        self.created_by_id = created_by_id
+        self.role = role
+
+    @property
+    def is_creator(self):
+        return self.exists and self.created_by_id == self.user_id
+
+    @property
+    def is_member(self):
+        return self.is_creator or bool(self.role)
+
+    def has_permission(self, permission):
+        # Project creator has all permissions
+        return self.is_creator or permission in PROJECT_ROLE_PERMISSIONS.get(self.role, [])
+
+
+def get_project_access(project_id, user_id, created_by_id=None):
+    """
+    Load the project owner and the user's membership role, cached across requests for
+    PROJECT_ACCESS_CACHE_TIMEOUT seconds. Both entries are dropped by the Project and ProjectMember
+    signals, so a warm check costs a single cache round trip and no queries.
+    """
+    owner_key = project_owner_cache_key(project_id)
+    role_key = project_member_role_cache_key(project_id, user_id)
+    cached = cache.get_many([role_key] if created_by_id else [owner_key, role_key])
+
+    if created_by_id:
+        owner = {"exists": True, "created_by_id": created_by_id}
+    else:
+        owner = cached.get(owner_key)
+        if owner is None:
+            project = Project.objects.filter(id=project_id).values("created_by_id").first()
+            owner = {"exists": project is not None, "created_by_id": project["created_by_id"] if project else None}
+            cache.set(owner_key, owner, timeout=settings.PROJECT_ACCESS_CACHE_TIMEOUT)
+
+    role = cached.get(role_key)
+    if role is None:
+        role = ProjectMember.objects.filter(project_id=project_id, user_id=user_id).values_list("role", flat=True).first() or ""
+        cache.set(role_key, role, timeout=settings.PROJECT_ACCESS_CACHE_TIMEOUT)
+
+    return ProjectAccess(user_id, owner["exists"], owner["created_by_id"], role)
+
+
+def get_request_project_access(request, view):
+    """
+    Project access of the requesting user for the project the view works on, loaded once per request
+    so stacked permission classes share the same lookup.
+    """
+    # Get project_id from view kwargs or request data
+    project_id = view.kwargs.get('project_id') or request.data.get('project_id')
+    if not project_id:
+        return None
+
+    request_access = getattr(request, '_project_access', None)
+    if request_access is None:
+        request_access = request._project_access = {}
+
+    if project_id not in request_access:
+        request_access[project_id] = get_project_access(project_id, request.user.id)
+    return request_access[project_id]
+
+
 class IsProjectOwnerOrAdmin(BasePermission):
     """Allow access to project creator or users with ADMIN role in the project"""
     
@@ -126,26 +269,12 @@ class IsProjectOwnerOrAdmin(BasePermission):
         if not request.user or not request.user.is_authenticated:
             return False
         
-        # Get project_id from view kwargs or request data
-        project_id = view.kwargs.get('project_id') or request.data.get('project_id')
-        if not project_id:
+        access = get_request_project_access(request, view)
+        if access is None or not access.exists:
             return False
         
-        try:
-            project = Project.objects.get(id=project_id)
-        except Project.DoesNotExist:
-            return False
-        
-        # Check if user is project creator
-        if project.created_by == request.user:
-            return True
-        
-        # Check if user has ADMIN or OWNER role
-        try:
-            member = ProjectMember.objects.get(project=project, user=request.user)
-            return member.role in ['admin', 'owner']
-        except ProjectMember.DoesNotExist:
-            return False
+        # Check if user is project creator or has ADMIN or OWNER role
+        return access.is_creator or access.role in ['admin', 'owner']
 
 
 class IsProjectMember(BasePermission):
@@ -155,22 +284,12 @@ class IsProjectMember(BasePermission):
         if not request.user or not request.user.is_authenticated:
             return False
         
-        # Get project_id from view kwargs or request data
-        project_id = view.kwargs.get('project_id') or request.data.get('project_id')
-        if not project_id:
+        access = get_request_project_access(request, view)
+        if access is None or not access.exists:
             return False
         
-        try:
-            project = Project.objects.get(id=project_id)
-        except Project.DoesNotExist:
-            return False
-        
-        # Check if user is project creator
-        if project.created_by == request.user:
-            return True
-        
-        # Check if user is a team member
-        return ProjectMember.objects.filter(project=project, user=request.user).exists()
+        # Check if user is project creator or a team member
+        return access.is_member
 
 
 def has_project_permission(user, project, permission):
@@ -181,25 +300,7 @@ def has_project_permission(user, project, permission):
     if not user or not user.is_authenticated:
         return False
     
-    # Project creator has all permissions
-    if project.created_by == user:
-        return True
-    
-    try:
-        member = ProjectMember.objects.get(project=project, user=user)
-        role = member.role
-        
-        # Permission matrix
-        permissions = {
-            'owner': ['create_tasks', 'view_tasks', 'manage_members', 'manage_project'],
-            'admin': ['create_tasks', 'view_tasks', 'manage_members'],
-            'member': ['create_tasks', 'view_tasks'],
-            'viewer': ['view_tasks'],
-        }
-        
-        return permission in permissions.get(role, [])
-    except ProjectMember.DoesNotExist:
-        return False
+    return get_project_access(project.id, user.id, created_by_id=project.created_by_id).has_permission(permission)
 
 
 class HasProjectPermission(BasePermission):
@@ -211,18 +312,12 @@ class HasProjectPermission(BasePermission):
         if not request.user or not request.user.is_authenticated:
             return False
         
-        # Get project_id from view kwargs or request data
-        project_id = view.kwargs.get('project_id') or request.data.get('project_id')
-        if not project_id:
-            return False
-        
-        try:
-            project = Project.objects.get(id=project_id)
-        except Project.DoesNotExist:
+        access = get_request_project_access(request, view)
+        if access is None or not access.exists:
             return False
         
         permission = getattr(view, 'required_permission', self.required_permission)
         if not permission:
             return False
         
-        return has_project_permission(request.user, project, permission)        
\ No newline at end of file
+        return access.has_permission(permission)        
\ No newline at end of file
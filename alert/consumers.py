@@ -2,9 +2,13 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.exceptions import DenyConnection
 import json
 
-from task.models import TaskClassificationChoices
+from task.models import TaskClassificationChoices, TaskCluster
 from task.tasks import submit_human_review_history
 from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from account.utils import has_project_permission
+from common.realtime import EventReplayMixin
+from task.utils import build_cluster_progress_snapshot
 
 
 
@@ -69,7 +73,7 @@ class AiChatWebsocket(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps(event['text']))
 
 
-class AlertConsumer(AsyncWebsocketConsumer):
+class AlertConsumer(EventReplayMixin, AsyncWebsocketConsumer):
     async def connect(self):
         me = self.scope['user']
         if not me.is_anonymous:
@@ -79,6 +83,7 @@ class AlertConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
             await self.accept()
+            await self.replay_missed_events(me.id)
         else:
             raise DenyConnection("Authentication failed") 
     
@@ -87,7 +92,53 @@ class AlertConsumer(AsyncWebsocketConsumer):
     
     async def task_message(self, event):
         await self.send(text_data=json.dumps(event['text']))
-    
-    
-    
-    
+
+
+class ClusterProgressConsumer(AsyncWebsocketConsumer):
+    """
+    Live labelling progress of a single cluster, for project owners and members who can view its tasks.
+    A snapshot is sent on connect and then whenever labels land (throttled by the publisher).
+    """
+    async def connect(self):
+        me = self.scope['user']
+        cluster_id = self.scope['url_route']['kwargs']['cluster_id']
+
+        snapshot = await self.get_snapshot_if_allowed(me, cluster_id)
+        if snapshot is None:
+            raise DenyConnection("You do not have access to this cluster")
+
+        self.cluster_group_name = f"cluster_progress_{cluster_id}"
+        await self.channel_layer.group_add(
+            self.cluster_group_name,
+            self.channel_name
+        )
+        await self.accept()
+        await self.send(text_data=json.dumps(snapshot, default=str))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'cluster_group_name'):
+            await self.channel_layer.group_discard(
+                self.cluster_group_name,
+                self.channel_name
+            )
+
+    async def cluster_progress(self, event):
+        await self.send(text_data=json.dumps(event['snapshot'], default=str))
+
+    @database_sync_to_async
+    def get_snapshot_if_allowed(self, user, cluster_id):
+        if user.is_anonymous:
+            return None
+        try:
+            cluster = TaskCluster.objects.select_related('project__created_by').get(id=cluster_id)
+        except TaskCluster.DoesNotExist:
+            return None
+
+        allowed = (
+            user.is_staff
+            or cluster.created_by_id == user.id
+            or has_project_permission(user, cluster.project, 'view_tasks')
+        )
+        if not allowed:
+            return None
+        return build_cluster_progress_snapshot(cluster)
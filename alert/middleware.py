@@ -1,29 +1,67 @@
-import token
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils import timezone
 from urllib.parse import parse_qs
 from rest_framework_simplejwt.tokens import UntypedToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from account.models import User, UserAPIKey
+from account.models import User
+from account.utils import get_verified_api_key
+
+
+def ws_auth_user_cache_key(user_id):
+    return f"ws_auth_user_fields_{user_id}"
+
+
+# the only user fields the consumers read, the cached entry holds nothing else (no password hash or profile)
+WS_AUTH_USER_FIELDS = ["id", "username", "is_staff", "is_reviewer", "is_active"]
+
+
+def _load_user(user_id):
+    """
+    Resolve a user for a websocket connection, cached for WS_AUTH_CACHE_TIMEOUT seconds.
+    Only WS_AUTH_USER_FIELDS are cached and the user is rebuilt from them, as an unsaved instance with just
+    those fields set. The entry is dropped whenever the user is saved (see account.signals).
+    """
+    cache_key = ws_auth_user_cache_key(user_id)
+    fields = cache.get(cache_key)
+    if fields is None:
+        fields = User.objects.filter(id=user_id).values(*WS_AUTH_USER_FIELDS).first()
+        if fields is None:
+            return AnonymousUser()
+        cache.set(cache_key, fields, timeout=settings.WS_AUTH_CACHE_TIMEOUT)
+    return User(**fields)
 
 
 @database_sync_to_async
 def get_user(user_id):
-    try:
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        return AnonymousUser()
+    return _load_user(user_id)
+
+
+@database_sync_to_async
+def get_user_from_token(token):
+    """
+    Resolve the user of an already validated access token. The token id (jti) is mapped to the user id
+    so repeated connects with the same token skip straight to the cached user.
+    """
+    jti = token.get("jti")
+    user_id = cache.get(f"ws_auth_token_{jti}") if jti else None
+    if user_id is None:
+        user_id = token["user_id"]
+        if jti:
+            expires_in = int(token["exp"] - timezone.now().timestamp())
+            cache.set(f"ws_auth_token_{jti}", user_id, timeout=max(min(expires_in, settings.WS_AUTH_CACHE_TIMEOUT), 1))
+    return _load_user(user_id)
+
 
 @database_sync_to_async
 def get_user_from_key(key):
-    try:
-        user_api_key = UserAPIKey.objects.get_from_key(key)
-        if user_api_key.has_expired or user_api_key.revoked:
-            return None
-        return user_api_key.user
-    except Exception:
+    api_key = get_verified_api_key(key)
+    if api_key is None:
         return None
+    return _load_user(api_key["user_id"])
 
 
 class JWTAuthMiddleWare(BaseMiddleware):
@@ -45,10 +83,8 @@ class JWTAuthMiddleWare(BaseMiddleware):
 
         if token:
             try:
-                user_id = UntypedToken(token=token)[
-                    "user_id"
-                ]  # decodinig the jwt token to get the userid
-                scope["user"] = await get_user(user_id)
+                validated_token = UntypedToken(token=token)  # decodinig the jwt token to get the userid
+                scope["user"] = await get_user_from_token(validated_token)
 
             except (InvalidToken, TokenError) as e:
                 scope["user"] = AnonymousUser()
@@ -99,10 +135,8 @@ class HybridAuthentication(BaseMiddleware):
         token = query_params.get('token', [None])[0]
         if token:
             try:
-                user_id = UntypedToken(token=token)[
-                    "user_id"
-                ]
-                scope["user"] = await get_user(user_id)
+                validated_token = UntypedToken(token=token)
+                scope["user"] = await get_user_from_token(validated_token)
 
             except (InvalidToken, TokenError) as e:
                 scope["user"] = AnonymousUser()
@@ -4,5 +4,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r"ws/task/$", consumers.AlertConsumer.as_asgi()),
-    re_path(r"ws/reviewer/$", consumers.AiChatWebsocket.as_asgi())
+    re_path(r"ws/reviewer/$", consumers.AiChatWebsocket.as_asgi()),
+    re_path(r"ws/cluster/(?P<cluster_id>\d+)/progress/$", consumers.ClusterProgressConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,3 +1,213 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from account.models import Project, ProjectMember, UserAPIKey
+from account.utils import create_api_key_for_uer, invalidate_verified_api_key, verified_api_key_cache_key
+from alert.consumers import AlertConsumer
+from alert.middleware import get_user_from_key, get_user_from_token
+from alert.routing import websocket_urlpatterns
+from common.realtime import get_missed_user_events, record_user_event, user_event_stream_key
+from task.choices import AnnotationMethodChoices
+from task.models import Task, TaskCluster, TaskLabel
+from task.utils import publish_cluster_progress
+
+User = get_user_model()
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    WS_EVENT_STREAM_MAXLEN=500,
+)
+class EventReplayTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='Testp@ssword123'
+        )
+        get_redis_connection("default").delete(user_event_stream_key(self.user.id))
+        self.event_ids = [
+            record_user_event(self.user.id, {"action": "task_status_changed", "id": i})
+            for i in range(3)
+        ]
+
+    def test_only_missed_events_are_returned(self):
+        """Test that events after the client's last event id are returned in order"""
+        events, truncated = get_missed_user_events(self.user.id, self.event_ids[0])
+
+        self.assertFalse(truncated)
+        self.assertEqual([event['id'] for event in events], [1, 2])
+        self.assertEqual([event['event_id'] for event in events], self.event_ids[1:])
+
+    def test_invalid_last_event_id_is_ignored(self):
+        """Test that a malformed last_event_id does not replay anything"""
+        events, truncated = get_missed_user_events(self.user.id, 'not-an-id')
+
+        self.assertEqual(events, [])
+        self.assertFalse(truncated)
+
+    @override_settings(WS_EVENT_STREAM_MAXLEN=3)
+    def test_trimmed_stream_is_reported(self):
+        """Test that a client whose position was trimmed away is told to resync"""
+        stale_event_id = self.event_ids[0]
+        get_redis_connection("default").xtrim(user_event_stream_key(self.user.id), maxlen=1, approximate=False)
+        for i in range(3, 5):
+            record_user_event(self.user.id, {"action": "task_status_changed", "id": i})
+
+        _, truncated = get_missed_user_events(self.user.id, stale_event_id)
+
+        self.assertTrue(truncated)
+
+    async def test_consumer_replays_on_connect(self):
+        """Test that the alert consumer replays missed events right after connecting"""
+        communicator = WebsocketCommunicator(
+            AlertConsumer.as_asgi(), f"/ws/task/?last_event_id={self.event_ids[1]}"
+        )
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['id'], 2)
+        self.assertEqual(message['event_id'], self.event_ids[2])
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.disconnect()
+
+    def tearDown(self):
+        get_redis_connection("default").delete(user_event_stream_key(self.user.id))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ClusterProgressConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='Testp@ssword123')
+        self.stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='Testp@ssword123')
+        self.reviewer = User.objects.create_user(username='reviewer', email='reviewer@example.com', password='Testp@ssword123', is_reviewer=True)
+
+        self.project = Project.objects.create(name='testproject', created_by=self.owner)
+        ProjectMember.objects.create(project=self.project, user=self.viewer, role='viewer')
+        self.cluster = TaskCluster.objects.create(
+            project=self.project,
+            labeller_per_item_count=2,
+            annotation_method=AnnotationMethodChoices.MANUAL,
+            created_by=self.owner
+        )
+        self.tasks = [
+            Task.objects.create(task_type='TEXT', data=f'item {i}', cluster=self.cluster, group=self.project, user=self.owner)
+            for i in range(2)
+        ]
+
+    def get_communicator(self, user):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/cluster/{self.cluster.id}/progress/"
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_owner_and_members_receive_snapshot_on_connect(self):
+        """Test that the project owner and project members get the current progress on connect"""
+        for user in (self.owner, self.viewer):
+            communicator = self.get_communicator(user)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual(snapshot['cluster_id'], self.cluster.id)
+            self.assertEqual(snapshot['total_tasks'], 2)
+            self.assertEqual(snapshot['required_labels'], 4)
+            await communicator.disconnect()
+
+    async def test_outsiders_are_rejected(self):
+        """Test that users without access to the project cannot watch the cluster"""
+        communicator = self.get_communicator(self.stranger)
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_published_progress_reaches_watchers(self):
+        """Test that a published snapshot reflects newly submitted labels"""
+        communicator = self.get_communicator(self.owner)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await sync_to_async(TaskLabel.objects.create)(task=self.tasks[0], label='positive', labeller=self.reviewer)
+        await sync_to_async(publish_cluster_progress)(self.cluster.id)
+
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['labelled_tasks'], 1)
+        self.assertEqual(snapshot['pending_tasks'], 1)
+        self.assertEqual(snapshot['total_labels'], 1)
+        await communicator.disconnect()
+
+
+class CachedWebsocketAuthTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='Testp@ssword123'
+        )
+        self.api_key, self.key = create_api_key_for_uer(self.user)
+        invalidate_verified_api_key(self.api_key.prefix)
+        cache.delete(f"ws_auth_user_fields_{self.user.id}")
+
+    def test_api_key_is_verified_once(self):
+        """Test that repeated connects with the same api key do not hit the database"""
+        self.assertEqual(async_to_sync(get_user_from_key)(self.key), self.user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(get_user_from_key)(self.key), self.user)
+
+    def test_wrong_secret_is_rejected(self):
+        """Test that a cached prefix does not let a different secret through"""
+        async_to_sync(get_user_from_key)(self.key)
+        prefix = self.key.split('.')[0]
+
+        self.assertIsNone(async_to_sync(get_user_from_key)(f"{prefix}.not-the-secret"))
+
+    def test_revoked_key_is_rejected_immediately(self):
+        """Test that revoking a key invalidates the cached verification"""
+        async_to_sync(get_user_from_key)(self.key)
+
+        self.api_key.revoked = True
+        self.api_key.save()
+
+        self.assertIsNone(async_to_sync(get_user_from_key)(self.key))
+
+    def test_key_revoked_by_another_process_is_rejected_immediately(self):
+        """Test that nothing outlives the shared redis entry, which is all another process can drop"""
+        async_to_sync(get_user_from_key)(self.key)
+
+        UserAPIKey.objects.filter(id=self.api_key.id).update(revoked=True)
+        cache.delete(verified_api_key_cache_key(self.api_key.prefix))
+
+        self.assertIsNone(async_to_sync(get_user_from_key)(self.key))
+
+    def test_token_user_is_cached(self):
+        """Test that repeated connects with the same access token reuse the resolved user"""
+        token = AccessToken.for_user(self.user)
+        self.assertEqual(async_to_sync(get_user_from_token)(token), self.user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(get_user_from_token)(token), self.user)
+
+    def test_only_the_needed_user_fields_are_cached(self):
+        """Test that the cached user holds no password hash or profile fields"""
+        user = async_to_sync(get_user_from_token)(AccessToken.for_user(self.user))
+
+        cached = cache.get(f"ws_auth_user_fields_{self.user.id}")
+        self.assertEqual(set(cached), {"id", "username", "is_staff", "is_reviewer", "is_active"})
+        self.assertNotIn(self.user.password, str(cached))
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual((user.id, user.is_staff, user.password), (self.user.id, False, ""))
+
+    def tearDown(self):
+        invalidate_verified_api_key(self.api_key.prefix)
+        cache.delete(f"ws_auth_user_fields_{self.user.id}")
@@ -1,4 +1,9 @@
+from django.http import HttpResponse
 from rest_framework import generics
+from rest_framework.permissions import IsAdminUser
+from account.utils import IsMetricsScraper
+from common.caching import get_cache_metrics
+from common.task_metrics import render_task_metrics
 from common.responses import SuccessResponse
 from common.utils import get_dp_cost_settings
 
@@ -6,6 +11,19 @@ from common.utils import get_dp_cost_settings
 class GetSystemSettingsView(generics.GenericAPIView):
     def get(self, request, *args, **kwargs):
         settings = get_dp_cost_settings()
-        
-        print(settings)
-        return SuccessResponse(message="System settings", data=settings)
\ No newline at end of file
+        return SuccessResponse(message="System settings", data=settings)
+
+
+class GetCacheMetricsView(generics.GenericAPIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return SuccessResponse(message="Cache metrics", data=get_cache_metrics())
+
+
+class CeleryTaskMetricsView(generics.GenericAPIView):
+    """Queue wait, runtime and outcomes of the Celery tasks in the Prometheus text format"""
+    permission_classes = [IsAdminUser | IsMetricsScraper]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_task_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,56 +1,395 @@
+import hashlib
+import logging
+import os
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
 from django.core.cache import cache
+from django_redis import get_redis_connection
+from django.http import HttpResponse, HttpResponseNotModified
 from rest_framework.response import Response
 
+logger = logging.getLogger(__name__)
+
+
+def cache_tag_key(tag: str) -> str:
+    return f"cache_tag_{tag}"
+
+
+def get_cache_tag_generations(tags) -> list:
+    """
+    Return the current generation of every tag, in the order given.
+
+    A tag that has never been seen (or was evicted) is started at the current time in milliseconds
+    rather than 0, so a reset generation can never line up with entries written under an older one.
+    """
+    tag_keys = [cache_tag_key(tag) for tag in tags]
+    generations = cache.get_many(tag_keys)
+
+    for tag_key in tag_keys:
+        if tag_key not in generations:
+            cache.add(tag_key, int(time.time() * 1000), timeout=None)
+            generations[tag_key] = cache.get(tag_key)
+    return [generations[tag_key] for tag_key in tag_keys]
+
+
+def invalidate_cache_tags(*tags: str):
+    """
+    Invalidate every response cached under any of the given tags.
+
+    Bumping the generation of a tag changes the key of every entry carrying it, so this is a single
+    INCR per tag instead of a keyspace scan; the orphaned entries simply age out through their TTL.
+    """
+    for tag in tags:
+        try:
+            cache.incr(cache_tag_key(tag))
+        except ValueError:
+            # the tag was never read, start it and still bump it in case a reader started it at the same time
+            cache.add(cache_tag_key(tag), int(time.time() * 1000), timeout=None)
+            cache.incr(cache_tag_key(tag))
+
+        for cache_prefix in {cache_prefix for pattern, cache_prefix in _tag_patterns if pattern.match(tag)}:
+            record_cache_metrics(cache_prefix, invalidations=1)
+
+
+CACHE_METRICS_PREFIXES_KEY = "cache_metrics_prefixes"
+CACHE_METRIC_FIELDS = ["hits", "stale_hits", "misses", "not_modified", "fill_time_ms", "fill_bytes", "invalidations"]
+
+# (compiled tag template, cache prefix) for every decorated view, used to attribute invalidations to prefixes
+_tag_patterns = []
+
+
+def cache_metrics_key(cache_prefix: str) -> str:
+    return f"cache_metrics_{cache_prefix}"
+
+
+def _register_cache_tags(cache_prefix, tags):
+    for tag in tags:
+        pattern = "".join(
+            re.escape(literal) + (".+" if field is not None else "")
+            for literal, field, _, _ in string.Formatter().parse(tag)
+        )
+        _tag_patterns.append((re.compile(f"^{pattern}$"), cache_prefix))
+
+
+def record_cache_metrics(cache_prefix: str, **counters):
+    """
+    Add to the counters of a cache prefix, e.g. record_cache_metrics("user_detail", hits=1).
+    Metrics are best effort and never fail the request that records them.
+    """
+    if not settings.CACHE_METRICS_ENABLED:
+        return
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        pipe.sadd(CACHE_METRICS_PREFIXES_KEY, cache_prefix)
+        for field, amount in counters.items():
+            if isinstance(amount, float):
+                pipe.hincrbyfloat(cache_metrics_key(cache_prefix), field, amount)
+            else:
+                pipe.hincrby(cache_metrics_key(cache_prefix), field, amount)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record cache metrics for {cache_prefix}: {e}")
+
+
+def get_cache_metrics() -> dict:
+    """
+    Return the recorded counters of every cache prefix along with derived hit ratio and average fill cost
+    """
+    redis = get_redis_connection("default")
+    prefixes = sorted(prefix.decode() for prefix in redis.smembers(CACHE_METRICS_PREFIXES_KEY))
+
+    pipe = redis.pipeline(transaction=False)
+    for cache_prefix in prefixes:
+        pipe.hgetall(cache_metrics_key(cache_prefix))
+
+    metrics = {}
+    for cache_prefix, raw_counters in zip(prefixes, pipe.execute()):
+        counters = {field: float(raw_counters.get(field.encode(), 0)) for field in CACHE_METRIC_FIELDS}
+        lookups = counters["hits"] + counters["stale_hits"] + counters["misses"]
+        metrics[cache_prefix] = {
+            **{field: round(value, 2) if field == "fill_time_ms" else int(value) for field, value in counters.items()},
+            "hit_ratio": round((counters["hits"] + counters["stale_hits"]) / lookups, 4) if lookups else None,
+            "avg_fill_time_ms": round(counters["fill_time_ms"] / counters["misses"], 2) if counters["misses"] else None,
+            "avg_fill_bytes": int(counters["fill_bytes"] / counters["misses"]) if counters["misses"] else None,
+        }
+    return metrics
+
+
+def reset_cache_metrics():
+    redis = get_redis_connection("default")
+    prefixes = redis.smembers(CACHE_METRICS_PREFIXES_KEY)
+    redis.delete(CACHE_METRICS_PREFIXES_KEY, *(cache_metrics_key(prefix.decode()) for prefix in prefixes))
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [value.strip() for value in if_none_match.split(",")]
+
+
+def _response_from_cache(request, cached_response):
+    """
+    Serve a cached entry as-is: the stored bytes, or a 304 when the client already holds them
+    """
+    if _etag_matches(request, cached_response["etag"]):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(
+            cached_response["content"],
+            status=cached_response["status"],
+            content_type=cached_response["content_type"],
+        )
+    response["ETag"] = cached_response["etag"]
+    return response
+
+
+def _serve_cached(cache_prefix, request, cached_response, stale=False):
+    response = _response_from_cache(request, cached_response)
+    counters = {"stale_hits" if stale else "hits": 1}
+    if response.status_code == 304:
+        counters["not_modified"] = 1
+    record_cache_metrics(cache_prefix, **counters)
+    return response
+
 
-def cache_response_decorator(cache_prefix: str, cache_timeout: int = 60 * 10, per_user:bool=False):
+def cache_response_decorator(cache_prefix: str, cache_timeout: int = 60 * 10, per_user:bool=False, tags=None, soft_timeout: int = None, lock_timeout: int = 10):
     """
     Decorator to cache the response of a view function.
-    
+
     This decorator caches API responses to improve performance by avoiding repeated database queries.
     The cache key is constructed using the provided prefix, HTTP method, and full request path.
     For user-specific caching, the user id of the currently logged in user can be included in the cache key.
 
+    Every entry carries one or more tags, and `invalidate_cache_tags` drops all entries carrying a tag.
+    Tags are format strings filled in with `user_id` and the view kwargs, e.g. "project_detail_{id}".
+    By default a cache is tagged "<cache_prefix>_{user_id}" when per_user is True and "<cache_prefix>" otherwise.
+
+    Only one request recomputes a missing entry at a time (single-flight, guarded by a short lock).
+    With a soft_timeout the entry is refreshed by one request once it is older than soft_timeout, while
+    concurrent requests keep being served the previous response, including right after an invalidation.
+    Without it, concurrent requests wait for the recomputed entry instead. cache_timeout stays the hard limit.
+
+    Entries are stored as the final rendered bytes with a content hash ETag, so a hit never touches the
+    serializers or the renderer, and a request whose If-None-Match matches is answered with 304 Not Modified.
+    Only JSON responses are cached; other formats such as the browsable API bypass the cache.
+
+    Hits, misses, fill time, payload size and invalidations are counted per cache_prefix, see `get_cache_metrics`
+    or the cache_metrics management command.
+
     Args:
         cache_prefix (str): The prefix to use for the cache key
-        cache_timeout (int): The timeout for the cache in seconds (default is 10 minutes) 
+        cache_timeout (int): The timeout for the cache in seconds (default is 10 minutes)
         per_user (bool): Whether to include the user ID in the cache key (default is False)
+        tags (list[str]): Tags to invalidate the cached responses by (default is based on the prefix)
+        soft_timeout (int): Age in seconds after which an entry is refreshed while stale copies are served (default is None, no stale serving)
+        lock_timeout (int): How long in seconds a recomputation may hold the lock (default is 10 seconds)
 
     Returns:
         The cached response if available, otherwise executes the view function and caches the response
 
     Example:
-        @cache_response_decorator('my_view', cache_timeout=300, per_user=True)
+        @cache_response_decorator('my_view', cache_timeout=300, per_user=True, soft_timeout=60)
         def get(self, request):
             # View logic here
             return Response(data)
-            
+
+        invalidate_cache_tags(f"my_view_{user.id}")
+
     Important: Ensure to write an invalidation signal or strategy for every cache created with this decorator
     """
+    if tags is None:
+        tags = [f"{cache_prefix}_{{user_id}}"] if per_user else [cache_prefix]
+    _register_cache_tags(cache_prefix, tags)
+
     def decorator(view_func):
         def wrapper(self, request, *args, **kwargs):
+            if request.method != "GET" or request.accepted_renderer.format != "json":
+                return view_func(self, request, *args, **kwargs)
+
             # if per_user is True, the cache key will contain the user id, this is intended for invalidating cache for a specific user
             # Note that changing the way the cache key is constructed might break the invalidation strategies for some cache patterns
             # If modifying the cache key structure is absolutely necessary, append any new components to the end rather than inserting them at the beginning or middle to maintain compatibility with existing cache invalidation patterns
-            cache_key = f"{cache_prefix}_{request.user.id}_{request.method}_{request.get_full_path()}" if per_user else f"{cache_prefix}_{request.method}_{request.get_full_path()}"
-
-            cached_response = cache.get(cache_key) if cache_key else None
-            if cached_response:
-                return Response(
-                    cached_response.get("data", {}),
-                    status=cached_response.get("status", 200),
-                    headers=cached_response.get("headers", {}),
-                )
-            response = view_func(self, request, *args, **kwargs)
-
-            if request.method == "GET" and response.status_code == 200:
-                cache_data = {
-                    "data": response.data,
-                    "status": response.status_code,
-                    "headers": dict(response.items()),
-                }
-                cache.set(cache_key, cache_data, cache_timeout)
+            base_cache_key = f"{cache_prefix}_{request.user.id}_{request.method}_{request.get_full_path()}" if per_user else f"{cache_prefix}_{request.method}_{request.get_full_path()}"
+
+            # the current generation of every tag is part of the key, so invalidating a tag moves readers to a fresh key
+            request_tags = [tag.format(user_id=request.user.id, **kwargs) for tag in tags]
+            generations = get_cache_tag_generations(request_tags)
+            cache_key = f"{base_cache_key}_v{'.'.join(str(generation) for generation in generations)}"
+            # the latest response regardless of generation, served while another request refreshes
+            stale_cache_key = f"{base_cache_key}_stale"
+
+            cached_response = cache.get(cache_key)
+            if cached_response and time.time() < cached_response.get("fresh_until", float("inf")):
+                return _serve_cached(cache_prefix, request, cached_response)
+
+            lock_key = f"{cache_key}_lock"
+            holds_lock = cache.add(lock_key, 1, lock_timeout)
+            if not holds_lock:
+                # another request is already recomputing this entry
+                stale_response = cached_response or (cache.get(stale_cache_key) if soft_timeout else None)
+                if stale_response:
+                    return _serve_cached(cache_prefix, request, stale_response, stale=True)
+
+                # nothing to serve meanwhile, wait for the recomputed entry and only compute it ourselves if it never shows up
+                deadline = time.time() + lock_timeout
+                while time.time() < deadline:
+                    cached_response = cache.get(cache_key)
+                    if cached_response:
+                        return _serve_cached(cache_prefix, request, cached_response)
+                    if not cache.get(lock_key):
+                        break
+                    time.sleep(0.05)
+
+            try:
+                fill_started_at = time.perf_counter()
+                response = view_func(self, request, *args, **kwargs)
+
+                if isinstance(response, Response) and response.status_code == 200:
+                    # render once here so every hit can be served from the stored bytes
+                    response.accepted_renderer = request.accepted_renderer
+                    response.accepted_media_type = request.accepted_media_type
+                    response.renderer_context = self.get_renderer_context()
+                    response.render()
+
+                    cache_data = {
+                        "content": response.content,
+                        "content_type": response["Content-Type"],
+                        "status": response.status_code,
+                        "etag": f'"{hashlib.sha256(response.content).hexdigest()[:32]}"',
+                    }
+                    if soft_timeout:
+                        cache_data["fresh_until"] = time.time() + soft_timeout
+                        cache.set(stale_cache_key, cache_data, cache_timeout)
+                    cache.set(cache_key, cache_data, cache_timeout)
+                    response["ETag"] = cache_data["etag"]
+                    record_cache_metrics(
+                        cache_prefix,
+                        misses=1,
+                        fill_time_ms=(time.perf_counter() - fill_started_at) * 1000,
+                        fill_bytes=len(response.content),
+                    )
+
+                    if _etag_matches(request, cache_data["etag"]):
+                        response = _response_from_cache(request, cache_data)
+            finally:
+                if holds_lock:
+                    cache.delete(lock_key)
             return response
 
         return wrapper
     return decorator
 
+
+class ReferenceCache:
+    """
+    Two-tier cache for near-static reference data (labeler domains, subscription plans, system settings...).
+
+    Reads are served from a small in-process LRU, falling back to redis and then to the loader.
+    `invalidate` drops the redis entry and publishes the key on a redis channel; every daphne and Celery
+    process runs a listener thread that drops its local copy when it hears about it. Local copies also
+    expire after REFERENCE_CACHE_LOCAL_TIMEOUT seconds, which bounds staleness if a message is ever missed.
+
+    Every key also has a cache tag generation that `invalidate` bumps. Redis entries are stored with the
+    generation read before the loader ran, so a loader that read the database before an invalidation
+    cannot leave its stale value behind for the whole timeout: the next reader sees an older generation
+    and loads again.
+    """
+
+    channel = "reference_cache_invalidation"
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        # bumped by every local drop, so a read that raced with one does not keep its value in memory
+        self._clears = 0
+
+    def _redis_key(self, key):
+        return f"reference_cache_{key}"
+
+    def _tag(self, key):
+        return f"reference_cache_{key}"
+
+    def _ensure_listener(self):
+        # prefork workers inherit the parent's object but not its thread, so each process starts its own listener
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._entries.clear()
+            threading.Thread(target=self._listen, name="reference-cache-listener", daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # anything published while we were not subscribed is lost, so start from a clean slate
+                self.clear_local()
+                for message in pubsub.listen():
+                    self.clear_local(message["data"].decode())
+            except Exception as e:
+                logger.warning(f"Reference cache listener disconnected, reconnecting: {e}")
+                time.sleep(1)
+
+    def clear_local(self, key=None):
+        with self._lock:
+            self._clears += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get(self, key, loader, timeout=60 * 60 * 24):
+        """
+        Return the value stored under `key`, calling `loader` to build it on a miss.
+        The value must be picklable as it is also kept in redis for `timeout` seconds.
+        """
+        self._ensure_listener()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self._entries.move_to_end(key)
+                return entry[0]
+            clears = self._clears
+
+        redis_key, tag_key = self._redis_key(key), cache_tag_key(self._tag(key))
+        stored = cache.get_many([redis_key, tag_key])
+        generation = stored.get(tag_key)
+        if generation is None:
+            generation = get_cache_tag_generations([self._tag(key)])[0]
+
+        if redis_key in stored and stored[redis_key][0] == generation:
+            value = stored[redis_key][1]
+        else:
+            # the generation is read before the loader runs, so an invalidation landing in between outdates this value
+            value = loader()
+            cache.set(redis_key, (generation, value), timeout)
+
+        with self._lock:
+            if self._clears != clears:
+                return value
+            self._entries[key] = (value, time.monotonic() + settings.REFERENCE_CACHE_LOCAL_TIMEOUT)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.REFERENCE_CACHE_LOCAL_SIZE:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys):
+        for key in keys:
+            invalidate_cache_tags(self._tag(key))
+            cache.delete(self._redis_key(key))
+            self.clear_local(key)
+            get_redis_connection("default").publish(self.channel, key)
+
+
+reference_cache = ReferenceCache()
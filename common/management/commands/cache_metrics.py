@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from common.caching import get_cache_metrics, reset_cache_metrics
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss, fill cost and invalidation counts for every cached response prefix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Clear the recorded metrics after printing them')
+
+    def handle(self, *args, **options):
+        metrics = get_cache_metrics()
+        if not metrics:
+            self.stdout.write(self.style.WARNING('No cache metrics recorded yet'))
+
+        header = f"{'prefix':<32}{'hits':>10}{'stale':>8}{'misses':>10}{'304s':>8}{'hit ratio':>11}{'avg fill ms':>13}{'avg bytes':>11}{'invalidations':>15}"
+        if metrics:
+            self.stdout.write(header)
+        for cache_prefix, counters in metrics.items():
+            hit_ratio = f"{counters['hit_ratio']:.1%}" if counters['hit_ratio'] is not None else '-'
+            self.stdout.write(
+                f"{cache_prefix:<32}{counters['hits']:>10}{counters['stale_hits']:>8}{counters['misses']:>10}"
+                f"{counters['not_modified']:>8}{hit_ratio:>11}{counters['avg_fill_time_ms'] or '-':>13}"
+                f"{counters['avg_fill_bytes'] or '-':>11}{counters['invalidations']:>15}"
+            )
+
+        if options['reset']:
+            reset_cache_metrics()
+            self.stdout.write(self.style.SUCCESS('Cache metrics cleared'))
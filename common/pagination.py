@@ -0,0 +1,16 @@
+from rest_framework.pagination import PageNumberPagination
+
+
+class StandardPagination(PageNumberPagination):
+    """Page number pagination, `?page=` and `?page_size=` up to max_page_size items"""
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def get_page_info(self):
+        """The count and the links of the current page, for responses that wrap the items in their own envelope"""
+        return {
+            "count": self.page.paginator.count,
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+        }
@@ -0,0 +1,271 @@
+"""
+Per-request profiling, reported in a structured log line and, to the client, in a Server-Timing header.
+
+RequestProfilingMiddleware profiles a request when it is sampled (REQUEST_PROFILING_SAMPLE_RATE) or asks for it
+with the REQUEST_PROFILING_HEADER header set to REQUEST_PROFILING_TOKEN. Only the requests asking for it get the
+Server-Timing header, sampled ones are just logged so their timings are not handed to any client. While a
+request is profiled, the time spent in and the number of:
+
+- database queries (an execute wrapper on every connection),
+- django.core.cache calls, with hits and misses of get/get_many,
+- DRF serializer validation and rendering,
+- outgoing HTTP requests made with requests or httpx
+
+are added up on a RequestProfile held in a context variable, so the work of a sync view run in a thread by
+the ASGI handler is attributed to the right request. Only the outermost call of a category is timed, e.g. a
+cache `get_or_set` is one call, but categories overlap: the queries a serializer makes count both as db and
+serializer time.
+"""
+import functools
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_current_profile = ContextVar("request_profile", default=None)
+_MISSING = object()
+# get and get_many are instrumented separately to count hits and misses
+CACHE_METHODS = ["set", "set_many", "add", "delete", "delete_many", "incr", "decr", "has_key", "touch", "get_or_set", "clear"]
+_installed = False
+
+
+class RequestProfile:
+    """Count and total duration of each category of work done while handling one request"""
+
+    CATEGORIES = ["db", "cache", "serializer", "http"]
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = dict.fromkeys(self.CATEGORIES, 0)
+        self.durations = dict.fromkeys(self.CATEGORIES, 0.0)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._depth = dict.fromkeys(self.CATEGORIES, 0)
+
+    @contextmanager
+    def measure(self, category):
+        self._depth[category] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[category] -= 1
+            # calls made from inside another call of the same category are part of its time
+            if not self._depth[category]:
+                self.counts[category] += 1
+                self.durations[category] += time.perf_counter() - started
+
+    def as_dict(self):
+        report = {
+            category: {"count": self.counts[category], "ms": round(self.durations[category] * 1000, 2)}
+            for category in self.CATEGORIES
+        }
+        report["cache"].update(hits=self.cache_hits, misses=self.cache_misses)
+        report["total_ms"] = round((time.perf_counter() - self.started) * 1000, 2)
+        return report
+
+    def server_timing(self):
+        descriptions = {
+            "db": f"{self.counts['db']} queries",
+            "cache": f"{self.cache_hits} hits / {self.cache_misses} misses",
+            "serializer": f"{self.counts['serializer']} calls",
+            "http": f"{self.counts['http']} requests",
+        }
+        metrics = [
+            f'{category};dur={self.durations[category] * 1000:.2f};desc="{descriptions[category]}"'
+            for category in self.CATEGORIES
+        ]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+def _profiled_call(category, function, *args, **kwargs):
+    """Call function, adding its time to the profile of the current request if it is being profiled"""
+    profile = _current_profile.get()
+    if profile is None:
+        return function(*args, **kwargs)
+    with profile.measure(category):
+        return function(*args, **kwargs)
+
+
+def _profile_query(execute, sql, params, many, context):
+    return _profiled_call("db", execute, sql, params, many, context)
+
+
+def install_query_profiler(connection, **kwargs):
+    if _profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_profile_query)
+
+
+def _instrument(owner, name, category):
+    original = getattr(owner, name)
+    if getattr(original, "_profiled", False):
+        return
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        return _profiled_call(category, original, *args, **kwargs)
+
+    wrapper._profiled = True
+    setattr(owner, name, wrapper)
+
+
+def _instrument_cache_get(backend):
+    original = backend.get
+    if getattr(original, "_profiled", False):
+        return
+
+    @functools.wraps(original)
+    def get(self, key, default=None, *args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return original(self, key, default, *args, **kwargs)
+        with profile.measure("cache"):
+            value = original(self, key, _MISSING, *args, **kwargs)
+        if value is _MISSING:
+            profile.cache_misses += 1
+            return default
+        profile.cache_hits += 1
+        return value
+
+    get._profiled = True
+    backend.get = get
+
+
+def _instrument_cache_get_many(backend):
+    original = backend.get_many
+    if getattr(original, "_profiled", False):
+        return
+
+    @functools.wraps(original)
+    def get_many(self, keys, *args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return original(self, keys, *args, **kwargs)
+        keys = list(keys)
+        with profile.measure("cache"):
+            values = original(self, keys, *args, **kwargs)
+        profile.cache_hits += len(values)
+        profile.cache_misses += len(keys) - len(values)
+        return values
+
+    get_many._profiled = True
+    backend.get_many = get_many
+
+
+def install_profilers():
+    """Instrument the database connections, cache backends, serializers and HTTP clients, once per process"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    connection_created.connect(install_query_profiler, dispatch_uid="request_profiling")
+    for connection in connections.all(initialized_only=True):
+        install_query_profiler(connection)
+
+    for backend in {type(caches[alias]) for alias in settings.CACHES}:
+        _instrument_cache_get(backend)
+        _instrument_cache_get_many(backend)
+        for name in CACHE_METHODS:
+            _instrument(backend, name, "cache")
+
+    from rest_framework import serializers
+    _instrument(serializers.BaseSerializer, "is_valid", "serializer")
+    # `data` is a property, the rendering happens in the getter
+    for serializer_class in [serializers.Serializer, serializers.ListSerializer]:
+        data = serializer_class.data
+        if not getattr(data.fget, "_profiled", False):
+            getter = data.fget
+
+            def profiled_data(self, getter=getter):
+                return _profiled_call("serializer", getter, self)
+
+            profiled_data._profiled = True
+            serializer_class.data = property(profiled_data)
+
+    import requests
+    _instrument(requests.Session, "send", "http")
+    try:
+        import httpx
+    except ImportError:
+        pass
+    else:
+        _instrument(httpx.Client, "send", "http")
+
+
+class RequestProfilingMiddleware:
+    """
+    Profile sampled requests and the ones asking for it, see the module docstring. Only used when
+    REQUEST_PROFILING_ENABLED is set; goes first in MIDDLEWARE so the total covers the other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        install_profilers()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def asks_for_profile(self, request):
+        token = settings.REQUEST_PROFILING_TOKEN
+        return bool(token) and request.headers.get(settings.REQUEST_PROFILING_HEADER) == token
+
+    def should_profile(self, request):
+        return self.asks_for_profile(request) or random.random() < settings.REQUEST_PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            # this thread's connections may predate the connection_created hook
+            for connection in connections.all(initialized_only=True):
+                install_query_profiler(connection)
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            # sync views run in a thread that inherits the context, their queries are attributed to the profile
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    def report(self, request, response, profile):
+        if self.asks_for_profile(request):
+            response["Server-Timing"] = profile.server_timing()
+        logger.info("request_profile " + json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            **profile.as_dict(),
+        }))
+        return response
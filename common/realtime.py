@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+STREAM_ID_PATTERN = re.compile(r"^\d+(-\d+)?$")
+
+
+class ChannelLayerPublisher:
+    """
+    Sends channel layer messages from synchronous code such as Celery workers.
+
+    `async_to_sync(channel_layer.group_send)` spins up a fresh event loop hop per message, and
+    channels_redis keeps its connection pools per event loop, so every message pays for a new
+    connection. The publisher instead owns one event loop running in a background thread for the
+    life of the process, which keeps the layer's pooled connections warm.
+
+    While a Celery task runs, messages are buffered from `task_prerun` and sent concurrently at
+    `task_postrun` (see `common.signals`), so a frame may reach clients only when the task ends. A long
+    task does not hold them that long: the buffer is sent early once it holds
+    CHANNEL_LAYER_BUFFER_MAX_MESSAGES messages, or when a message is sent after the oldest buffered one
+    has waited CHANNEL_LAYER_BUFFER_MAX_SECONDS. Messages sent with `immediate`, such as the progress
+    of the task itself, go out right away along with the ones buffered before them. Outside of a task
+    messages are sent straight away.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._loop = None
+        self._pid = None
+
+    def _get_loop(self):
+        # prefork workers inherit the parent's object but not its thread, so each process starts its own loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._loop.run_forever, name="channel-layer-publisher", daemon=True
+                ).start()
+            return self._loop
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    @property
+    def _pending(self):
+        return getattr(self._local, "pending", None)
+
+    def begin(self):
+        """Start buffering messages sent from the current thread, nested calls share the outer buffer"""
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        if self._pending is None:
+            self._local.pending = []
+
+    def group_send(self, group, message, immediate=False):
+        pending = self._pending
+        if pending is None:
+            self._run(get_channel_layer().group_send(group, message))
+            return
+        if not pending:
+            self._local.oldest = time.monotonic()
+        pending.append((group, message))
+        if (
+            immediate
+            or len(pending) >= settings.CHANNEL_LAYER_BUFFER_MAX_MESSAGES
+            or time.monotonic() - self._local.oldest >= settings.CHANNEL_LAYER_BUFFER_MAX_SECONDS
+        ):
+            self._local.pending = []
+            self._send(pending)
+
+    def flush(self):
+        """Send every buffered message once the outermost `begin` is closed"""
+        self._local.depth = max(getattr(self._local, "depth", 0) - 1, 0)
+        if self._local.depth:
+            return 0
+
+        pending, self._local.pending = self._pending, None
+        return self._send(pending)
+
+    def _send(self, pending):
+        if not pending:
+            return 0
+
+        async def send_all():
+            channel_layer = get_channel_layer()
+            results = await asyncio.gather(
+                *(channel_layer.group_send(group, message) for group, message in pending),
+                return_exceptions=True,
+            )
+            for (group, _), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to publish message to {group}: {result}")
+
+        self._run(send_all())
+        logger.debug(f"Published {len(pending)} buffered channel layer messages")
+        return len(pending)
+
+
+publisher = ChannelLayerPublisher()
+
+
+def user_event_stream_key(user_id):
+    return f"user_events_{user_id}"
+
+
+def _parse_stream_id(stream_id):
+    milliseconds, _, sequence = stream_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def record_user_event(user_id, payload):
+    """
+    Append an event to the per-user Redis stream and return its id.
+
+    Stream ids are monotonic, so a client that remembers the last id it saw can ask for
+    everything after it when reconnecting. The stream is trimmed to roughly WS_EVENT_STREAM_MAXLEN entries.
+    """
+    redis = get_redis_connection("default")
+    event_id = redis.xadd(
+        user_event_stream_key(user_id),
+        {"payload": json.dumps(payload, cls=DjangoJSONEncoder)},
+        maxlen=settings.WS_EVENT_STREAM_MAXLEN,
+        approximate=True,
+    )
+    return event_id.decode() if isinstance(event_id, bytes) else event_id
+
+
+def get_missed_user_events(user_id, last_event_id):
+    """
+    Return the events recorded for a user after `last_event_id`.
+
+    Returns a tuple of (events, truncated). `truncated` is True when the stream has already been
+    trimmed past the client's position, in which case the client should fall back to a full refresh.
+    """
+    if not last_event_id or not STREAM_ID_PATTERN.match(last_event_id):
+        return [], False
+
+    redis = get_redis_connection("default")
+    stream_key = user_event_stream_key(user_id)
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.xrange(stream_key, min="-", max="+", count=1)
+    pipe.xlen(stream_key)
+    pipe.xrange(stream_key, min=f"({last_event_id}", max="+", count=settings.WS_EVENT_STREAM_MAXLEN)
+    oldest, length, entries = pipe.execute()
+
+    truncated = False
+    if oldest and length >= settings.WS_EVENT_STREAM_MAXLEN:
+        oldest_id = oldest[0][0].decode()
+        truncated = _parse_stream_id(oldest_id) > _parse_stream_id(last_event_id)
+
+    events = []
+    for event_id, fields in entries:
+        try:
+            payload = json.loads(fields[b"payload"])
+        except (KeyError, ValueError):
+            logger.warning(f"Skipping malformed event {event_id} in {stream_key}")
+            continue
+        events.append({**payload, "event_id": event_id.decode()})
+
+    return events, truncated
+
+
+class EventReplayMixin:
+    """
+    Consumer mixin that replays the events a client missed while it was disconnected.
+
+    Clients pass the id of the last event they received as `last_event_id` in the query string.
+    Replay runs after the consumer joins its group, so an event may be delivered twice around the
+    reconnect; clients should drop events whose `event_id` is not newer than the last one they saw.
+    """
+
+    async def replay_missed_events(self, user_id):
+        query_params = parse_qs(self.scope["query_string"].decode())
+        last_event_id = query_params.get("last_event_id", [None])[0]
+        if not last_event_id:
+            return
+
+        events, truncated = await sync_to_async(get_missed_user_events)(user_id, last_event_id)
+        if truncated:
+            await self.task_message({"text": {"action": "replay_truncated"}})
+
+        for event in events:
+            await self.task_message({"text": event})
@@ -0,0 +1,25 @@
+from celery.signals import task_postrun, task_prerun
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from common.caching import invalidate_cache_tags
+from common.models import SystemSetting
+from common.realtime import publisher
+from common.utils import SYSTEM_SETTINGS_CACHE_TAG
+
+
+@task_prerun.connect
+def buffer_channel_layer_messages(**kwargs):
+    publisher.begin()
+
+
+@task_postrun.connect
+def flush_channel_layer_messages(**kwargs):
+    publisher.flush()
+
+
+@receiver([post_save, post_delete], sender=SystemSetting)
+def invalidate_system_settings_cache(sender, instance, **kwargs):
+    # bumping before the commit would let another process reload the old rows under the new version
+    transaction.on_commit(lambda: invalidate_cache_tags(SYSTEM_SETTINGS_CACHE_TAG))
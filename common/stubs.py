@@ -0,0 +1,53 @@
+"""
+Local stand-ins for the external services, used instead of Cohere and Stripe when STUB_EXTERNAL_SERVICES is set
+so a local server can be load tested (see the load_test command) without network calls or costs. Emails go to
+Django's in-memory backend in that case.
+
+Every call sleeps for STUB_EXTERNAL_SERVICES_LATENCY_MS to keep the timing of the real services, and the
+answers are derived from the input so repeated runs behave the same.
+"""
+import json
+import time
+import uuid
+import zlib
+from types import SimpleNamespace
+
+from django.conf import settings
+
+CLASSIFICATIONS = ["Safe", "Mildly Offensive", "Highly Offensive"]
+
+
+def _simulate_latency():
+    time.sleep(settings.STUB_EXTERNAL_SERVICES_LATENCY_MS / 1000)
+
+
+class StubCohereClient:
+    """Answers `chat` like the Cohere client, with a JSON block both ai_processor parsers accept"""
+
+    def chat(self, message="", chat_history=None, **kwargs):
+        _simulate_latency()
+        checksum = zlib.crc32(message.encode())
+        confidence = round(0.5 + (checksum % 50) / 100, 2)
+        classification = CLASSIFICATIONS[checksum % len(CLASSIFICATIONS)]
+        answer = {
+            "text": message,
+            "classification": classification,
+            "confidence": confidence,
+            "requires_human_review": confidence < 0.8,
+            "human_review": {"correction": None, "justification": None},
+            "learning_summary": "Stubbed feedback acknowledgement",
+            "updated_confidence": confidence,
+            "similar_examples": [],
+        }
+        text = f"```json\n{json.dumps(answer)}\n```"
+        # roughly a token per word, reported like the billed units of a Cohere response
+        prompt = " ".join([message, *(turn["message"] for turn in chat_history or [])])
+        billed_units = SimpleNamespace(input_tokens=len(prompt.split()), output_tokens=len(text.split()))
+        return SimpleNamespace(text=text, meta=SimpleNamespace(billed_units=billed_units))
+
+
+def create_stub_checkout_session(**kwargs):
+    """Stands in for stripe.checkout.Session.create"""
+    _simulate_latency()
+    session_id = f"cs_test_{uuid.uuid4().hex}"
+    return SimpleNamespace(id=session_id, url=f"https://checkout.stripe.com/c/pay/{session_id}")
@@ -0,0 +1,157 @@
+"""
+Queue wait, runtime and outcome metrics of every Celery task, per task name and queue.
+
+The publishing process stamps each message with the time it was sent and the queue it was routed to
+(before_task_publish). The worker then records:
+- the wait from that stamp to the start of the task (or from its ETA, for delayed tasks), on task_prerun
+- the runtime and successes, on task_postrun
+- retries and failures, on task_retry and task_failure
+
+Histograms and counters are kept in one Redis hash so the numbers of every worker process add up, and are
+rendered in the Prometheus text format by `render_task_metrics` (served at /api/v1/system/celery-metrics/).
+Like the cache metrics, recording is best effort and never fails the task.
+"""
+import logging
+import time
+from datetime import datetime
+
+from celery.signals import before_task_publish, task_failure, task_postrun, task_prerun, task_retry
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+TASK_METRICS_KEY = "celery_task_metrics"
+# upper bounds in seconds of the histogram buckets, the last bucket (+Inf) is implied
+BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+HISTOGRAMS = {
+    "celery_task_queue_wait_seconds": "Time between a task being published, or its ETA, and a worker starting it",
+    "celery_task_runtime_seconds": "Time a worker spent running a task",
+}
+OUTCOMES_METRIC = "celery_task_outcomes_total"
+OUTCOMES = ["success", "retry", "failure"]
+
+# start time of the tasks running in this process, by task id
+_started = {}
+
+
+def _field(metric, task_name, queue, suffix):
+    return f"{metric}|{task_name}|{queue}|{suffix}"
+
+
+def _record(task_name, queue, durations=None, outcome=None):
+    """Add {histogram: seconds} observations and an outcome of a task to the metrics"""
+    if not settings.TASK_METRICS_ENABLED:
+        return
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for metric, seconds in (durations or {}).items():
+            bucket = next((str(bound) for bound in BUCKETS if seconds <= bound), "+Inf")
+            pipe.hincrby(TASK_METRICS_KEY, _field(metric, task_name, queue, bucket), 1)
+            pipe.hincrbyfloat(TASK_METRICS_KEY, _field(metric, task_name, queue, "sum"), seconds)
+            pipe.hincrby(TASK_METRICS_KEY, _field(metric, task_name, queue, "count"), 1)
+        if outcome:
+            pipe.hincrby(TASK_METRICS_KEY, _field(OUTCOMES_METRIC, task_name, queue, outcome), 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record task metrics for {task_name}: {e}")
+
+
+def _header(request, name):
+    # a worker sets the message headers as attributes of the request, apply() keeps them in request.headers
+    return getattr(request, name, None) or (request.headers or {}).get(name)
+
+
+def _queue(task):
+    request = task.request
+    return _header(request, "queue_name") or (request.delivery_info or {}).get("routing_key") or "unknown"
+
+
+@before_task_publish.connect
+def stamp_published_task(sender=None, headers=None, declare=None, routing_key=None, **kwargs):
+    if headers is None:
+        return
+    headers["enqueued_at"] = time.time()
+    # the routing key of a queue is not necessarily its name, e.g. ai_queue is routed with "ai"
+    headers["queue_name"] = declare[0].name if declare else routing_key
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    now = time.time()
+    _started[task_id] = time.perf_counter()
+
+    enqueued_at = _header(task.request, "enqueued_at")
+    if enqueued_at is None:
+        # published before the instrumentation was deployed, or run eagerly
+        return
+    eta = task.request.eta
+    if eta:
+        enqueued_at = max(enqueued_at, datetime.fromisoformat(eta).timestamp() if isinstance(eta, str) else eta.timestamp())
+    _record(task.name, _queue(task), durations={"celery_task_queue_wait_seconds": max(now - enqueued_at, 0)})
+
+
+@task_postrun.connect
+def record_task_end(task_id=None, task=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    if started is None:
+        return
+    _record(
+        task.name, _queue(task),
+        durations={"celery_task_runtime_seconds": time.perf_counter() - started},
+        outcome="success" if state == "SUCCESS" else None,
+    )
+
+
+@task_retry.connect
+def record_task_retry(sender=None, request=None, **kwargs):
+    _record(sender.name, _queue(sender), outcome="retry")
+
+
+@task_failure.connect
+def record_task_failure(sender=None, **kwargs):
+    _record(sender.name, _queue(sender), outcome="failure")
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def get_task_metrics():
+    """{(metric, task name, queue): {suffix: value}} of everything recorded"""
+    metrics = {}
+    for field, value in get_redis_connection("default").hgetall(TASK_METRICS_KEY).items():
+        metric, task_name, queue, suffix = field.decode().split("|")
+        metrics.setdefault((metric, task_name, queue), {})[suffix] = float(value)
+    return metrics
+
+
+def render_task_metrics():
+    """The recorded metrics in the Prometheus text exposition format"""
+    metrics = get_task_metrics()
+    lines = []
+    for metric, description in HISTOGRAMS.items():
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+        for (name, task_name, queue), values in sorted(metrics.items()):
+            if name != metric:
+                continue
+            labels = f'task="{_escape(task_name)}",queue="{_escape(queue)}"'
+            cumulative = 0
+            for bound in [*map(str, BUCKETS), "+Inf"]:
+                cumulative += values.get(bound, 0)
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {int(cumulative)}')
+            lines.append(f"{metric}_sum{{{labels}}} {values.get('sum', 0)}")
+            lines.append(f"{metric}_count{{{labels}}} {int(values.get('count', 0))}")
+
+    lines += [f"# HELP {OUTCOMES_METRIC} Tasks that succeeded, were retried or failed", f"# TYPE {OUTCOMES_METRIC} counter"]
+    for (name, task_name, queue), values in sorted(metrics.items()):
+        if name != OUTCOMES_METRIC:
+            continue
+        for outcome in OUTCOMES:
+            if outcome in values:
+                lines.append(f'{OUTCOMES_METRIC}{{task="{_escape(task_name)}",queue="{_escape(queue)}",outcome="{outcome}"}} {int(values[outcome])}')
+    return "\n".join(lines) + "\n"
+
+
+def reset_task_metrics():
+    get_redis_connection("default").delete(TASK_METRICS_KEY)
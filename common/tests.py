@@ -1,3 +1,459 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from celery import shared_task
+from channels.layers import get_channel_layer
+from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from kombu import Queue
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework import serializers
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from common.caching import ReferenceCache, cache_response_decorator, get_cache_metrics, invalidate_cache_tags
+from common.models import SystemSetting
+from common.profiling import RequestProfilingMiddleware
+from common.realtime import publisher
+from common.task_metrics import get_task_metrics, render_task_metrics, reset_task_metrics, stamp_published_task
+from common.utils import get_dp_cost_settings
+from reviewer.models import LabelerDomain
+from subscription.models import SubscriptionPlan
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ChannelLayerPublisherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)("publisher_test", self.channel_name)
+
+    def receive(self):
+        return async_to_sync(self.channel_layer.receive)(self.channel_name)
+
+    def test_messages_are_sent_immediately_outside_a_task(self):
+        """Test that messages are not held back when nothing is buffering"""
+        publisher.group_send("publisher_test", {"type": "task.message", "text": {"n": 1}})
+
+        self.assertEqual(self.receive()["text"], {"n": 1})
+
+    def test_buffered_messages_are_sent_on_flush(self):
+        """Test that messages sent during a task are held until the outermost flush"""
+        publisher.begin()
+        publisher.begin()
+        for n in range(3):
+            publisher.group_send("publisher_test", {"type": "task.message", "text": {"n": n}})
+
+        # closing the nested scope keeps buffering
+        self.assertEqual(publisher.flush(), 0)
+        self.assertEqual(publisher.flush(), 3)
+
+        received = sorted(self.receive()["text"]["n"] for _ in range(3))
+        self.assertEqual(received, [0, 1, 2])
+
+    @override_settings(CHANNEL_LAYER_BUFFER_MAX_MESSAGES=2)
+    def test_full_buffer_is_sent_before_the_task_ends(self):
+        """Test that a long task does not hold more than CHANNEL_LAYER_BUFFER_MAX_MESSAGES messages"""
+        publisher.begin()
+        for n in range(3):
+            publisher.group_send("publisher_test", {"type": "task.message", "text": {"n": n}})
+
+        received = sorted(self.receive()["text"]["n"] for _ in range(2))
+        self.assertEqual(received, [0, 1])
+        self.assertEqual(publisher.flush(), 1)
+        self.assertEqual(self.receive()["text"], {"n": 2})
+
+    def test_immediate_messages_are_not_held(self):
+        """Test that an immediate message is sent right away, along with the messages buffered before it"""
+        publisher.begin()
+        publisher.group_send("publisher_test", {"type": "task.message", "text": {"n": 0}})
+        publisher.group_send("publisher_test", {"type": "task.message", "text": {"n": 1}}, immediate=True)
+
+        received = sorted(self.receive()["text"]["n"] for _ in range(2))
+        self.assertEqual(received, [0, 1])
+        self.assertEqual(publisher.flush(), 0)
+
+    @override_settings(CHANNEL_LAYER_BUFFER_MAX_SECONDS=1)
+    def test_old_buffer_is_sent_before_the_task_ends(self):
+        """Test that messages are sent once the oldest buffered one has waited CHANNEL_LAYER_BUFFER_MAX_SECONDS"""
+        publisher.begin()
+        # only the publisher's clock is replaced, its event loop keeps the real one
+        with patch("common.realtime.time") as clock:
+            clock.monotonic.side_effect = [100, 100, 100.5, 101]
+            for n in range(3):
+                publisher.group_send("publisher_test", {"type": "task.message", "text": {"n": n}})
+
+        received = sorted(self.receive()["text"]["n"] for _ in range(3))
+        self.assertEqual(received, [0, 1, 2])
+        self.assertEqual(publisher.flush(), 0)
+
+
+class CountingView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    calls = 0
+
+    @cache_response_decorator('caching_test', tags=['caching_test', 'caching_test_item_{item_id}'], soft_timeout=60)
+    def get(self, request, item_id):
+        CountingView.calls += 1
+        return Response({'item_id': item_id, 'calls': CountingView.calls})
+
+
+class CacheResponseDecoratorTestCase(SimpleTestCase):
+    def setUp(self):
+        CountingView.calls = 0
+        # start from fresh generations so entries left by earlier runs are never read
+        invalidate_cache_tags('caching_test', 'caching_test_item_1', 'caching_test_item_2')
+        self.factory = APIRequestFactory()
+
+    def get(self, item_id, **headers):
+        request = self.factory.get(f'/caching-test/{item_id}/', headers=headers)
+        request.user = AnonymousUser()
+        return CountingView.as_view()(request, item_id=item_id)
+
+    def calls(self, item_id):
+        return json.loads(self.get(item_id).content)['calls']
+
+    def test_responses_are_served_from_cache(self):
+        """Test that a repeated request does not run the view again"""
+        self.assertEqual(self.calls(1), 1)
+        self.assertEqual(self.calls(1), 1)
+
+    def test_invalidating_a_tag_only_drops_entries_carrying_it(self):
+        """Test that bumping a tag refreshes its entries and leaves other entries alone"""
+        self.get(1)
+        self.get(2)
+
+        invalidate_cache_tags('caching_test_item_1')
+
+        self.assertEqual(self.calls(1), 3)
+        self.assertEqual(self.calls(2), 2)
+
+    def test_shared_tag_drops_every_entry(self):
+        """Test that a tag shared by all entries invalidates all of them"""
+        self.get(1)
+        self.get(2)
+
+        invalidate_cache_tags('caching_test')
+
+        self.assertEqual(self.calls(1), 3)
+        self.assertEqual(self.calls(2), 4)
+
+    def test_stale_response_is_served_while_another_request_refreshes(self):
+        """Test that an invalidated entry keeps being served while its recomputation is in flight"""
+        self.get(1)
+        invalidate_cache_tags('caching_test_item_1')
+
+        # another request holds the recomputation lock
+        with patch.object(cache, 'add', return_value=False):
+            self.assertEqual(self.calls(1), 1)
+
+        self.assertEqual(self.calls(1), 2)
+
+    def test_matching_etag_is_answered_with_not_modified(self):
+        """Test that clients holding the current representation get a 304 and others get the cached bytes"""
+        first = self.get(1)
+        etag = first['ETag']
+        self.assertTrue(etag)
+
+        not_modified = self.get(1, **{'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(not_modified.content, b'')
+
+        cached = self.get(1, **{'If-None-Match': '"outdated"'})
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(CountingView.calls, 1)
+
+
+    def test_hits_misses_and_invalidations_are_counted(self):
+        """Test that cache usage is recorded against the view's cache prefix"""
+        before = get_cache_metrics().get('caching_test', {})
+
+        self.get(1)
+        self.get(1)
+        self.get(1, **{'If-None-Match': self.get(1)['ETag']})
+        invalidate_cache_tags('caching_test_item_1')
+
+        after = get_cache_metrics()['caching_test']
+        self.assertEqual(after['misses'] - before.get('misses', 0), 1)
+        self.assertEqual(after['hits'] - before.get('hits', 0), 3)
+        self.assertEqual(after['not_modified'] - before.get('not_modified', 0), 1)
+        self.assertEqual(after['invalidations'] - before.get('invalidations', 0), 1)
+        self.assertGreater(after['fill_bytes'], before.get('fill_bytes', 0))
+
+class ReferenceCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.reference_cache = ReferenceCache()
+        self.reference_cache.invalidate('reference_test')
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return {'loads': self.loads}
+
+    def test_value_is_loaded_once(self):
+        """Test that repeated reads are served from memory without calling the loader again"""
+        self.assertEqual(self.reference_cache.get('reference_test', self.load), {'loads': 1})
+
+        with patch.object(cache, 'get') as cache_get:
+            self.assertEqual(self.reference_cache.get('reference_test', self.load), {'loads': 1})
+        cache_get.assert_not_called()
+        self.assertEqual(self.loads, 1)
+
+    def test_other_processes_fill_from_redis(self):
+        """Test that a process with an empty local cache reuses the value stored in redis"""
+        self.reference_cache.get('reference_test', self.load)
+
+        self.assertEqual(ReferenceCache().get('reference_test', self.load), {'loads': 1})
+        self.assertEqual(self.loads, 1)
+
+    def test_invalidate_reloads_value(self):
+        """Test that invalidating a key drops both tiers"""
+        self.reference_cache.get('reference_test', self.load)
+
+        self.reference_cache.invalidate('reference_test')
+
+        self.assertEqual(self.reference_cache.get('reference_test', self.load), {'loads': 2})
+
+    def test_value_loaded_before_an_invalidation_is_not_kept(self):
+        """Test that a loader which read the database before an invalidation does not leave its value cached"""
+        def load_then_invalidate():
+            value = self.load()
+            self.reference_cache.invalidate('reference_test')
+            return value
+
+        self.assertEqual(self.reference_cache.get('reference_test', load_then_invalidate), {'loads': 1})
+
+        self.assertEqual(self.reference_cache.get('reference_test', self.load), {'loads': 2})
+        self.assertEqual(ReferenceCache().get('reference_test', self.load), {'loads': 2})
+
+    @override_settings(REFERENCE_CACHE_LOCAL_SIZE=1)
+    def test_local_cache_is_bounded(self):
+        """Test that the least recently used entry is evicted from memory"""
+        self.reference_cache.get('reference_test', self.load)
+        self.reference_cache.get('reference_test_other', self.load)
+
+        self.assertEqual(list(self.reference_cache._entries), ['reference_test_other'])
+
+    def tearDown(self):
+        self.reference_cache.invalidate('reference_test', 'reference_test_other')
+
+
+class SystemSettingsCacheTestCase(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.setting = SystemSetting.objects.create(key='base_cost', value='10')
+
+    def test_settings_are_read_once_per_version(self):
+        """Test that unchanged settings are served from memory with a single redis lookup"""
+        self.assertEqual(get_dp_cost_settings()['base_cost'], 10)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dp_cost_settings()['base_cost'], 10)
+
+    def test_committed_change_is_picked_up(self):
+        """Test that saving a setting reloads it on the next lookup"""
+        get_dp_cost_settings()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.setting.value = '25'
+            self.setting.save()
+
+        self.assertEqual(get_dp_cost_settings()['base_cost'], 25)
+
+    def test_change_made_elsewhere_is_picked_up(self):
+        """Test that a version bumped by another process invalidates the local copy"""
+        get_dp_cost_settings()
+        SystemSetting.objects.filter(pk=self.setting.pk).update(value='40')
+
+        invalidate_cache_tags('system_settings')
+
+        self.assertEqual(get_dp_cost_settings()['base_cost'], 40)
+
+
+class ReferenceDataInvalidationTestCase(TestCase):
+    def test_reference_cache_is_invalidated_after_commit(self):
+        """Test that saving a domain or plan only drops the cached rows once the transaction commits"""
+        with patch("common.caching.reference_cache.invalidate") as invalidate:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                LabelerDomain.objects.create(domain="reference invalidation")
+                SubscriptionPlan.objects.create(name="starter", monthly_fee=1, included_requests=1, cost_per_extra_request=0)
+                invalidate.assert_not_called()
+
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(sorted(call.args for call in invalidate.call_args_list), [("labeler_domains",), ("subscription_plans",)])
+
+
+class SystemSettingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SystemSetting
+        fields = ["key", "value"]
+
+
+def profiled_view(request):
+    cache.delete("profiling_test")
+    cache.get("profiling_test")
+    cache.set("profiling_test", 1)
+    cache.get("profiling_test")
+    return JsonResponse(SystemSettingSerializer(SystemSetting.objects.all(), many=True).data, safe=False)
+
+
+def server_timing(response):
+    """{metric: (duration, description)} of a Server-Timing header"""
+    metrics = {}
+    for metric in response["Server-Timing"].split(", "):
+        name, *params = metric.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        metrics[name] = (float(params["dur"]), params.get("desc", "").strip('"'))
+    return metrics
+
+
+@override_settings(REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_SAMPLE_RATE=0, REQUEST_PROFILING_TOKEN="secret")
+class RequestProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        SystemSetting.objects.create(key="input_text_cost", value="1")
+        self.factory = APIRequestFactory()
+
+    def test_requests_asking_for_it_are_profiled(self):
+        """Test that the queries, cache calls and serialization of a request are reported in Server-Timing"""
+        middleware = RequestProfilingMiddleware(profiled_view)
+
+        with self.assertLogs("common.profiling", level="INFO") as logs:
+            response = middleware(self.factory.get("/", HTTP_X_REQUEST_PROFILE="secret"))
+
+        metrics = server_timing(response)
+        self.assertEqual(metrics["db"][1], "1 queries")
+        self.assertEqual(metrics["cache"][1], "1 hits / 1 misses")
+        self.assertEqual(metrics["serializer"][1], "1 calls")
+        self.assertEqual(metrics["http"][1], "0 requests")
+        self.assertGreaterEqual(metrics["total"][0], metrics["db"][0])
+
+        report = json.loads(logs.output[0].split("request_profile ", 1)[1])
+        self.assertEqual(report["status"], 200)
+        self.assertEqual(report["db"]["count"], 1)
+        self.assertEqual(report["cache"]["count"], 4)
+
+    def test_other_requests_are_not_profiled(self):
+        """Test that requests that are not sampled and have no or a wrong token are left alone"""
+        middleware = RequestProfilingMiddleware(profiled_view)
+
+        self.assertNotIn("Server-Timing", middleware(self.factory.get("/")))
+        self.assertNotIn("Server-Timing", middleware(self.factory.get("/", HTTP_X_REQUEST_PROFILE="guess")))
+
+    @override_settings(REQUEST_PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_are_only_logged(self):
+        """Test that the timings of a sampled request are logged but not sent back to the client"""
+        middleware = RequestProfilingMiddleware(profiled_view)
+
+        with self.assertLogs("common.profiling", level="INFO") as logs:
+            response = middleware(self.factory.get("/"))
+
+        self.assertNotIn("Server-Timing", response)
+        report = json.loads(logs.output[0].split("request_profile ", 1)[1])
+        self.assertEqual(report["db"]["count"], 1)
+
+    def test_sync_views_are_profiled_on_the_asgi_path(self):
+        """Test that the work of a sync view run in a thread counts towards the async request's profile"""
+        async def get_response(request):
+            return await sync_to_async(profiled_view)(request)
+
+        middleware = RequestProfilingMiddleware(get_response)
+        response = async_to_sync(middleware)(self.factory.get("/", HTTP_X_REQUEST_PROFILE="secret"))
+
+        self.assertEqual(server_timing(response)["db"][1], "1 queries")
+
+    @override_settings(REQUEST_PROFILING_ENABLED=False)
+    def test_disabled_by_default(self):
+        """Test that the middleware takes itself out of the stack unless enabled"""
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilingMiddleware(profiled_view)
+
+
+@shared_task(bind=True, max_retries=1)
+def metrics_test_task(self, outcome="success"):
+    if outcome == "failure":
+        raise ValueError("failed on purpose")
+    if outcome == "retry" and not self.request.retries:
+        raise self.retry(countdown=0)
+    return outcome
+
+
+class CeleryTaskMetricsTestCase(TestCase):
+    def setUp(self):
+        reset_task_metrics()
+        self.addCleanup(reset_task_metrics)
+
+    def metrics(self, metric):
+        return get_task_metrics().get((metric, metrics_test_task.name, "ai_queue"), {})
+
+    def published_headers(self, seconds_ago):
+        """The headers a message routed to ai_queue gets when published seconds_ago"""
+        headers = {}
+        stamp_published_task(headers=headers, declare=[Queue("ai_queue", routing_key="ai")], routing_key="ai")
+        headers["enqueued_at"] -= seconds_ago
+        return headers
+
+    def test_queue_wait_and_runtime_are_recorded(self):
+        """Test that the wait since publishing and the runtime land in the histograms of the task's queue"""
+        metrics_test_task.apply(headers=self.published_headers(3))
+
+        wait = self.metrics("celery_task_queue_wait_seconds")
+        self.assertEqual(wait["5"], 1)
+        self.assertEqual(wait["count"], 1)
+        self.assertGreaterEqual(wait["sum"], 3)
+        self.assertEqual(self.metrics("celery_task_runtime_seconds")["count"], 1)
+        self.assertEqual(self.metrics("celery_task_outcomes_total"), {"success": 1})
+
+    def test_retries_and_failures_are_counted(self):
+        """Test that every outcome of a task is counted"""
+        metrics_test_task.apply(kwargs={"outcome": "failure"}, headers=self.published_headers(0))
+        metrics_test_task.apply(kwargs={"outcome": "retry"}, headers=self.published_headers(0))
+
+        self.assertEqual(self.metrics("celery_task_outcomes_total"), {"failure": 1, "retry": 1, "success": 1})
+
+    def test_tasks_published_without_a_stamp_only_record_their_runtime(self):
+        """Test that eager tasks, or ones published before the instrumentation, have no queue wait"""
+        metrics_test_task.apply()
+
+        self.assertNotIn(("celery_task_queue_wait_seconds", metrics_test_task.name, "unknown"), get_task_metrics())
+        self.assertIn(("celery_task_runtime_seconds", metrics_test_task.name, "unknown"), get_task_metrics())
+
+    def test_metrics_are_rendered_for_prometheus(self):
+        """Test that the histograms are cumulative and the endpoint is limited to admins and allowed addresses"""
+        metrics_test_task.apply(headers=self.published_headers(0.2))
+        metrics_test_task.apply(headers=self.published_headers(20))
+
+        rendered = render_task_metrics()
+        labels = f'task="{metrics_test_task.name}",queue="ai_queue"'
+        self.assertIn("# TYPE celery_task_queue_wait_seconds histogram", rendered)
+        self.assertIn(f'celery_task_queue_wait_seconds_bucket{{{labels},le="0.1"}} 0', rendered)
+        self.assertIn(f'celery_task_queue_wait_seconds_bucket{{{labels},le="0.25"}} 1', rendered)
+        self.assertIn(f'celery_task_queue_wait_seconds_bucket{{{labels},le="30"}} 2', rendered)
+        self.assertIn(f'celery_task_queue_wait_seconds_bucket{{{labels},le="+Inf"}} 2', rendered)
+        self.assertIn(f'celery_task_queue_wait_seconds_count{{{labels}}} 2', rendered)
+        self.assertIn(f'celery_task_outcomes_total{{{labels},outcome="success"}} 2', rendered)
+
+        with override_settings(METRICS_ALLOWED_IPS=["10.0.0.5"]):
+            response = APIClient(REMOTE_ADDR="10.0.0.5").get(reverse("celery-task-metrics"))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+            self.assertIn(f'celery_task_queue_wait_seconds_count{{{labels}}} 2', response.content.decode())
+
+            response = APIClient(REMOTE_ADDR="203.0.113.7").get(reverse("celery-task-metrics"))
+            self.assertIn(response.status_code, [401, 403])
+
+    def test_no_address_is_allowed_by_default(self):
+        """Test that the metrics are not public, not even to local requests, until addresses are allowed"""
+        self.assertEqual(settings.METRICS_ALLOWED_IPS, [])
+
+        response = APIClient(REMOTE_ADDR="127.0.0.1").get(reverse("celery-task-metrics"))
+        self.assertIn(response.status_code, [401, 403])
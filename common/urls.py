@@ -4,5 +4,7 @@ from django.urls import path
 from . import apis
 
 urlpatterns = [
-    path('cost-settings/', apis.GetSystemSettingsView.as_view(), name='get-system-settings')
+    path('cost-settings/', apis.GetSystemSettingsView.as_view(), name='get-system-settings'),
+    path('cache-metrics/', apis.GetCacheMetricsView.as_view(), name='get-cache-metrics'),
+    path('celery-metrics/', apis.CeleryTaskMetricsView.as_view(), name='celery-task-metrics'),
 ]
\ No newline at end of file
@@ -41,20 +41,28 @@ def get_duration(time_unit:str, time_period:int):
     
     return duration
 
+SYSTEM_SETTINGS_CACHE_TAG = "system_settings"
+
+# (version, settings) of the copy held by this process
 _settings_cache = None
 def get_dp_cost_settings():
     """
     Retrieve all system settings related to data point costs and cache them in memory.
 
-    This function uses a simple in-memory cache to avoid hitting the database
-    every time the settings are needed.
+    The in-memory copy is versioned: every call compares it against a version number kept in redis,
+    which the SystemSetting signals bump once a change is committed. That is a single GET per call, and
+    an edit made in the admin reaches every daphne and Celery process on their next lookup without a restart.
 
     Returns:
         dict: A dictionary of system settings keyed by their `key` values with integer values.
     """
+    from common.caching import get_cache_tag_generations
+
     global _settings_cache
-    if _settings_cache is None:
+    version = get_cache_tag_generations([SYSTEM_SETTINGS_CACHE_TAG])[0]
+    if _settings_cache is None or _settings_cache[0] != version:
         from django.apps import apps
         SystemSetting = apps.get_model("common", "SystemSetting")
-        _settings_cache = {s.key: int(s.value) for s in SystemSetting.objects.all()}
-    return _settings_cache
+        # the version is read before the rows, so a change landing in between only causes one extra reload
+        _settings_cache = (version, {s.key: int(s.value) for s in SystemSetting.objects.all()})
+    return _settings_cache[1]
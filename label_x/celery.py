@@ -44,6 +44,10 @@ celery_app.conf.result_backend = 'django-db'
 
 # Load task modules from all registered Django app configs.
 celery_app.autodiscover_tasks()
+# periodic tasks live in periodic_tasks.py modules, which the default discovery does not import
+celery_app.autodiscover_tasks(related_name='periodic_tasks')
+# cluster file ingestion queues task processing itself, so it cannot be imported from task.tasks
+celery_app.autodiscover_tasks(related_name='ingestion')
 
 # Configure Celery Beat schedule
 celery_app.conf.beat_schedule = {
@@ -78,6 +82,12 @@ celery_app.conf.task_routes = {
     'payment.tasks.process_pending_payments': {'queue': 'default'},
     'payment.tasks.process_single_payment': {'queue': 'default'},
     'task.utils.credit_labeller_monthly_payment': {'queue': 'default'},
+    'task.utils.flush_task_notifications': {'queue': 'default'},
+    'task.utils.publish_cluster_progress': {'queue': 'default'},
+    'task.consensus.recompute_cluster_consensus': {'queue': 'default'},
+    'task.ingestion.ingest_cluster_file': {'queue': 'default'},
+    'task.periodic_tasks.reconcile_project_daily_stats': {'queue': 'default'},
+    'task.periodic_tasks.reconcile_project_stats': {'queue': 'default'},
     'payment.tasks.test_task': {'queue': 'default'},
 }
 
@@ -82,6 +82,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "common.profiling.RequestProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -404,7 +405,71 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Task status notifications from the processing pipeline are coalesced per user over this window
+# and sent as a single batched websocket frame
+WS_NOTIFICATION_BATCH_WINDOW_MS = config("WS_NOTIFICATION_BATCH_WINDOW_MS", default=250, cast=int)
+# Number of events kept per user for replaying to reconnecting websocket clients
+WS_EVENT_STREAM_MAXLEN = config("WS_EVENT_STREAM_MAXLEN", default=500, cast=int)
+# Minimum interval between two progress snapshots pushed on a cluster_progress_{id} channel
+WS_CLUSTER_PROGRESS_THROTTLE_MS = config("WS_CLUSTER_PROGRESS_THROTTLE_MS", default=1000, cast=int)
+# Channel layer messages sent while a Celery task runs are held until the task ends (see common/realtime.py),
+# or sent early once this many are held or the oldest has waited this many seconds
+CHANNEL_LAYER_BUFFER_MAX_MESSAGES = config("CHANNEL_LAYER_BUFFER_MAX_MESSAGES", default=100, cast=int)
+CHANNEL_LAYER_BUFFER_MAX_SECONDS = config("CHANNEL_LAYER_BUFFER_MAX_SECONDS", default=1.0, cast=float)
+
+# How long websocket connects may reuse a resolved user or verified api key, in seconds
+WS_AUTH_CACHE_TIMEOUT = config("WS_AUTH_CACHE_TIMEOUT", default=60, cast=int)
+
 API_KEY_CUSTOM_HEADER = "HTTP_X_API_KEY"
+# Verified api keys are cached in redis for API_KEY_CACHE_TIMEOUT seconds
+API_KEY_CACHE_TIMEOUT = config("API_KEY_CACHE_TIMEOUT", default=300, cast=int)
+
+# How long the cached per-cluster label histograms live before being rebuilt from the database
+CLUSTER_LABEL_HISTOGRAM_TIMEOUT = config("CLUSTER_LABEL_HISTOGRAM_TIMEOUT", default=60 * 10, cast=int)
+
+# Labels submitted within this many seconds of each other are folded into one consensus recomputation
+CONSENSUS_UPDATE_DELAY_SECONDS = config("CONSENSUS_UPDATE_DELAY_SECONDS", default=30, cast=int)
+
+# Reviewers whose smoothed agreement with consensus in a cluster's domain is below this are assigned last
+LABELLER_QUALITY_MIN_SCORE = config("LABELLER_QUALITY_MIN_SCORE", default=0.5, cast=float)
+
+# Rows of an uploaded cluster file turned into tasks per transaction
+CLUSTER_INGESTION_BATCH_SIZE = config("CLUSTER_INGESTION_BATCH_SIZE", default=1000, cast=int)
+
+# Replace Cohere, Stripe and Resend with local stand-ins (see common/stubs.py), for load tests against a local server only
+STUB_EXTERNAL_SERVICES = config("STUB_EXTERNAL_SERVICES", default=False, cast=bool)
+# How long each stubbed call takes, to keep the timing of the real services
+STUB_EXTERNAL_SERVICES_LATENCY_MS = config("STUB_EXTERNAL_SERVICES_LATENCY_MS", default=300, cast=int)
+
+# Price of the LLM tokens in USD, used to estimate the cost of the recorded AI calls (see task/ai_telemetry.py)
+AI_COST_PER_MILLION_INPUT_TOKENS = config("AI_COST_PER_MILLION_INPUT_TOKENS", default=2.5, cast=float)
+AI_COST_PER_MILLION_OUTPUT_TOKENS = config("AI_COST_PER_MILLION_OUTPUT_TOKENS", default=10.0, cast=float)
+
+# Profile requests (see common/profiling.py): a REQUEST_PROFILING_SAMPLE_RATE share of them are logged, and those
+# sending the REQUEST_PROFILING_HEADER header with REQUEST_PROFILING_TOKEN are logged and get a Server-Timing header
+REQUEST_PROFILING_ENABLED = config("REQUEST_PROFILING_ENABLED", default=False, cast=bool)
+REQUEST_PROFILING_SAMPLE_RATE = config("REQUEST_PROFILING_SAMPLE_RATE", default=0.0, cast=float)
+REQUEST_PROFILING_HEADER = config("REQUEST_PROFILING_HEADER", default="X-Request-Profile")
+# header triggered profiling is off while this is empty
+REQUEST_PROFILING_TOKEN = config("REQUEST_PROFILING_TOKEN", default="")
+
+# Record queue wait, runtime and outcome histograms of every Celery task (see common/task_metrics.py)
+TASK_METRICS_ENABLED = config("TASK_METRICS_ENABLED", default=True, cast=bool)
+# Addresses allowed to scrape the Prometheus metrics endpoints without logging in, none by default. They are
+# matched against REMOTE_ADDR: behind a reverse proxy every request comes from the proxy, so never list its
+# address (e.g. 127.0.0.1 with a local nginx), list the scraper's address where it reaches the app directly
+METRICS_ALLOWED_IPS = config("METRICS_ALLOWED_IPS", default="", cast=Csv())
+
+# Record per-prefix hit/miss/fill metrics for cache_response_decorator (see the cache_metrics command)
+CACHE_METRICS_ENABLED = config("CACHE_METRICS_ENABLED", default=True, cast=bool)
+
+# Near-static reference data (labeler domains, plans, system settings) is kept in a per-process LRU of
+# REFERENCE_CACHE_LOCAL_SIZE entries for at most REFERENCE_CACHE_LOCAL_TIMEOUT seconds, on top of redis
+REFERENCE_CACHE_LOCAL_SIZE = config("REFERENCE_CACHE_LOCAL_SIZE", default=128, cast=int)
+REFERENCE_CACHE_LOCAL_TIMEOUT = config("REFERENCE_CACHE_LOCAL_TIMEOUT", default=300, cast=int)
+
+# Project owners and member roles used by the project permission checks are cached for this many seconds
+PROJECT_ACCESS_CACHE_TIMEOUT = config("PROJECT_ACCESS_CACHE_TIMEOUT", default=300, cast=int)
 STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY", default="")
 STRIPE_WEBHOOK_SECRET = config("STRIPE_WEBHOOK_SECRET", default="")
 STRIPE_CONNECT_WEBHOOK_SECRET = config("STRIPE_CONNECT_WEBHOOK_SECRET", default="")
@@ -453,6 +518,8 @@ PAYSTACK_PUBLIC_KEY = config("PAYSTACK_PUBLIC_KEY", default="")
 EXCHANGE_RATE_API_KEY = config("EXCHANGE_RATE_API_KEY", default="")
 
 CELERY_TIMEZONE = 'UTC'
+# How many days back the nightly reconcile recomputes the project daily rollups
+PROJECT_DAILY_STATS_RECONCILE_DAYS = config("PROJECT_DAILY_STATS_RECONCILE_DAYS", default=3, cast=int)
 # Django Celery Beat
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
@@ -468,6 +535,16 @@ CELERY_BEAT_SCHEDULE = {
             day_of_month="28-31,1-10"
         ),
    },
+   # recompute the project chart rollups of the last few days, shortly after midnight
+   "reconcile_project_daily_stats": {
+       "task": "task.periodic_tasks.reconcile_project_daily_stats",
+       "schedule": crontab(minute=15, hour=0),
+   },
+   # recount the cluster statistics of every project, after the daily rollups
+   "reconcile_project_stats": {
+       "task": "task.periodic_tasks.reconcile_project_stats",
+       "schedule": crontab(minute=45, hour=0),
+   },
 #    "process_pending_payments": { 
 #        "task": "payment.tasks.process_pending_payments",
 #        "schedule": crontab(minute="*"),
@@ -484,6 +561,9 @@ ANYMAIL = {
 }
 
 EMAIL_BACKEND = "anymail.backends.resend.EmailBackend"
+if STUB_EXTERNAL_SERVICES:
+    # load tests keep their emails in memory instead of sending them
+    EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="noreply@labelx.com")
 SERVER_EMAIL = DEFAULT_FROM_EMAIL
 
@@ -24,7 +24,8 @@ import json
 from django.db.models import F, Sum, Q
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from subscription.models import SubscriptionPlan, UserDataPoints, UserPaymentHistory, UserPaymentStatus, UserSubscription
+from subscription.utils import get_subscription_plan_by_stripe_price
+from subscription.models import UserDataPoints, UserPaymentHistory, UserPaymentStatus, UserSubscription
 from task.utils import calculate_static_labeller_monthly_earning, get_labeller_monthly_history, get_unreleased_reviewer_earnings
 from datetime import datetime, timedelta
 from django.utils import timezone
@@ -53,9 +54,7 @@ class StripeWebhookListener(generics.GenericAPIView):
             logger.error(f"Error fetching customer for email '{customer_email}' in Stripe webhook: {str(e)}", exc_info=True)
             customer = None
 
-        subscription_plan = SubscriptionPlan.objects.filter(
-            stripe_monthly_plan_id=price_id
-        ).first()
+        subscription_plan = get_subscription_plan_by_stripe_price(price_id)
         
         if not subscription_plan:
             logger.warning(f"Subscription plan not found for Stripe price ID: {price_id} at {datetime.now()}")
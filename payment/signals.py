@@ -1,9 +1,8 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
+from common.caching import invalidate_cache_tags
 from payment.models import Transaction
 
 @receiver([post_save, post_delete], sender=Transaction)
 def invalidate_transaction_cache(sender, instance, **kwargs):
-    print('invalidating transaction cache')
-    cache.delete_pattern(f"*user_transaction_history_{instance.user.id}*")
\ No newline at end of file
+    invalidate_cache_tags(f"user_transaction_history_{instance.user_id}")
\ No newline at end of file
@@ -3,7 +3,8 @@ from datetime import datetime
 from drf_spectacular.utils import extend_schema
 from rest_framework import generics
 from account.utils import IsAdminOrReadOnly
-from common.caching import cache_response_decorator
+from rest_framework.response import Response
+from common.caching import reference_cache
 from reviewer.models import LabelerDomain
 from .serializers import LabelerDomainSerializer
 
@@ -14,9 +15,13 @@ class GetLabelerDomains(generics.ListCreateAPIView):
     queryset = LabelerDomain.objects.all()
     permission_classes = [IsAdminOrReadOnly]
  
-    @cache_response_decorator('labeler_domains')
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        # domains rarely change, so the serialized list is kept in the reference cache
+        data = reference_cache.get(
+            "labeler_domains",
+            lambda: self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data,
+        )
+        return Response(data)
     
     @extend_schema(
         summary="Get all labeler domains",
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ReviewerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reviewer'
+
+    def ready(self) -> None:
+        from . import signals
@@ -1,8 +1,10 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
+from common.caching import reference_cache
 from .models import LabelerDomain
 
 @receiver([post_save, post_delete], sender=LabelerDomain)
 def invalidate_labeler_domain_cache(sender, instance, **kwargs):
-    cache.delete_pattern("*labeler_domains*")
\ No newline at end of file
+    # invalidating before the commit would let another process reload the old rows for the whole TTL
+    transaction.on_commit(lambda: reference_cache.invalidate("labeler_domains"))
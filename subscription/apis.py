@@ -11,7 +11,9 @@ import stripe.error
 
 from account.models import User
 from common.responses import ErrorResponse, SuccessResponse, format_first_error
+from common.stubs import create_stub_checkout_session
 from common.utils import get_request_origin
+from subscription.utils import get_subscription_plans
 
 from .models import (
     SubscriptionPlan,
@@ -72,8 +74,7 @@ class ListSubscriptionPlansView(generics.ListAPIView):
     )
     def get(self, request, *args, **kwargs):
         logger.info(f"User '{request.user.username if request.user.is_authenticated else 'Anonymous'}' fetched subscription plans at {datetime.now()}")
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer(get_subscription_plans(), many=True)
         return Response({"status": "success", "detail": serializer.data})
 
 
@@ -170,7 +171,8 @@ class InitializeStripeSubscription(generics.GenericAPIView):
 
         callback_url = f"{get_request_origin(request)}/client/overview"      
         try:
-            session = stripe.checkout.Session.create(
+            create_checkout_session = create_stub_checkout_session if settings.STUB_EXTERNAL_SERVICES else stripe.checkout.Session.create
+            session = create_checkout_session(
                 success_url=callback_url,
                 cancel_url=callback_url,
                 mode="subscription",
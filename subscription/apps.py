@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SubscriptionConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "subscription"
+
+    def ready(self):
+        from . import signals
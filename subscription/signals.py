@@ -0,0 +1,10 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from common.caching import reference_cache
+from .models import SubscriptionPlan
+
+@receiver([post_save, post_delete], sender=SubscriptionPlan)
+def invalidate_subscription_plan_cache(sender, instance, **kwargs):
+    # invalidating before the commit would let another process reload the old rows for the whole TTL
+    transaction.on_commit(lambda: reference_cache.invalidate("subscription_plans"))
@@ -0,0 +1,17 @@
+from common.caching import reference_cache
+from .models import SubscriptionPlan
+
+
+def get_subscription_plans():
+    """
+    Return every subscription plan, served from the reference cache.
+    The cache is dropped by the SubscriptionPlan signals whenever a plan changes.
+    """
+    return reference_cache.get("subscription_plans", lambda: list(SubscriptionPlan.objects.order_by("id")))
+
+
+def get_subscription_plan_by_stripe_price(price_id):
+    for plan in get_subscription_plans():
+        if price_id and plan.stripe_monthly_plan_id == price_id:
+            return plan
+    return None
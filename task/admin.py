@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ManualReviewSession, MultiChoiceOption, Task, TaskCluster, TaskLabel, UserReviewChatHistory
+from .models import AICallTelemetry, ManualReviewSession, MultiChoiceOption, Task, TaskCluster, TaskLabel, UserReviewChatHistory
 
 @admin.register(TaskCluster)
 class TaskClusterAdmin(admin.ModelAdmin):
@@ -58,3 +58,11 @@ class ManualReviewSessionAdmin(admin.ModelAdmin):
     def cluster_project(self, obj):
         return obj.cluster.project.name
     cluster_project.short_description = 'Project'
+
+@admin.register(AICallTelemetry)
+class AICallTelemetryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'operation', 'model', 'project', 'cluster', 'task', 'outcome', 'latency_ms', 'input_tokens', 'output_tokens', 'retries', 'created_at']
+    list_filter = ['operation', 'outcome', 'model', 'created_at', 'project']
+    search_fields = ['task__serial_no', 'cluster__name', 'project__name']
+    raw_id_fields = ['task', 'cluster', 'project']
+    readonly_fields = ['created_at']
@@ -1,6 +1,8 @@
 from email import message
 from pickle import FALSE
 import cohere
+import httpx
+from cohere.core import ApiError
 from decouple import config
 import os
 import json
@@ -10,9 +12,14 @@ import requests
 import logging
 
 from channels.layers import get_channel_layer
+from django.conf import settings
 from asgiref.sync import async_to_sync
 import re
 
+from common.stubs import StubCohereClient
+from task.ai_telemetry import CallTelemetry
+from task.choices import AICallOperationChoices, AICallOutcomeChoices
+
 # Set up logger
 logger = logging.getLogger(__name__)
 
@@ -20,10 +27,36 @@ logger = logging.getLogger(__name__)
 co = cohere.Client(
     api_key=config("CO_API_KEY", default=""), timeout=30  # Set timeout to 30 seconds
 )
+COHERE_MODEL = "command-a-03-2025"
+# the Cohere client raises httpx and ApiError exceptions, requests ones are kept for plain HTTP calls
+RETRYABLE_ERRORS = (httpx.TimeoutException, httpx.TransportError, ApiError, Timeout, RequestException)
+
+
+def is_retryable(error):
+    """Timeouts, connection errors, rate limits and server errors are retried, other API errors would fail again"""
+    if isinstance(error, ApiError):
+        return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+def get_ai_client():
+    """The Cohere client, or its local stand-in when external services are stubbed for load tests"""
+    if settings.STUB_EXTERNAL_SERVICES:
+        return StubCohereClient()
+    return co
 
 
-def submit_human_review(original_text, original_classification, correct_classification, justification, max_retries=3):
+def submit_human_review(original_text, original_classification, correct_classification, justification, max_retries=3, task=None):
+    telemetry = CallTelemetry(AICallOperationChoices.HUMAN_REVIEW, COHERE_MODEL, task)
+    try:
+        return _submit_human_review(original_text, original_classification, correct_classification, justification, max_retries, telemetry)
+    finally:
+        telemetry.save()
+
+
+def _submit_human_review(original_text, original_classification, correct_classification, justification, max_retries, telemetry):
     for attempt in range(max_retries):
+        telemetry.retries = attempt
         logger.info(f"Attempting text")
         feedback_prompt = f"""
         I'm providing human review feedback for a text classification you previously analyzed.
@@ -55,19 +88,20 @@ def submit_human_review(original_text, original_classification, correct_classifi
         ```
         """
         
-        # Submit the feedback to the model
-        response = co.chat(
-            model="command-a-03-2025",
-            message="Please process this human review feedback",
-            chat_history=[
-                {
-                    "role": "system", 
-                    "message": feedback_prompt
-                }
-            ],
-        )
-        
         try:
+            # Submit the feedback to the model
+            response = get_ai_client().chat(
+                model=COHERE_MODEL,
+                message="Please process this human review feedback",
+                chat_history=[
+                    {
+                        "role": "system", 
+                        "message": feedback_prompt
+                    }
+                ],
+            )
+            telemetry.record_response(response)
+
             # response_text = response.text.replace("```json", "").replace("```", "")
             json_match = re.search(
                 r"```json\s*(.*?)\s*```", response.text, re.DOTALL
@@ -75,26 +109,41 @@ def submit_human_review(original_text, original_classification, correct_classifi
             if json_match:
                 json_str = json_match.group(1)
                 print("processed ai response is", json_str)
-                return True, json.loads(json_str)
+                ai_response = json.loads(json_str)
+                telemetry.outcome = AICallOutcomeChoices.SUCCESS
+                return True, ai_response
             else:
+                telemetry.fail(AICallOutcomeChoices.NO_JSON, "No JSON found in response")
                 return False, "Error processing ai response"
-        except json.JSONDecodeError:
+        except json.JSONDecodeError as e:
             logger.error(f"Failed to parse response: {response.text}")
+            telemetry.fail(AICallOutcomeChoices.PARSE_FAILURE, e)
             return False, response.text
                
-        except (Timeout, RequestException) as e:
-            if attempt == max_retries - 1:  # Last attempt
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries - 1 or not is_retryable(e):  # Last attempt
                 logger.error(f"Cohere API final retry failed for human review submission: {str(e)}", exc_info=True)
+                telemetry.fail(AICallOutcomeChoices.ERROR, e)
                 return False, str(e)
             logger.warning(f"Cohere API attempt {attempt + 1} failed for human review, retrying... Error: {str(e)}")
             time.sleep(2**attempt)  # Exponential backoff            
         except Exception as e:
             logger.error(f"Unexpected error in human review submission: {str(e)}", exc_info=True)
+            telemetry.fail(AICallOutcomeChoices.ERROR, e)
             return False, str(e)
 
 
-def text_classification(text, max_retries=3):
+def text_classification(text, max_retries=3, task=None):
+    telemetry = CallTelemetry(AICallOperationChoices.CLASSIFICATION, COHERE_MODEL, task)
+    try:
+        return _text_classification(text, max_retries, telemetry)
+    finally:
+        telemetry.save()
+
+
+def _text_classification(text, max_retries, telemetry):
     for attempt in range(max_retries):
+        telemetry.retries = attempt
         logger.info(
             f"Attempting text classification, attempt {attempt + 1} of {max_retries}"
         )
@@ -135,8 +184,8 @@ def text_classification(text, max_retries=3):
             """
 
             # Define the conversation with system configuration for classification
-            response = co.chat(
-                model="command-a-03-2025",  # Using standard model instead of command-a-03-2025
+            response = get_ai_client().chat(
+                model=COHERE_MODEL,
                 message=text,
                 chat_history=[
                     {
@@ -145,6 +194,7 @@ def text_classification(text, max_retries=3):
                     }
                 ],
             )
+            telemetry.record_response(response)
 
             try:
                 # response_text = response.text.replace("```json", "").replace("```", "")
@@ -153,8 +203,11 @@ def text_classification(text, max_retries=3):
                 )
                 if json_match:
                     json_str = json_match.group(1)
-                    return json.loads(json_str)
+                    classification = json.loads(json_str)
+                    telemetry.outcome = AICallOutcomeChoices.SUCCESS
+                    return classification
                 else:
+                    telemetry.fail(AICallOutcomeChoices.NO_JSON, "No JSON found in response")
                     return {
                         "label": "Normal",
                         "confidence_score": 0.0,
@@ -164,18 +217,20 @@ def text_classification(text, max_retries=3):
                         "requires_human_review": True
                     }
 
-            except json.JSONDecodeError:
+            except json.JSONDecodeError as e:
                 logger.error(f"Failed to parse response: {response.text}")
+                telemetry.fail(AICallOutcomeChoices.PARSE_FAILURE, e)
                 raise
 
-        except (Timeout, RequestException) as e:
-            if attempt == max_retries - 1:  # Last attempt
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries - 1 or not is_retryable(e):  # Last attempt
                 logger.error(f"Cohere API final retry failed for text classification: {str(e)}", exc_info=True)
+                telemetry.fail(AICallOutcomeChoices.ERROR, e)
                 return {
                     "label": "Normal",
                     "confidence_score": 0.0,
                     "need_human_intervention": True,
-                    "justification": f"Error: Connection timeout after {max_retries} attempts",
+                    "justification": f"Error: Cohere API call failed after {attempt + 1} attempts: {str(e)}",
                     "classification": None,
                     "requires_human_review": True
 
@@ -185,6 +240,8 @@ def text_classification(text, max_retries=3):
 
         except Exception as e:
             logger.error(f"Unexpected error in text classification: {str(e)}", exc_info=True)
+            if telemetry.outcome != AICallOutcomeChoices.PARSE_FAILURE:
+                telemetry.fail(AICallOutcomeChoices.ERROR, e)
             return {
                 "label": "Normal",
                 "confidence_score": 0.0,
@@ -0,0 +1,120 @@
+"""
+Telemetry of the LLM calls made by `task.ai_processor`.
+
+Every call to `text_classification` or `submit_human_review` is measured by a CallTelemetry: the model, the
+wall time including retries and their backoff, the billed input/output tokens Cohere reports in
+`response.meta.billed_units`, the number of retries and whether the JSON in the answer could be parsed.
+Each call is stored as an AICallTelemetry row, attributed to the task's cluster and project, and logged as
+a JSON line "ai_call {...}". Like the other metrics, recording is best effort and never fails the call.
+
+`get_ai_usage` adds the rows up per project or cluster, with an estimated cost from the AI_COST_PER_MILLION_*
+settings (see the ai_usage command).
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Q, Sum
+
+from task.choices import AICallOutcomeChoices
+from task.models import AICallTelemetry
+
+logger = logging.getLogger(__name__)
+
+
+class CallTelemetry:
+    """Measures one logical LLM call, retries included, and saves it when the caller is done"""
+
+    def __init__(self, operation, model, task=None):
+        self.operation = operation
+        self.model = model
+        self.task = task
+        self.started = time.perf_counter()
+        self.retries = 0
+        self.input_tokens = None
+        self.output_tokens = None
+        # until an outcome is set, the call is assumed to have failed
+        self.outcome = AICallOutcomeChoices.ERROR
+        self.error = None
+
+    def record_response(self, response):
+        """Keep the billed tokens of a response, when the client reports them"""
+        billed_units = getattr(getattr(response, "meta", None), "billed_units", None)
+        if billed_units is None:
+            return
+        self.input_tokens = int(billed_units.input_tokens) if billed_units.input_tokens is not None else None
+        self.output_tokens = int(billed_units.output_tokens) if billed_units.output_tokens is not None else None
+
+    def fail(self, outcome, error):
+        self.outcome = outcome
+        self.error = str(error)
+
+    def save(self):
+        latency_ms = round((time.perf_counter() - self.started) * 1000, 2)
+        task = self.task
+        record = {
+            "operation": str(self.operation),
+            "model": self.model,
+            "task_id": task.id if task else None,
+            "cluster_id": task.cluster_id if task else None,
+            "project_id": task.group_id if task else None,
+            "latency_ms": latency_ms,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "retries": self.retries,
+            # the Cohere client is not guarded by a circuit breaker yet
+            "breaker_state": None,
+            "outcome": str(self.outcome),
+        }
+        logger.info("ai_call " + json.dumps(record))
+        try:
+            AICallTelemetry.objects.create(**record, error=self.error)
+        except Exception as e:
+            logger.warning(f"Failed to record ai call telemetry: {e}")
+
+
+def get_ai_usage(group_by="project", calls=None):
+    """
+    Calls, outcomes, retries, latency, tokens and estimated cost of the AI calls, per project or cluster.
+    `calls` narrows down the AICallTelemetry rows that are added up.
+    """
+    if group_by not in ("project", "cluster"):
+        raise ValueError("group_by must be 'project' or 'cluster'")
+    calls = AICallTelemetry.objects.all() if calls is None else calls
+
+    usage = []
+    rows = (
+        calls.values(f"{group_by}_id", f"{group_by}__name")
+        .annotate(
+            calls=Count("id"),
+            failed_calls=Count("id", filter=~Q(outcome=AICallOutcomeChoices.SUCCESS)),
+            parse_failures=Count("id", filter=Q(outcome__in=[AICallOutcomeChoices.NO_JSON, AICallOutcomeChoices.PARSE_FAILURE])),
+            retries=Sum("retries"),
+            avg_latency_ms=Avg("latency_ms"),
+            max_latency_ms=Max("latency_ms"),
+            input_tokens=Sum("input_tokens"),
+            output_tokens=Sum("output_tokens"),
+        )
+        .order_by(f"{group_by}_id")
+    )
+    for row in rows:
+        input_tokens, output_tokens = row["input_tokens"] or 0, row["output_tokens"] or 0
+        usage.append({
+            "id": row[f"{group_by}_id"],
+            "name": row[f"{group_by}__name"],
+            "calls": row["calls"],
+            "failed_calls": row["failed_calls"],
+            "parse_failures": row["parse_failures"],
+            "retries": row["retries"] or 0,
+            "avg_latency_ms": round(row["avg_latency_ms"], 2),
+            "max_latency_ms": round(row["max_latency_ms"], 2),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "estimated_cost": round(
+                input_tokens * settings.AI_COST_PER_MILLION_INPUT_TOKENS / 1_000_000
+                + output_tokens * settings.AI_COST_PER_MILLION_OUTPUT_TOKENS / 1_000_000,
+                4,
+            ),
+        })
+    return usage
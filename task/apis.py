@@ -1,7 +1,6 @@
-from django.core.cache import cache
 from django.http import HttpResponse
 from django.shortcuts  import get_object_or_404
-from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiExample
+from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiResponse, OpenApiExample
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework import status
@@ -9,21 +8,26 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 import logging
 from datetime import datetime
 from rest_framework.views import APIView
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework_api_key.permissions import HasAPIKey
 from account.choices import ProjectStatusChoices
 from account.models import Project, User
-from common.caching import cache_response_decorator
+from common.caching import cache_response_decorator, invalidate_cache_tags
+from common.pagination import StandardPagination
 from common.responses import ErrorResponse, SuccessResponse, format_first_error
 from common.utils import is_valid_url
 from subscription.models import UserDataPoints
 from task.choices import AnnotationMethodChoices, ManualReviewSessionStatusChoices, TaskClusterStatusChoices, TaskInputTypeChoices, TaskTypeChoices
-from task.utils import assign_reviewers_to_cluster, calculate_labelling_required_data_points, calculate_required_data_points, credit_labeller_monthly_payment, dispatch_task_message, push_realtime_update
-from .models import ManualReviewSession, MultiChoiceOption, Task, TaskCluster, UserReviewChatHistory, TaskLabel
-from .serializers import AcceptClusterIdSerializer, AssignedTaskSerializer, FullTaskSerializer, GetAndValidateReviewersSerializer, ListReviewersWithClustersSerializer, MultiChoiceOptionSerializer, RequestAdditionalLabellersSerializer, TaskAnnotationSerializer, TaskClusterCreateSerializer, TaskClusterDetailSerializer, TaskClusterListSerializer, TaskIdSerializer, TaskSerializer, TaskReviewSerializer, AssignTaskSerializer
+from task.utils import assign_reviewers_to_cluster, calculate_labelling_required_data_points, calculate_required_data_points, credit_labeller_monthly_payment, dispatch_task_message, get_cluster_label_histogram, push_realtime_update, schedule_cluster_progress_update
+from .models import ClusterConsensus, ClusterIngestionJob, ManualReviewSession, MultiChoiceOption, Task, TaskCluster, UserReviewChatHistory, TaskLabel
+from .serializers import AcceptClusterIdSerializer, AssignedTaskSerializer, FullTaskSerializer, GetAndValidateReviewersSerializer, ListReviewersWithClustersSerializer, MultiChoiceOptionSerializer, RequestAdditionalLabellersSerializer, TaskAnnotationSerializer, ClusterIngestionJobSerializer, TaskClusterCreateSerializer, TaskClusterDetailSerializer, TaskClusterIngestSerializer, TaskClusterListSerializer, TaskIdSerializer, TaskSerializer, TaskReviewSerializer, AssignTaskSerializer
 from .tasks import process_task, provide_feedback_to_ai_model
+from .consensus import schedule_cluster_consensus_update
+from .ingestion import ingest_cluster_file, store_upload
 
 # import custom permissions
-from account.utils import HasUserAPIKey, IsAdminUser, IsReviewer
+from account.utils import HasUserAPIKey, IsAdminUser, IsReviewer, has_project_permission
+from django.db import transaction
 from django.db.models import Q, Count, Avg, F, Sum
 import csv
 
@@ -47,16 +51,17 @@ class ExportClusterToCsvView(generics.GenericAPIView):
         cluster_id = kwargs.get('cluster_id')
         
         try:
-            cluster = TaskCluster.objects.get(id=cluster_id)
+            cluster = TaskCluster.objects.select_related('project').get(id=cluster_id)
         except TaskCluster.DoesNotExist:
             logger.warning(f"Cluster export attempted for non-existent cluster {cluster_id} by user '{request.user.username}' at {datetime.now()}")
             return ErrorResponse(message="Cluster not found", status=status.HTTP_404_NOT_FOUND)
         
-        if cluster.created_by != request.user:
+        if cluster.created_by_id != request.user.id:
             logger.warning(f"Unauthorized cluster export attempt for cluster {cluster_id} by user '{request.user.username}' at {datetime.now()}")
             return ErrorResponse(message="You are not authorized to export this data", status=status.HTTP_403_FORBIDDEN)
         
-        labels = TaskLabel.objects.filter(task__cluster=cluster)
+        # the task and labeller of every row come with the label, in chunks so large clusters are not loaded at once
+        labels = TaskLabel.objects.filter(task__cluster=cluster).select_related('task', 'labeller').order_by('id').iterator(chunk_size=2000)
         
         response = HttpResponse(content_type='text/csv')
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -431,7 +436,7 @@ class GetAvailableClusters(generics.ListAPIView):
     def get_queryset(self):
         user_domains = self.request.user.domains.all()
  
-        return TaskCluster.objects.annotate(reviewer_count=Count("assigned_reviewers")).filter(
+        return TaskCluster.objects.prefetch_related("choices", "assigned_reviewers").annotate(reviewer_count=Count("assigned_reviewers")).filter(
             ~Q(status=TaskClusterStatusChoices.COMPLETED) & 
             ~Q(annotation_method=AnnotationMethodChoices.AI_AUTOMATED) &
             Q(reviewer_count__lt=F("labeller_per_item_count"))
@@ -442,7 +447,7 @@ class GetAvailableClusters(generics.ListAPIView):
         summary="Get all the clusters that are available for assignment",
         description="Ideal for when a reviewer is looking for clusters to assign to themselves"
     )
-    # @cache_response_decorator('available_clusters', per_user=True)
+    # @cache_response_decorator('available_clusters', per_user=True, tags=['available_clusters', 'available_clusters_{user_id}'])
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
 
@@ -514,6 +519,69 @@ class TaskClusterCreateView(generics.GenericAPIView):
         
     
     
+class TaskClusterIngestView(generics.GenericAPIView):
+    """
+    Create a cluster whose tasks are uploaded as a JSONL or CSV file instead of a JSON list,
+    the file is turned into tasks in the background by `ingest_cluster_file`
+    """
+    serializer_class = TaskClusterIngestSerializer
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    @extend_schema(
+        summary="Create a cluster from a JSONL or CSV file of tasks",
+        description="Takes the same cluster settings as the cluster creation endpoint along with a `file` of tasks, one per line in JSONL (like dataset.jsonl) or per row in CSV. Text tasks are read from the `data` (or `text`) key, file tasks from `file_name`, `file_type`, `file_url` and `file_size_bytes`. The tasks are created in the background and each one is charged the data points of a cluster item as it is created, the job fails when the balance runs out. Follow the returned job through the job status endpoint or the `cluster_ingestion_progress` websocket messages.",
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return ErrorResponse(message=format_first_error(serializer.errors, False))
+
+        file = serializer.validated_data['file']
+        file_format = serializer.validated_data['file_format']
+        labelling_choices = serializer.validated_data.get('labelling_choices', [])
+
+        # the tasks are charged as they are created from the file, this only turns away uploads that cannot pay for any
+        user_data_point, created = UserDataPoints.objects.get_or_create(user=request.user)
+        required_data_points = calculate_labelling_required_data_points(serializer.validated_data)
+        if user_data_point.data_points_balance < required_data_points:
+            return ErrorResponse(message="You do not have enough data points to satisfy this request")
+
+        with transaction.atomic():
+            cluster = serializer.save(created_by=request.user)
+            if cluster.input_type == TaskInputTypeChoices.MULTIPLE_CHOICE:
+                MultiChoiceOption.objects.bulk_create([MultiChoiceOption(cluster=cluster, option_text=choice) for choice in labelling_choices])
+            job = ClusterIngestionJob.objects.create(cluster=cluster, created_by=request.user, file_format=file_format)
+            store_upload(job, file)
+            transaction.on_commit(lambda: ingest_cluster_file.delay(job.id))
+
+        logger.info(f"User '{request.user.username}' uploaded {file.size} bytes of tasks for cluster {cluster.id}, ingestion job {job.id}")
+        return SuccessResponse(
+            message="Cluster created successfully, its tasks are being created from the uploaded file",
+            data={"cluster": TaskClusterDetailSerializer(cluster).data, "job": ClusterIngestionJobSerializer(job).data},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class ClusterIngestionJobView(generics.RetrieveAPIView):
+    """
+    Progress of a cluster file upload
+    """
+    serializer_class = ClusterIngestionJobSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_url_kwarg = 'job_id'
+
+    def get_queryset(self):
+        jobs = ClusterIngestionJob.objects.all()
+        if not self.request.user.is_staff:
+            jobs = jobs.filter(created_by=self.request.user)
+        return jobs
+
+    @extend_schema(summary="Get the progress of a cluster file upload")
+    def get(self, request, *args, **kwargs):
+        return SuccessResponse(data=self.get_serializer(self.get_object()).data)
+
+
 class TaskCreateView(generics.CreateAPIView):
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated | HasUserAPIKey]
@@ -677,7 +745,7 @@ class AssignClusterToSelf(generics.GenericAPIView):
         else:
             return ErrorResponse(message="You are already assigned to this cluster")
 
-        cache.delete_pattern(f"*available_clusters_{request.user.id}*")
+        invalidate_cache_tags(f"available_clusters_{request.user.id}")
         return SuccessResponse(message="Successfully added user to assigned reviewers")
 
 class AssignTaskToSelfView(APIView):
@@ -1084,7 +1152,7 @@ class TaskCompletionStatsView(generics.GenericAPIView):
         }
     )
         
-    @cache_response_decorator('task_completion_stats', per_user=True)
+    @cache_response_decorator('task_completion_stats', per_user=True, soft_timeout=60)
     def get(self, request):        
         try:
             user_clusters = TaskCluster.objects.filter(created_by=request.user)
@@ -1172,7 +1240,7 @@ class MyAssignedClustersView(APIView):
             #     assigned_reviewers=request.user
             # ).select_related('project').prefetch_related('tasks')
             
-            assigned_clusters = TaskCluster.objects.filter(assigned_reviewers=request.user).select_related('project').prefetch_related('tasks', "choices").annotate(
+            assigned_clusters = TaskCluster.objects.filter(assigned_reviewers=request.user).select_related('project').prefetch_related("choices").annotate(
                 tasks_count=Count("tasks"),
                 user_labels_count=Count("tasks", filter=Q(tasks__tasklabel__labeller=request.user), distinct=True)
             )
@@ -1318,7 +1386,7 @@ class TaskAnnotationView(generics.GenericAPIView):
             
             # Get the task            
             try:
-                task = Task.objects.select_related('cluster').get(id=task_id)
+                task = Task.objects.select_related('cluster__project').get(id=task_id)
             except Task.DoesNotExist:
                 logger.warning(f"Task annotation attempted for non-existent task {task_id} by user '{request.user.username}' at {datetime.now()}")
                 return Response({
@@ -1334,7 +1402,7 @@ class TaskAnnotationView(generics.GenericAPIView):
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Check if user is assigned to review this cluster
-            if not task.cluster or request.user not in task.cluster.assigned_reviewers.all():
+            if not task.cluster or not task.cluster.assigned_reviewers.filter(id=request.user.id).exists():
                 return Response({
                     'status': 'error',
                     'detail': 'You are not assigned to review this task cluster'
@@ -1386,11 +1454,11 @@ class TaskAnnotationView(generics.GenericAPIView):
             review_session, created = ManualReviewSession.objects.get_or_create(labeller=request.user, cluster=cluster)
             
 
-            task_ids = cluster.tasks.values_list("id", flat=True) #get the ids of all the tasks in a cluster
+            # the session is complete once the user has labelled every task of the cluster, counted in the database
+            # rather than by loading the ids of every task
+            user_labelled_tasks_count = TaskLabel.objects.filter(task__cluster=cluster, labeller=request.user).values("task_id").distinct().count()
             
-            user_labelled_tasks_ids = TaskLabel.objects.filter(task_id__in=task_ids, labeller=request.user).values_list("task_id", flat=True).distinct()  #get the ids of all the tasks the currently logged in user has labelled in this cluster
-            
-            user_review_session_complete= set(task_ids) == set(user_labelled_tasks_ids)
+            user_review_session_complete = user_labelled_tasks_count == cluster.tasks.count()
             
 
             if user_review_session_complete:
@@ -1401,6 +1469,8 @@ class TaskAnnotationView(generics.GenericAPIView):
             task.save()
             
             cluster.update_completion_percentage()
+            schedule_cluster_progress_update(cluster.id)
+            schedule_cluster_consensus_update(cluster.id)
             credit_labeller_monthly_payment.delay(task.id, request.user.id)
             
             cluster.project.create_log(f"Reviewer '{request.user.username}' submitted {len(created_labels)} labels for task {task.serial_no} at {datetime.now()}")
@@ -1410,7 +1480,7 @@ class TaskAnnotationView(generics.GenericAPIView):
             
             logger.info(f"Reviewer '{request.user.username}' submitted {len(created_labels)} labels for task {task.serial_no} at {datetime.now()}")
             
-            cache.delete_pattern(f"*project_detail_GET_/api/v1/account/projects/{cluster.project.id}/*") #invalidate project detail cache when a label is provided, this is becuase project detail depends on logs and stats from here
+            invalidate_cache_tags(f"project_detail_{cluster.project_id}") #invalidate project detail cache when a label is provided, this is becuase project detail depends on logs and stats from here
             return Response({
                 'status': 'success',
                 'message': 'Task labels submitted successfully',
@@ -1469,7 +1539,7 @@ class ClusterAnnotationProgressView(APIView):
         }
     )
     
-    @cache_response_decorator('cluster_annotation_progress', per_user=True)
+    @cache_response_decorator('cluster_annotation_progress', per_user=True, tags=['cluster_annotation_progress_{user_id}_{cluster_id}'])
     def get(self, request, cluster_id):
       
         try:
@@ -1725,7 +1795,10 @@ class ClusterLabelsSummaryView(APIView):
     
     @extend_schema(
         summary="Get cluster labels summary",
-        description="Retrieve a summary of all labels across tasks in a cluster.",
+        description="Retrieve a summary of all labels across tasks in a cluster. Labels are ordered by frequency, pass `top` to only get the most frequent ones.",
+        parameters=[
+            OpenApiParameter(name='top', type=int, location=OpenApiParameter.QUERY, required=False, description='Only return the top K most frequent labels'),
+        ],
         responses={
             200: OpenApiResponse(
                 response=None,
@@ -1765,36 +1838,36 @@ class ClusterLabelsSummaryView(APIView):
             cluster = get_object_or_404(TaskCluster, id=cluster_id)
             
             # Check if user is assigned to review this cluster
-            if request.user not in cluster.assigned_reviewers.all():
+            if not cluster.assigned_reviewers.filter(id=request.user.id).exists():
                 return Response({
                     'status': 'error',
                     'detail': 'You are not assigned to review this cluster'
                 }, status=status.HTTP_403_FORBIDDEN)
             
-            # Get all tasks in the cluster
-            cluster_tasks = cluster.tasks.all()
-            total_tasks = cluster_tasks.count()
-            labeled_tasks = cluster_tasks.filter(tasklabel__isnull=False).distinct().count()
-            
-            # Get all labels for the cluster
-            cluster_labels = TaskLabel.objects.filter(task__cluster=cluster).select_related('labeller')
-            total_labels = cluster_labels.count()
+            top = request.query_params.get('top')
+            if top is not None:
+                if not top.isdigit() or int(top) < 1:
+                    return Response({
+                        'status': 'error',
+                        'detail': 'top must be a positive integer'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                top = int(top)
             
-            # Calculate label frequency
-            label_frequency = {}
-            labeller_contributions = {}
+            task_counts = cluster.tasks.aggregate(
+                total_tasks=Count('id', distinct=True),
+                labeled_tasks=Count('id', filter=Q(tasklabel__isnull=False), distinct=True),
+            )
+            total_tasks = task_counts['total_tasks']
+            labeled_tasks = task_counts['labeled_tasks']
             
-            for task_label in cluster_labels:
-                # Count label frequency
-                label_text = task_label.label
-                label_frequency[label_text] = label_frequency.get(label_text, 0) + 1
-                
-                # Count labeller contributions
-                labeller_name = task_label.labeller.username
-                labeller_contributions[labeller_name] = labeller_contributions.get(labeller_name, 0) + 1
+            # label and labeller counts come from the cluster's cached histograms, built with GROUP BY queries on a miss
+            label_frequency, unique_labels, labeller_counts = get_cluster_label_histogram(cluster.id, top=top)
+            total_labels = sum(labeller_counts.values())
             
-            # Get unique labels count
-            unique_labels = len(label_frequency)
+            usernames = dict(User.objects.filter(id__in=labeller_counts).values_list('id', 'username'))
+            labeller_contributions = {
+                usernames[labeller_id]: count for labeller_id, count in labeller_counts.items() if labeller_id in usernames
+            }
             
             logger.info(f"User '{request.user.username}' fetched labels summary for cluster {cluster_id} at {datetime.now()}")
             
@@ -1817,3 +1890,84 @@ class ClusterLabelsSummaryView(APIView):
                 'status': 'error',
                 'detail': f'Failed to fetch cluster labels summary: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ClusterConsensusView(APIView):
+    """
+    View to get the consensus between the labellers of a cluster
+    """
+    permission_classes = [IsAuthenticated | HasUserAPIKey]
+
+    @extend_schema(
+        summary="Get cluster consensus",
+        description="Majority label and labeller agreement for the labelled tasks of a cluster, a page at a time, along with the cluster's Fleiss' kappa. Only available for text and multiple choice clusters. The first request for a cluster schedules the computation and returns 202.",
+        parameters=[
+            OpenApiParameter(name="page", type=int, required=False, description="Page of tasks to return"),
+            OpenApiParameter(name="page_size", type=int, required=False, description="Tasks per page, 50 by default and at most 500"),
+        ],
+        responses={
+            200: OpenApiResponse(
+                response=None,
+                description="Cluster consensus",
+                examples=[
+                    OpenApiExample(
+                        "Successful Response",
+                        value={
+                            "status": "success",
+                            "data": {
+                                "cluster_id": 1,
+                                "kappa": 0.305556,
+                                "mean_agreement": 0.666667,
+                                "labelled_tasks": 2,
+                                "label_totals": {"positive": 2, "negative": 3},
+                                "computed_at": "2025-08-29T10:00:00Z",
+                                "count": 2,
+                                "next": None,
+                                "previous": None,
+                                "tasks": [
+                                    {"id": 1, "serial_no": "A1B2C3", "final_label": "positive", "consensus": {"votes": {"positive": 2, "negative": 1}, "labellers": 3, "agreement": 0.333333, "tied": False}},
+                                    {"id": 2, "serial_no": "D4E5F6", "final_label": "negative", "consensus": {"votes": {"negative": 2}, "labellers": 2, "agreement": 1.0, "tied": False}}
+                                ]
+                            }
+                        },
+                        response_only=True
+                    )
+                ]
+            ),
+            202: OpenApiResponse(response=None, description="The consensus of the cluster is being computed, try again shortly"),
+        }
+    )
+    def get(self, request, cluster_id):
+        cluster = get_object_or_404(TaskCluster.objects.select_related('project'), id=cluster_id)
+
+        if not (request.user.is_staff or cluster.created_by_id == request.user.id or has_project_permission(request.user, cluster.project, 'view_tasks')):
+            return ErrorResponse(message="You are not authorized to view this cluster", status=status.HTTP_403_FORBIDDEN)
+
+        if cluster.input_type not in [TaskInputTypeChoices.TEXT, TaskInputTypeChoices.MULTIPLE_CHOICE]:
+            return ErrorResponse(message=f"Consensus is not available for clusters with {cluster.input_type} labels")
+
+        try:
+            consensus = cluster.consensus
+        except ClusterConsensus.DoesNotExist:
+            # first request for this cluster, computed by a worker and kept up to date as labels come in
+            schedule_cluster_consensus_update(cluster.id)
+            return SuccessResponse(
+                data={'cluster_id': cluster.id},
+                message="The consensus of this cluster is being computed, try again shortly",
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        tasks = cluster.tasks.filter(consensus__isnull=False).order_by('id').values('id', 'serial_no', 'final_label', 'consensus')
+        paginator = StandardPagination()
+        page = paginator.paginate_queryset(tasks, request, view=self)
+
+        return SuccessResponse(data={
+            'cluster_id': cluster.id,
+            'kappa': consensus.kappa,
+            'mean_agreement': consensus.mean_agreement,
+            'labelled_tasks': consensus.labelled_tasks,
+            'label_totals': consensus.category_totals,
+            'computed_at': consensus.computed_at,
+            **paginator.get_page_info(),
+            'tasks': page,
+        })
@@ -31,4 +31,20 @@ class TaskClusterStatusChoices(models.TextChoices):
 
 class ManualReviewSessionStatusChoices(models.TextChoices):
     STARTED = 'started', 'Started' #the human has started review for the tasks in a cluster
-    COMPLETED = 'completed', 'Completed' #the human has reviewed all the tasks in that cluster
\ No newline at end of file
+    COMPLETED = 'completed', 'Completed' #the human has reviewed all the tasks in that cluster
+
+class ClusterIngestionStatusChoices(models.TextChoices):
+    PENDING = 'pending', 'Pending' #the file has been uploaded and is waiting for a worker
+    PROCESSING = 'processing', 'Processing' #tasks are being created from the file
+    COMPLETED = 'completed', 'Completed' #every row of the file has been processed
+    FAILED = 'failed', 'Failed' #the file could not be read, see the error
+
+class AICallOperationChoices(models.TextChoices):
+    CLASSIFICATION = 'classification', 'Classification' #text_classification, the first pass over a task
+    HUMAN_REVIEW = 'human_review', 'Human review' #submit_human_review, a reviewer's correction sent back to the model
+
+class AICallOutcomeChoices(models.TextChoices):
+    SUCCESS = 'success', 'Success' #the response contained valid JSON
+    NO_JSON = 'no_json', 'No JSON' #the response had no ```json block, the task falls back to human review
+    PARSE_FAILURE = 'parse_failure', 'Parse failure' #the ```json block was not valid JSON
+    ERROR = 'error', 'Error' #the call itself failed, after its retries
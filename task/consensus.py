@@ -0,0 +1,238 @@
+"""
+Consensus between the labellers of a cluster.
+
+A cluster's text and multiple choice labels are loaded into a task x labeller matrix of label codes, from
+which the per-task vote counts, majority label, per-task agreement and the cluster's Fleiss' kappa are
+computed with numpy. A labeller's vote on a task is the first label they submitted for it; text labels
+are compared case-insensitively.
+
+Results are stored on `Task.final_label` (the majority label) and `Task.consensus` (the votes behind it),
+the cluster-wide totals on `ClusterConsensus` and each labeller's agreement with the majority on
+`LabellerQuality`. Each run only reprocesses the tasks that received labels since the previous one: their
+old contribution is taken out of the totals and the new one added.
+"""
+import logging
+from datetime import timedelta
+
+import numpy as np
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from task.choices import TaskInputTypeChoices
+from task.models import ClusterConsensus, LabellerQuality, Task, TaskCluster, TaskLabel
+
+logger = logging.getLogger(__name__)
+
+# labels created just before the previous run started may have been committed after it read the labels,
+# so every run looks back this far further; reprocessing a task is idempotent
+RECOMPUTE_OVERLAP = timedelta(minutes=1)
+
+
+def normalize_label(label):
+    return " ".join(label.split()).casefold()
+
+
+def build_label_matrix(rows):
+    """
+    Turn (task_id, labeller_id, label) rows into a task x labeller matrix of label codes.
+
+    Rows must be ordered so that each labeller's first label for a task comes first. Returns
+    (task_ids, labeller_ids, categories, codes) where codes[i, j] is the index in `categories` of the
+    label labeller j gave task i, or -1 when they did not label it.
+    """
+    votes = {}
+    for task_id, labeller_id, label in rows:
+        votes.setdefault((task_id, labeller_id), normalize_label(label))
+
+    if not votes:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), [], np.empty((0, 0), dtype=np.int64)
+
+    pairs = np.array(list(votes.keys()), dtype=np.int64)
+    task_ids, task_index = np.unique(pairs[:, 0], return_inverse=True)
+    labeller_ids, labeller_index = np.unique(pairs[:, 1], return_inverse=True)
+    categories, label_codes = np.unique(np.array(list(votes.values()), dtype=object).astype(str), return_inverse=True)
+
+    codes = np.full((len(task_ids), len(labeller_ids)), -1, dtype=np.int64)
+    codes[task_index, labeller_index] = label_codes
+    return task_ids, labeller_ids, categories.tolist(), codes
+
+
+def count_votes(codes, category_count):
+    """Number of votes per task and label, a task x label matrix"""
+    counts = np.zeros((codes.shape[0], category_count), dtype=np.int64)
+    rows, columns = np.nonzero(codes >= 0)
+    np.add.at(counts, (rows, codes[rows, columns]), 1)
+    return counts
+
+
+def score_tasks(counts):
+    """
+    Majority label, agreement and ties for every task of a vote count matrix.
+
+    Agreement is the share of labeller pairs that agree on the task (the per-item term of Fleiss' kappa),
+    NaN for tasks with fewer than two votes. Ties are broken towards the label that sorts first.
+    """
+    votes = counts.sum(axis=1)
+    majority = counts.argmax(axis=1)
+    top = counts.max(axis=1)
+    tied = (counts == top[:, None]).sum(axis=1) > 1
+
+    agreement = np.full(len(votes), np.nan)
+    scored = votes >= 2
+    agreement[scored] = ((counts[scored] ** 2).sum(axis=1) - votes[scored]) / (votes[scored] * (votes[scored] - 1))
+    return majority, agreement, tied
+
+
+def fleiss_kappa(category_totals, agreement_sum, scored_tasks):
+    """
+    Fleiss' kappa from running totals, generalised to tasks with different numbers of votes:
+    observed agreement is the mean agreement of the tasks with at least two votes, chance agreement
+    comes from the overall share of each label.
+    """
+    totals = np.array(list(category_totals.values()), dtype=np.float64)
+    if not scored_tasks or totals.sum() == 0:
+        return None
+
+    observed = agreement_sum / scored_tasks
+    shares = totals / totals.sum()
+    expected = float((shares ** 2).sum())
+    if expected >= 1:
+        # every vote went to the same label, agreement is perfect but kappa is undefined
+        return None
+    return (observed - expected) / (1 - expected)
+
+
+def _remove_contribution(consensus, task_consensus):
+    if not task_consensus:
+        return
+    for label, count in task_consensus["votes"].items():
+        remaining = consensus.category_totals.get(label, 0) - count
+        if remaining > 0:
+            consensus.category_totals[label] = remaining
+        else:
+            consensus.category_totals.pop(label, None)
+    consensus.labelled_tasks -= 1
+    if task_consensus["agreement"] is not None:
+        consensus.agreement_sum -= task_consensus["agreement"]
+        consensus.scored_tasks -= 1
+
+
+def _add_contribution(consensus, task_consensus):
+    for label, count in task_consensus["votes"].items():
+        consensus.category_totals[label] = consensus.category_totals.get(label, 0) + count
+    consensus.labelled_tasks += 1
+    if task_consensus["agreement"] is not None:
+        consensus.agreement_sum += task_consensus["agreement"]
+        consensus.scored_tasks += 1
+
+
+def _labeller_agreement(labeller_ids, codes, majority, clear):
+    """
+    {labeller_id: agreed} for every vote on one task, only for tasks with a clear majority;
+    keys are strings so the mapping survives the round trip through `Task.labeller_agreement`
+    """
+    if not clear:
+        return {}
+    voted = codes >= 0
+    return {str(labeller_id): bool(agreed) for labeller_id, agreed in zip(labeller_ids[voted].tolist(), (codes[voted] == majority).tolist())}
+
+
+def _add_quality(quality_deltas, labeller_agreement, sign=1):
+    for labeller_id, agreed in (labeller_agreement or {}).items():
+        scored, agreeing = quality_deltas.get(int(labeller_id), (0, 0))
+        quality_deltas[int(labeller_id)] = (scored + sign, agreeing + sign * agreed)
+
+
+def update_cluster_consensus(cluster_id, full=False):
+    """
+    Recompute the consensus of the tasks of a cluster that received labels since the previous run,
+    or of every task with `full`. Returns the updated ClusterConsensus, or None for clusters whose
+    labels are files rather than text.
+    """
+    cluster = TaskCluster.objects.get(id=cluster_id)
+    if cluster.input_type not in [TaskInputTypeChoices.TEXT, TaskInputTypeChoices.MULTIPLE_CHOICE]:
+        return None
+
+    with transaction.atomic():
+        # runs on the same cluster are serialized, each one builds on the totals of the previous
+        consensus, _ = ClusterConsensus.objects.get_or_create(cluster=cluster)
+        consensus = ClusterConsensus.objects.select_for_update().get(id=consensus.id)
+        started_at = timezone.now()
+
+        labels = TaskLabel.objects.filter(task__cluster=cluster, label__isnull=False).exclude(label="")
+        full = full or consensus.computed_at is None
+        if full:
+            consensus.category_totals, consensus.agreement_sum = {}, 0
+            consensus.scored_tasks = consensus.labelled_tasks = 0
+            # the cluster totals start over, but labeller quality is shared with other clusters so the
+            # contribution of every task is taken out of it individually
+            previous = Task.objects.filter(cluster=cluster, consensus__isnull=False)
+        else:
+            touched_task_ids = labels.filter(created_at__gte=consensus.computed_at - RECOMPUTE_OVERLAP).values("task_id")
+            labels = labels.filter(task_id__in=touched_task_ids)
+            previous = Task.objects.filter(id__in=touched_task_ids)
+        previous = {task_id: (task_consensus, agreement) for task_id, task_consensus, agreement in previous.values_list("id", "consensus", "labeller_agreement")}
+
+        rows = labels.order_by("task_id", "labeller_id", "id").values_list("task_id", "labeller_id", "label")
+        task_ids, labeller_ids, categories, codes = build_label_matrix(rows.iterator(chunk_size=5000))
+        counts = count_votes(codes, len(categories))
+        majority, agreement, tied = score_tasks(counts)
+        clear = ~np.isnan(agreement) & ~tied
+
+        tasks, quality_deltas = [], {}
+        for index, task_id in enumerate(task_ids.tolist()):
+            task_votes = {categories[code]: int(count) for code, count in enumerate(counts[index]) if count}
+            task_consensus = {
+                "votes": task_votes,
+                "labellers": int(counts[index].sum()),
+                "agreement": None if np.isnan(agreement[index]) else round(float(agreement[index]), 6),
+                "tied": bool(tied[index]),
+            }
+            labeller_agreement = _labeller_agreement(labeller_ids, codes[index], majority[index], clear[index])
+            previous_consensus, previous_agreement = previous.pop(task_id, (None, None))
+            if not full:
+                _remove_contribution(consensus, previous_consensus)
+            _add_contribution(consensus, task_consensus)
+            _add_quality(quality_deltas, previous_agreement, sign=-1)
+            _add_quality(quality_deltas, labeller_agreement)
+            tasks.append(Task(id=task_id, final_label=categories[majority[index]], consensus=task_consensus, labeller_agreement=labeller_agreement))
+
+        # tasks whose labels are all gone no longer count
+        for task_id, (previous_consensus, previous_agreement) in previous.items():
+            if not full:
+                _remove_contribution(consensus, previous_consensus)
+            _add_quality(quality_deltas, previous_agreement, sign=-1)
+            tasks.append(Task(id=task_id, final_label=None, consensus=None, labeller_agreement=None))
+
+        Task.objects.bulk_update(tasks, ["final_label", "consensus", "labeller_agreement"], batch_size=1000)
+        LabellerQuality.apply_deltas(cluster.labeler_domain_id, quality_deltas)
+
+        kappa = fleiss_kappa(consensus.category_totals, consensus.agreement_sum, consensus.scored_tasks)
+        consensus.kappa = None if kappa is None else round(kappa, 6)
+        consensus.computed_at = started_at
+        consensus.save()
+
+    logger.info(f"Updated consensus of {len(tasks)} tasks in cluster {cluster_id}, kappa {consensus.kappa}")
+    return consensus
+
+
+@shared_task
+def recompute_cluster_consensus(cluster_id, full=False):
+    consensus = update_cluster_consensus(cluster_id, full=full)
+    return consensus.kappa if consensus else None
+
+
+def schedule_cluster_consensus_update(cluster_id):
+    """
+    Recompute a cluster's consensus shortly after it receives labels.
+
+    Labels arriving within CONSENSUS_UPDATE_DELAY_SECONDS of each other are handled by a single run,
+    which only reprocesses the tasks they touched.
+    """
+    delay = settings.CONSENSUS_UPDATE_DELAY_SECONDS
+    scheduled = get_redis_connection("default").set(f"cluster_consensus_scheduled_{cluster_id}", 1, nx=True, ex=delay)
+    if scheduled:
+        recompute_cluster_consensus.apply_async(args=[cluster_id], countdown=delay)
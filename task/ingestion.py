@@ -0,0 +1,241 @@
+"""
+Streaming ingestion of cluster tasks from JSONL and CSV uploads.
+
+The web process stores the uploaded file in the database as ClusterIngestionChunk rows, since the worker
+runs in another container and cannot open the files the web process wrote. The worker reads the chunks back
+one at a time, line by line, and turns the rows into tasks with bulk_create in batches of
+CLUSTER_INGESTION_BATCH_SIZE, so memory use does not grow with the size of the file.
+
+Rows have the shape of dataset.jsonl: the text of a TEXT task is read from `data` (or `text`), the file of
+other task types from a `file` object in JSONL or `file_name`, `file_type`, `file_url` and `file_size_bytes`
+columns in CSV. Other keys are ignored. Invalid rows are skipped and reported on the job.
+
+Each created task is charged the data points of a cluster item when its batch is saved, the job fails once
+the uploader's balance cannot cover the next batch.
+"""
+import codecs
+import csv
+import json
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from common.caching import invalidate_cache_tags
+from subscription.models import UserDataPoints
+from task.choices import AnnotationMethodChoices, ClusterIngestionStatusChoices, TaskTypeChoices
+from task.models import ClusterIngestionChunk, ClusterIngestionJob, ProjectDailyStats, Task
+from task.serializers import FileItemSerializer
+from task.tasks import process_task
+from task.utils import assign_serial_numbers, calculate_labelling_required_data_points, dispatch_task_message
+
+logger = logging.getLogger(__name__)
+
+# only the first invalid rows are kept on the job, the rest are just counted
+ROW_ERROR_LIMIT = 50
+# a batch whose serial numbers were taken by a concurrent insert is retried with new ones
+SERIAL_NO_ATTEMPTS = 3
+FILE_FIELDS = ("file_name", "file_type", "file_url", "file_size_bytes")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def store_upload(job, file):
+    """Save an uploaded file as the chunks of `job`, one row per UPLOAD_CHUNK_SIZE bytes"""
+    for index, data in enumerate(file.chunks(UPLOAD_CHUNK_SIZE)):
+        ClusterIngestionChunk.objects.create(job=job, index=index, data=data)
+
+
+def read_upload(job):
+    """Yield the lines of the file of `job` as bytes, reading its chunks one at a time"""
+    pending = b""
+    chunks = job.chunks.order_by("index").values_list("data", flat=True)
+    for data in chunks.iterator(chunk_size=1):
+        *lines, pending = (pending + bytes(data)).split(b"\n")
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+def read_rows(lines, file_format):
+    """
+    Yield (line_number, row, error) for every row of an uploaded file given as lines of bytes, where row is a
+    dict or None when the row could not be decoded. Blank lines are skipped.
+    """
+    lines = codecs.iterdecode(lines, "utf-8-sig")
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def parse_row(row, task_type):
+    """Task fields for one row, raises ValueError when the row cannot become a task of `task_type`"""
+    if task_type == TaskTypeChoices.TEXT:
+        data = row.get("data") or row.get("text")
+        if not isinstance(data, str) or not data.strip():
+            raise ValueError("Must provide a text data for task of type TEXT")
+        return {"data": data}
+
+    file = row.get("file")
+    if not isinstance(file, dict):
+        file = {field: row.get(field) for field in FILE_FIELDS}
+    serializer = FileItemSerializer(data=file)
+    if not serializer.is_valid():
+        field, errors = next(iter(serializer.errors.items()))
+        raise ValueError(f"Must provide file data for task of type {task_type} ({field}: {errors[0]})")
+    return dict(serializer.validated_data)
+
+
+def _publish_progress(job):
+    # sent as soon as each batch is saved rather than when the ingestion task ends
+    dispatch_task_message(job.created_by_id, {
+        "job_id": job.id,
+        "cluster_id": job.cluster_id,
+        "status": job.status,
+        "processed_rows": job.processed_rows,
+        "created_tasks": job.created_tasks,
+        "failed_rows": job.failed_rows,
+    }, action="cluster_ingestion_progress", immediate=True)
+
+
+def item_data_points(cluster):
+    """Data points charged for each task of an uploaded cluster"""
+    return calculate_labelling_required_data_points({
+        "input_type": cluster.input_type,
+        "task_type": cluster.task_type,
+        "labeller_per_item_count": cluster.labeller_per_item_count,
+    })
+
+
+def _save_batch(job, rows_read, task_fields, row_errors):
+    """Create and charge the tasks of one batch and advance the job's counters in the same transaction"""
+    cluster = job.cluster
+    processing_status = "REVIEW_NEEDED" if cluster.annotation_method == AnnotationMethodChoices.MANUAL else "PENDING"
+    used_data_points = item_data_points(cluster)
+    tasks = [
+        Task(
+            cluster=cluster,
+            group_id=cluster.project_id,
+            user_id=job.created_by_id,
+            task_type=cluster.task_type,
+            processing_status=processing_status,
+            used_data_points=used_data_points,
+            **fields,
+        )
+        for fields in task_fields
+    ]
+    required_data_points = used_data_points * len(tasks)
+
+    for attempt in range(SERIAL_NO_ATTEMPTS):
+        assign_serial_numbers(tasks)
+        try:
+            with transaction.atomic():
+                if required_data_points:
+                    user_data_points = UserDataPoints.objects.select_for_update().get_or_create(user_id=job.created_by_id)[0]
+                    if user_data_points.data_points_balance < required_data_points:
+                        raise ValueError(f"Not enough data points left to create {len(tasks)} more tasks")
+                    user_data_points.deduct_data_points(required_data_points)
+                created = Task.objects.bulk_create(tasks)
+                job.processed_rows += rows_read
+                job.created_tasks += len(created)
+                job.failed_rows += len(row_errors)
+                job.row_errors = (job.row_errors + row_errors)[:ROW_ERROR_LIMIT]
+                job.save(update_fields=["processed_rows", "created_tasks", "failed_rows", "row_errors"])
+            break
+        except IntegrityError:
+            if attempt == SERIAL_NO_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Serial number collision while ingesting job {job.id}, retrying the batch")
+
+    # bulk_create skips the Task signals, so the daily rollup and cached stats are updated here
+    if created:
+        ProjectDailyStats.apply_delta(
+            cluster.project_id, timezone.localdate(created[0].created_at), task_count=len(created), total_data_points=required_data_points,
+        )
+        invalidate_cache_tags(f"task_completion_stats_{job.created_by_id}")
+    if cluster.annotation_method == AnnotationMethodChoices.AI_AUTOMATED:
+        for task in created:
+            process_task.delay(task.id)
+    _publish_progress(job)
+
+
+def _ingest_rows(job):
+    batch_size = settings.CLUSTER_INGESTION_BATCH_SIZE
+    task_type = job.cluster.task_type
+    rows_read, task_fields, row_errors = 0, [], []
+
+    rows = read_rows(read_upload(job), job.file_format)
+    # rows up to processed_rows were committed by an earlier attempt at this job
+    for _ in range(job.processed_rows):
+        next(rows, None)
+
+    for line_number, row, error in rows:
+        rows_read += 1
+        if row is not None:
+            try:
+                task_fields.append(parse_row(row, task_type))
+            except ValueError as e:
+                error = str(e)
+        if error:
+            row_errors.append({"line": line_number, "error": error})
+
+        if rows_read == batch_size:
+            _save_batch(job, rows_read, task_fields, row_errors)
+            rows_read, task_fields, row_errors = 0, [], []
+
+    if rows_read:
+        _save_batch(job, rows_read, task_fields, row_errors)
+
+
+@shared_task
+def ingest_cluster_file(job_id):
+    """Create the tasks of an uploaded cluster file, returns the number of tasks created"""
+    try:
+        job = ClusterIngestionJob.objects.select_related("cluster").get(id=job_id)
+    except ClusterIngestionJob.DoesNotExist:
+        logger.warning(f"Cluster ingestion job {job_id} no longer exists")
+        return 0
+    if job.status in [ClusterIngestionStatusChoices.COMPLETED, ClusterIngestionStatusChoices.FAILED]:
+        return job.created_tasks
+
+    job.status = ClusterIngestionStatusChoices.PROCESSING
+    job.started_at = job.started_at or timezone.now()
+    job.save(update_fields=["status", "started_at"])
+
+    try:
+        _ingest_rows(job)
+    except Exception as e:
+        logger.error(f"Cluster ingestion job {job.id} failed after {job.processed_rows} rows: {e}", exc_info=True)
+        job.status = ClusterIngestionStatusChoices.FAILED
+        job.error = f"The file could not be processed after {job.processed_rows} rows: {e}"
+    else:
+        if job.created_tasks:
+            job.status = ClusterIngestionStatusChoices.COMPLETED
+            # the tasks now hold everything the upload had to offer
+            job.chunks.all().delete()
+        else:
+            job.status = ClusterIngestionStatusChoices.FAILED
+            job.error = "The file did not contain any valid tasks"
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at"])
+    _publish_progress(job)
+    logger.info(f"Cluster ingestion job {job.id} {job.status}: {job.created_tasks} tasks created, {job.failed_rows} rows skipped")
+    return job.created_tasks
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from task.ai_telemetry import get_ai_usage
+from task.models import AICallTelemetry
+
+
+class Command(BaseCommand):
+    help = 'Show the calls, failures, retries, latency, tokens and estimated cost of the AI calls per project or cluster'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=['project', 'cluster'], default='project', help='What to add the calls up by')
+        parser.add_argument('--days', type=int, help='Only count the calls of the last DAYS days')
+        parser.add_argument('--project', type=int, help='Only count the calls made for this project')
+
+    def handle(self, *args, **options):
+        calls = AICallTelemetry.objects.all()
+        if options['days']:
+            calls = calls.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['project']:
+            calls = calls.filter(project_id=options['project'])
+
+        usage = get_ai_usage(options['by'], calls)
+        if not usage:
+            self.stdout.write(self.style.WARNING('No AI calls recorded yet'))
+            return
+
+        self.stdout.write(
+            f"{options['by']:<32}{'calls':>8}{'failed':>8}{'parse err':>11}{'retries':>9}{'avg ms':>10}{'max ms':>10}"
+            f"{'input tok':>12}{'output tok':>12}{'est. cost':>11}"
+        )
+        for row in usage:
+            name = f"{row['id']} {row['name']}" if row['id'] else '(none)'
+            self.stdout.write(
+                f"{name[:31]:<32}{row['calls']:>8}{row['failed_calls']:>8}{row['parse_failures']:>11}{row['retries']:>9}"
+                f"{row['avg_latency_ms']:>10}{row['max_latency_ms']:>10}{row['input_tokens']:>12}{row['output_tokens']:>12}"
+                f"{row['estimated_cost']:>11}"
+            )
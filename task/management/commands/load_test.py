@@ -0,0 +1,282 @@
+"""
+Concurrent load test of a running server, built from the steps of the test_flow command.
+
+Simulated clients go through the client flow (register, log in, generate an api key, subscribe, create a
+project and submit tasks, optionally waiting for the task updates on the websocket) and simulated labellers
+through the labelling flow (log in, list their clusters and available tasks and annotate them). Both arrive
+as Poisson processes at the configured rates.
+
+Run it against a local server started with STUB_EXTERNAL_SERVICES=True so the AI and payment calls are
+answered by the stand-ins of common.stubs, and with labellers seeded by seed_load_dataset. Throughput, errors
+and latency percentiles are reported per endpoint.
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+import numpy as np
+import websockets
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from subscription.models import UserDataPoints
+from task.management.commands.seed_load_dataset import LABEL_CHOICES
+from task.management.commands.test_flow import FLOW_ENDPOINTS, project_payload, register_payload, task_payload
+
+User = get_user_model()
+
+LABELLER_ENDPOINTS = {
+    "my_assigned_clusters": "/api/v1/tasks/my-assigned-clusters/",
+    "available_tasks": "/api/v1/tasks/available-for-annotation/",
+    "annotate": "/api/v1/tasks/annotate/",
+}
+# data points credited to every simulated client in place of a completed payment
+CLIENT_DATA_POINTS = 100000
+PERCENTILES = [50, 90, 95, 99]
+
+
+class LoadStats:
+    """Latency and status of every request, grouped by endpoint"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def record(self, endpoint, latency_ms, status_code=None):
+        """status_code is None for requests that failed before a response came back"""
+        self.samples[endpoint].append((latency_ms, status_code))
+
+    def summary(self, duration_seconds):
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = np.array([latency for latency, _ in samples])
+            statuses = [status_code for _, status_code in samples]
+            errors = sum(1 for status_code in statuses if status_code is None or status_code >= 500)
+            report[endpoint] = {
+                "requests": len(samples),
+                "throughput": round(len(samples) / duration_seconds, 2) if duration_seconds else None,
+                "errors": errors,
+                "rejected": sum(1 for status_code in statuses if status_code is not None and 400 <= status_code < 500),
+                "error_rate": round(errors / len(samples), 4),
+                **{f"p{percentile}_ms": round(float(value), 1) for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))},
+                "max_ms": round(float(latencies.max()), 1),
+            }
+        return report
+
+
+def _task_ids(message):
+    """Ids of the tasks a websocket message is about, single events and batches alike"""
+    events = message.get("tasks") or [message]
+    return {event.get("id") or event.get("task_id") for event in events if isinstance(event, dict)}
+
+
+def prepare_client(username):
+    """Verify the email of a registered client and credit it data points, in place of the email link and the payment"""
+    user = User.objects.get(username=username)
+    user.is_email_verified = True
+    user.save(update_fields=["is_email_verified"])
+    user_data_points, _ = UserDataPoints.objects.get_or_create(user=user)
+    user_data_points.topup_data_points(CLIENT_DATA_POINTS)
+
+
+class LoadTest:
+    def __init__(self, options, run_id):
+        self.options = options
+        self.run_id = run_id
+        self.stats = LoadStats()
+        self.websocket_url = options["base_url"].replace("http", "ws", 1)
+
+    async def request(self, client, endpoint, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.stats.record(endpoint, (time.perf_counter() - started) * 1000)
+            return None
+        self.stats.record(endpoint, (time.perf_counter() - started) * 1000, response.status_code)
+        return response if response.is_success else None
+
+    async def login(self, client, username, password):
+        response = await self.request(client, "login", "POST", FLOW_ENDPOINTS["login"], json={"username": username, "password": password})
+        if response is None:
+            return False
+        client.headers["Authorization"] = f"Bearer {response.json().get('access')}"
+        return True
+
+    async def run_client(self, index):
+        user_data = {
+            "username": f"{self.run_id}_client_{index}",
+            "email": f"{self.run_id}_client_{index}@example.com",
+            "password": f"TestP@ssword{index}!",
+        }
+        async with httpx.AsyncClient(base_url=self.options["base_url"], timeout=self.options["timeout"]) as client:
+            if await self.request(client, "register", "POST", FLOW_ENDPOINTS["register"], json=register_payload(user_data)) is None:
+                return
+            await sync_to_async(prepare_client)(user_data["username"])
+            if not await self.login(client, user_data["username"], user_data["password"]):
+                return
+
+            response = await self.request(client, "generate_production_key", "POST", FLOW_ENDPOINTS["generate_production_key"],
+                                          json={"key_name": f"{user_data['username']}-prod-key"})
+            api_key = response.json().get("data", {}).get("api_key") if response else None
+            if api_key:
+                client.headers["X-Api-Key"] = api_key
+
+            response = await self.request(client, "subscription_plans", "GET", FLOW_ENDPOINTS["subscription_plans"])
+            plans = (response.json().get("detail") or []) if response else []
+            if plans:
+                await self.request(client, "initialize_subscription", "POST", FLOW_ENDPOINTS["initialize_subscription"],
+                                   json={"subscription_plan": plans[0].get("id")})
+
+            await self.request(client, "create_project", "POST", FLOW_ENDPOINTS["create_project"], data=project_payload(user_data))
+            response = await self.request(client, "project_list", "GET", FLOW_ENDPOINTS["project_list"])
+            projects = response.json() if response else []
+            if not projects:
+                return
+
+            if self.options["websocket"] and api_key:
+                await self.create_tasks_and_wait(client, projects[0]["id"], api_key)
+            else:
+                await self.create_tasks(client, projects[0]["id"])
+
+    async def create_tasks(self, client, project_id):
+        created = {}
+        for _ in range(self.options["tasks_per_client"]):
+            response = await self.request(client, "create_task", "POST", FLOW_ENDPOINTS["create_task"], json=task_payload(project_id))
+            if response is not None:
+                created[response.json()["data"]["task_id"]] = time.perf_counter()
+        return created
+
+    async def create_tasks_and_wait(self, client, project_id, api_key):
+        """Create the tasks while listening on the task websocket, recording how long each task took to be reported back"""
+        url = f"{self.websocket_url}{FLOW_ENDPOINTS['task_websocket']}?api_key={api_key}"
+        started = time.perf_counter()
+        try:
+            websocket = await websockets.connect(url, open_timeout=self.options["timeout"])
+        except (OSError, websockets.WebSocketException, asyncio.TimeoutError):
+            self.stats.record("task_websocket", (time.perf_counter() - started) * 1000)
+            await self.create_tasks(client, project_id)
+            return
+        self.stats.record("task_websocket", (time.perf_counter() - started) * 1000, 101)
+
+        async with websocket:
+            created = await self.create_tasks(client, project_id)
+            deadline = time.perf_counter() + self.options["timeout"]
+            while created and time.perf_counter() < deadline:
+                try:
+                    message = json.loads(await asyncio.wait_for(websocket.recv(), timeout=deadline - time.perf_counter()))
+                except (asyncio.TimeoutError, websockets.WebSocketException):
+                    break
+                for task_id in _task_ids(message) & created.keys():
+                    self.stats.record("task_update", (time.perf_counter() - created.pop(task_id)) * 1000, 200)
+        # updates that never came count as errors
+        for created_at in created.values():
+            self.stats.record("task_update", (time.perf_counter() - created_at) * 1000)
+
+    async def run_labeller(self, username):
+        async with httpx.AsyncClient(base_url=self.options["base_url"], timeout=self.options["timeout"]) as client:
+            if not await self.login(client, username, self.options["password"]):
+                return
+            await self.request(client, "my_assigned_clusters", "GET", LABELLER_ENDPOINTS["my_assigned_clusters"])
+
+            annotated = 0
+            while annotated < self.options["annotations_per_labeller"]:
+                response = await self.request(client, "available_tasks", "GET", LABELLER_ENDPOINTS["available_tasks"])
+                tasks = response.json()["data"]["available_tasks"] if response else []
+                if not tasks:
+                    return
+                for task in random.sample(tasks, min(len(tasks), self.options["annotations_per_labeller"] - annotated)):
+                    # time spent reading the task before labelling it
+                    await asyncio.sleep(random.expovariate(1 / self.options["think_time"]) if self.options["think_time"] else 0)
+                    await self.request(client, "annotate", "POST", LABELLER_ENDPOINTS["annotate"],
+                                       json={"task_id": task["id"], "labels": [random.choice(LABEL_CHOICES)]})
+                    annotated += 1
+
+    async def arrive(self, rate, users, run_user):
+        """Start run_user for each user with exponential gaps in between, i.e. a Poisson process of `rate` per second"""
+        runs = []
+        for user in users:
+            runs.append(asyncio.create_task(run_user(user)))
+            await asyncio.sleep(random.expovariate(rate))
+        await asyncio.gather(*runs)
+
+    async def run(self, labellers):
+        await asyncio.gather(
+            self.arrive(self.options["client_rate"], range(self.options["clients"]), self.run_client),
+            self.arrive(self.options["labeller_rate"], labellers, self.run_labeller),
+        )
+
+
+class Command(BaseCommand):
+    help = "Load test a running server with concurrent clients and labellers going through the test_flow steps"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", type=str, default="http://localhost:8080", help="Base URL for the API (default: http://localhost:8080)")
+        parser.add_argument("--clients", type=int, default=20, help="Number of simulated clients (default: 20)")
+        parser.add_argument("--labellers", type=int, default=20, help="Number of simulated labellers, taken from the seeded reviewers (default: 20)")
+        parser.add_argument("--client-rate", type=float, default=2, help="Clients arriving per second (default: 2)")
+        parser.add_argument("--labeller-rate", type=float, default=2, help="Labellers arriving per second (default: 2)")
+        parser.add_argument("--tasks-per-client", type=int, default=5, help="Tasks submitted by each client (default: 5)")
+        parser.add_argument("--annotations-per-labeller", type=int, default=10, help="Tasks annotated by each labeller (default: 10)")
+        parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds a labeller spends on a task (default: 0.5)")
+        parser.add_argument("--prefix", type=str, default="load", help="Prefix the labellers were seeded with by seed_load_dataset (default: load)")
+        parser.add_argument("--password", type=str, default="Testp@ssword123", help="Password of the seeded labellers")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a response or a task update (default: 30)")
+        parser.add_argument("--websocket", action="store_true", help="Have clients wait for their task updates on the task websocket")
+        parser.add_argument("--seed", type=int, default=None, help="Seed of the arrival times and labeller choices")
+        parser.add_argument("--output", type=str, default=None, help="Also write the report to this JSON file")
+        parser.add_argument("--max-p95-ms", type=float, default=None, help="Fail when an endpoint's p95 latency is above this")
+        parser.add_argument("--max-error-rate", type=float, default=None, help="Fail when an endpoint's error rate is above this")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the simulated clients afterwards")
+
+    def handle(self, *args, **options):
+        if options["client_rate"] <= 0 or options["labeller_rate"] <= 0:
+            raise CommandError("Arrival rates must be positive")
+        random.seed(options["seed"])
+
+        labellers = list(
+            User.objects.filter(username__startswith=f"{options['prefix']}_reviewer_", is_reviewer=True)
+            .order_by("id").values_list("username", flat=True)[:options["labellers"]]
+        )
+        if options["labellers"] and len(labellers) < options["labellers"]:
+            self.stdout.write(self.style.WARNING(
+                f"Only {len(labellers)} labellers found with the prefix {options['prefix']}, seed more with seed_load_dataset"
+            ))
+
+        run_id = f"loadtest_{uuid.uuid4().hex[:8]}"
+        load_test = LoadTest(options, run_id)
+        self.stdout.write(f"Running {options['clients']} clients and {len(labellers)} labellers against {options['base_url']}")
+        started = time.perf_counter()
+        asyncio.run(load_test.run(labellers))
+        duration = time.perf_counter() - started
+
+        report = load_test.stats.summary(duration)
+        self.write_report(report, duration)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump({"duration_seconds": round(duration, 2), "endpoints": report}, file, indent=2)
+
+        if options["cleanup"]:
+            deleted, _ = User.objects.filter(username__startswith=f"{run_id}_").delete()
+            self.stdout.write(f"Deleted {deleted} objects of the simulated clients")
+
+        violations = [
+            f"{endpoint} p95 {row['p95_ms']}ms" for endpoint, row in report.items()
+            if options["max_p95_ms"] is not None and row["p95_ms"] > options["max_p95_ms"]
+        ] + [
+            f"{endpoint} error rate {row['error_rate']}" for endpoint, row in report.items()
+            if options["max_error_rate"] is not None and row["error_rate"] > options["max_error_rate"]
+        ]
+        if violations:
+            raise CommandError(f"Load test budget exceeded: {', '.join(violations)}")
+
+    def write_report(self, report, duration):
+        columns = ["requests", "throughput", "errors", "rejected", *[f"p{percentile}_ms" for percentile in PERCENTILES], "max_ms"]
+        self.stdout.write(f"\nCompleted in {duration:.1f}s")
+        self.stdout.write(f"{'endpoint':<26}" + "".join(f"{column:>12}" for column in columns))
+        for endpoint, row in report.items():
+            self.stdout.write(f"{endpoint:<26}" + "".join(f"{str(row[column]):>12}" for column in columns))
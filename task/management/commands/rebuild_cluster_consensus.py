@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from task.choices import TaskInputTypeChoices
+from task.consensus import update_cluster_consensus
+from task.models import TaskCluster
+
+
+class Command(BaseCommand):
+    help = 'Recompute the consensus and labeller quality of every text cluster (or the given clusters) from their labels'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cluster_ids', nargs='*', type=int, help='Only rebuild these clusters')
+
+    def handle(self, *args, **options):
+        clusters = TaskCluster.objects.filter(input_type__in=[TaskInputTypeChoices.TEXT, TaskInputTypeChoices.MULTIPLE_CHOICE])
+        if options['cluster_ids']:
+            clusters = clusters.filter(id__in=options['cluster_ids'])
+
+        rebuilt_count = 0
+        for cluster_id in clusters.values_list('id', flat=True).iterator():
+            update_cluster_consensus(cluster_id, full=True)
+            rebuilt_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt consensus for {rebuilt_count} cluster(s)'))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from task.models import ProjectDailyStats, Task
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily project chart rollups from the tasks and clusters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Only rebuild the last N days (default is the whole history)')
+        parser.add_argument('--project', type=int, action='append', dest='project_ids', help='Only rebuild this project, can be repeated')
+
+    def handle(self, *args, **options):
+        if options['days']:
+            since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        else:
+            first_task = Task.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            since = timezone.localdate(first_task) if first_task else timezone.localdate()
+
+        rows = ProjectDailyStats.rebuild(since, project_ids=options['project_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily stats row(s) since {since}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from account.models import Project
+from task.models import ProjectStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized cluster statistics of every project (or the given projects)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='Only rebuild these projects')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['project_ids']:
+            projects = projects.filter(id__in=options['project_ids'])
+
+        rebuilt_count = 0
+        for project_id in projects.values_list('id', flat=True).iterator():
+            ProjectStats.rebuild(project_id)
+            rebuilt_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics for {rebuilt_count} project(s)'))
@@ -0,0 +1,397 @@
+import csv
+import datetime
+import io
+import json
+import math
+import random
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from account.choices import MonthlyEarningsReleaseStatusChoices
+from account.models import MonthlyReviewerEarnings, Project
+from reviewer.models import LabelerDomain
+from subscription.models import UserDataPoints
+from task.choices import AnnotationMethodChoices, TaskClusterStatusChoices, TaskInputTypeChoices, TaskTypeChoices
+from task.consensus import update_cluster_consensus
+from task.models import MultiChoiceOption, ProjectDailyStats, ProjectStats, Task, TaskCluster, TaskLabel
+from task.utils import assign_serial_numbers
+
+User = get_user_model()
+
+LABEL_CHOICES = ["positive", "negative", "neutral", "mixed"]
+SUBJECTS = ["The movie", "The delivery", "The support team", "This product", "The update", "The checkout", "The app", "The hotel"]
+VERDICTS = ["was fantastic", "was a complete waste of money", "was fine I guess", "exceeded every expectation",
+            "kept crashing", "was slower than promised", "felt overpriced", "made my week"]
+DETAILS = ["", " and I would do it again.", " but the price was fair.", " and nobody answered my emails.",
+           " even though it arrived late.", " which I did not expect."]
+# models whose timestamps are generated instead of set to the time of the insert
+TIMESTAMPED_MODELS = [User, Project, TaskCluster, Task, TaskLabel, MonthlyReviewerEarnings, UserDataPoints]
+
+
+@contextmanager
+def generated_timestamps():
+    """Let the seeded objects keep the created_at/updated_at values they were given"""
+    fields = [
+        field for model in TIMESTAMPED_MODELS for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible, production-sized dataset (reviewers, projects, clusters, tasks, labels and earnings) "
+        "with bulk inserts, for load tests and benchmarks. The same seed and end date always give the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+        parser.add_argument("--prefix", type=str, default="load", help="Prefix of the generated usernames and project names (default: load)")
+        parser.add_argument("--flush", action="store_true", help="Delete the data generated earlier with the same prefix first")
+        parser.add_argument("--reviewers", type=int, default=200, help="Number of reviewers (default: 200)")
+        parser.add_argument("--domains", type=int, default=5, help="Number of labeller domains (default: 5)")
+        parser.add_argument("--projects", type=int, default=20, help="Number of projects, each with its own owner (default: 20)")
+        parser.add_argument("--clusters-per-project", type=int, default=25, help="Number of clusters per project (default: 25)")
+        parser.add_argument("--tasks-per-cluster", type=int, default=400, help="Mean number of tasks per cluster (default: 400)")
+        parser.add_argument(
+            "--cluster-size-spread", type=float, default=1.0,
+            help="Sigma of the lognormal distribution of cluster sizes, 0 gives every cluster the mean (default: 1.0)",
+        )
+        parser.add_argument("--labellers-per-cluster", type=int, default=5, help="Reviewers assigned to each cluster (default: 5)")
+        parser.add_argument("--label-coverage", type=float, default=0.7, help="Share of tasks with at least one label (default: 0.7)")
+        parser.add_argument("--file-task-share", type=float, default=0.2, help="Share of clusters with image tasks instead of text (default: 0.2)")
+        parser.add_argument("--ai-share", type=float, default=0.3, help="Share of clusters annotated by the AI first (default: 0.3)")
+        parser.add_argument("--days", type=int, default=180, help="Spread the data over this many days before the end date (default: 180)")
+        parser.add_argument("--end-date", type=datetime.date.fromisoformat, default=None, help="Last day of the data, YYYY-MM-DD (default: today)")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per insert (default: 5000)")
+        parser.add_argument("--copy", action="store_true", help="Insert tasks and labels with COPY, PostgreSQL only")
+        parser.add_argument("--consensus", action="store_true", help="Compute the consensus and labeller quality of every cluster afterwards")
+        parser.add_argument("--password", type=str, default="Testp@ssword123", help="Password of every generated user")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.prefix = options["prefix"]
+        self.batch_size = options["batch_size"]
+        self.use_copy = options["copy"]
+        if self.use_copy and connection.vendor != "postgresql":
+            raise CommandError("--copy is only supported on PostgreSQL")
+        if min(options["reviewers"], options["domains"], options["labellers_per_cluster"]) < 1:
+            raise CommandError("At least one reviewer, domain and labeller per cluster is needed")
+
+        # numpy draws the distributions, random (through generate_serial_no) the serial numbers and uuids
+        self.rng = np.random.default_rng(options["seed"])
+        random.seed(options["seed"])
+        end_date = options["end_date"] or timezone.localdate()
+        self.end = timezone.make_aware(datetime.datetime.combine(end_date, datetime.time(23, 59)))
+        self.start = self.end - datetime.timedelta(days=options["days"])
+
+        if User.objects.filter(username__startswith=f"{self.prefix}_").exists():
+            if not options["flush"]:
+                raise CommandError(f"Data with the prefix '{self.prefix}' already exists, pass --flush to replace it")
+            self.flush()
+
+        self.counts = {"tasks": 0, "labels": 0}
+        with generated_timestamps():
+            domains = self.create_domains()
+            reviewers, reliability = self.create_reviewers(domains)
+            owners = self.create_owners()
+            projects = self.create_projects(owners)
+            for project in projects:
+                with transaction.atomic():
+                    for _ in range(options["clusters_per_project"]):
+                        self.create_cluster(project, domains, reviewers, reliability)
+            self.create_earnings(reviewers)
+
+        for project in projects:
+            ProjectStats.rebuild(project.id)
+        ProjectDailyStats.rebuild(self.start.date(), end_date, project_ids=[project.id for project in projects])
+
+        if options["consensus"]:
+            clusters = TaskCluster.objects.filter(project__in=projects).values_list("id", flat=True)
+            for cluster_id in clusters.iterator():
+                update_cluster_consensus(cluster_id, full=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(reviewers)} reviewers, {len(projects)} projects, "
+            f"{len(projects) * options['clusters_per_project']} clusters, {self.counts['tasks']} tasks and {self.counts['labels']} labels"
+        ))
+
+    def flush(self):
+        self.stdout.write(f"Deleting the data generated with the prefix '{self.prefix}'...")
+        users = User.objects.filter(username__startswith=f"{self.prefix}_")
+        # children first, so each delete only has to collect one kind of row
+        TaskLabel.objects.filter(labeller__in=users).delete()
+        Task.objects.filter(group__created_by__in=users).delete()
+        Project.objects.filter(created_by__in=users).delete()
+        users.delete()
+        LabelerDomain.objects.filter(domain__startswith=f"{self.prefix} ").delete()
+
+    def random_time(self, size=None):
+        span = (self.end - self.start).total_seconds()
+        offsets = self.rng.uniform(0, span, size)
+        if size is None:
+            return self.start + datetime.timedelta(seconds=float(offsets))
+        return [self.start + datetime.timedelta(seconds=float(offset)) for offset in offsets]
+
+    def insert(self, model, objects, copy=False):
+        if not objects:
+            return objects
+        if copy and self.use_copy:
+            return self.copy(model, objects)
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def copy(self, model, objects):
+        """Insert with COPY, ids are taken from the table's sequence beforehand so they are known afterwards"""
+        table = model._meta.db_table
+        fields = model._meta.concrete_fields
+        columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+        sql = f"COPY {connection.ops.quote_name(table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(objects), self.batch_size):
+                batch = objects[start:start + self.batch_size]
+                cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, len(batch)])
+                for obj, (pk,) in zip(batch, cursor.fetchall()):
+                    obj.pk = pk
+
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for obj in batch:
+                    writer.writerow([copy_value(getattr(obj, field.attname)) for field in fields])
+                buffer.seek(0)
+                if hasattr(cursor, "copy_expert"):
+                    cursor.copy_expert(sql, buffer)
+                else:
+                    with cursor.copy(sql) as copy:
+                        copy.write(buffer.getvalue())
+        return objects
+
+    def create_domains(self):
+        names = [f"{self.prefix} domain {i}" for i in range(self.options["domains"])]
+        return self.insert(LabelerDomain, [LabelerDomain(domain=name) for name in names])
+
+    def make_users(self, kind, count, **fields):
+        password = make_password(self.options["password"])
+        joined = sorted(self.random_time(count))
+        return [
+            User(
+                username=f"{self.prefix}_{kind}_{i}",
+                email=f"{self.prefix}_{kind}_{i}@example.com",
+                password=password,
+                customer_id=uuid.UUID(int=random.getrandbits(128)),
+                date_joined=joined[i],
+                last_activity=joined[i],
+                is_email_verified=True,
+                **fields,
+            )
+            for i in range(count)
+        ]
+
+    def create_reviewers(self, domains):
+        reviewers = self.insert(User, self.make_users("reviewer", self.options["reviewers"], is_reviewer=True))
+        # most reviewers are reliable, a few mostly guess
+        reliability = self.rng.beta(8, 2, len(reviewers))
+
+        memberships = []
+        for reviewer in reviewers:
+            count = int(self.rng.integers(1, min(3, len(domains)) + 1))
+            for index in self.rng.choice(len(domains), size=count, replace=False):
+                memberships.append(User.domains.through(user_id=reviewer.id, labelerdomain_id=domains[index].id))
+        self.insert(User.domains.through, memberships)
+        return reviewers, reliability
+
+    def create_owners(self):
+        owners = self.insert(User, self.make_users("client", self.options["projects"]))
+        self.insert(UserDataPoints, [
+            UserDataPoints(user=owner, data_points_balance=1_000_000, created_at=owner.date_joined, updated_at=owner.date_joined)
+            for owner in owners
+        ])
+        return owners
+
+    def create_projects(self, owners):
+        projects = [
+            Project(
+                name=f"{self.prefix} project {i}",
+                description=f"Generated project {i}",
+                created_by=owner,
+                created_at=owner.date_joined,
+                updated_at=owner.date_joined,
+            )
+            for i, owner in enumerate(owners)
+        ]
+        return self.insert(Project, projects)
+
+    def cluster_size(self):
+        mean, sigma = self.options["tasks_per_cluster"], self.options["cluster_size_spread"]
+        if sigma <= 0:
+            return mean
+        # lognormal with the requested mean, most clusters are small and a few are very large
+        return max(1, int(self.rng.lognormal(math.log(mean) - sigma ** 2 / 2, sigma)))
+
+    def create_cluster(self, project, domains, reviewers, reliability):
+        rng = self.rng
+        size = self.cluster_size()
+        is_file_cluster = rng.random() < self.options["file_task_share"]
+        is_ai = not is_file_cluster and rng.random() < self.options["ai_share"]
+        input_type = TaskInputTypeChoices.MULTIPLE_CHOICE if rng.random() < 0.5 else TaskInputTypeChoices.TEXT
+        domain = domains[int(rng.integers(len(domains)))]
+
+        # who labels what, drawn before anything is inserted so the cluster's progress is known
+        candidates = [index for index, reviewer in enumerate(reviewers) if reviewer.id in self.domain_reviewers(domain)] or list(range(len(reviewers)))
+        labeller_count = min(self.options["labellers_per_cluster"], len(candidates))
+        assigned = rng.choice(candidates, size=labeller_count, replace=False)
+        labelled = rng.random(size) < self.options["label_coverage"]
+        vote_counts = rng.integers(1, labeller_count + 1, size) * labelled
+        order = rng.permuted(np.tile(np.arange(labeller_count), (size, 1)), axis=1)
+        voted = np.arange(labeller_count)[None, :] < vote_counts[:, None]
+        truth = rng.integers(len(LABEL_CHOICES), size=size)
+        correct = rng.random((size, labeller_count)) < reliability[assigned][order]
+        votes = np.where(correct, truth[:, None], rng.integers(len(LABEL_CHOICES), size=(size, labeller_count)))
+
+        completion = voted.sum() / (labeller_count * size) * 100 if labeller_count else 0
+        if completion >= 100:
+            cluster_status = TaskClusterStatusChoices.COMPLETED
+        elif completion > 0:
+            cluster_status = TaskClusterStatusChoices.IN_REVIEW
+        else:
+            cluster_status = TaskClusterStatusChoices.PENDING
+
+        created_at = max(self.random_time(), project.created_at)
+        cluster = self.insert(TaskCluster, [TaskCluster(
+            name=f"{project.name} cluster {int(rng.integers(1_000_000))}",
+            description="Generated cluster",
+            input_type=input_type,
+            task_type=TaskTypeChoices.IMAGE if is_file_cluster else TaskTypeChoices.TEXT,
+            annotation_method=AnnotationMethodChoices.AI_AUTOMATED if is_ai else AnnotationMethodChoices.MANUAL,
+            labeller_per_item_count=labeller_count,
+            labeler_domain=domain,
+            project=project,
+            created_by_id=project.created_by_id,
+            status=cluster_status,
+            completion_percentage=round(completion, 2),
+            created_at=created_at,
+            updated_at=created_at,
+        )])[0]
+        self.insert(TaskCluster.assigned_reviewers.through, [
+            TaskCluster.assigned_reviewers.through(taskcluster_id=cluster.id, user_id=reviewers[index].id) for index in assigned
+        ])
+        if input_type == TaskInputTypeChoices.MULTIPLE_CHOICE:
+            self.insert(MultiChoiceOption, [MultiChoiceOption(cluster=cluster, option_text=choice) for choice in LABEL_CHOICES])
+
+        tasks = self.create_tasks(cluster, size, is_file_cluster, is_ai, labelled, voted)
+        self.create_labels(cluster, tasks, [reviewers[index] for index in assigned], order, voted, votes)
+
+    def domain_reviewers(self, domain):
+        if not hasattr(self, "_domain_reviewers"):
+            self._domain_reviewers = {}
+            for user_id, domain_id in User.domains.through.objects.filter(user__username__startswith=f"{self.prefix}_").values_list("user_id", "labelerdomain_id"):
+                self._domain_reviewers.setdefault(domain_id, set()).add(user_id)
+        return self._domain_reviewers.get(domain.id, set())
+
+    def create_tasks(self, cluster, size, is_file_cluster, is_ai, labelled, voted):
+        rng = self.rng
+        # tasks are submitted within two days of their cluster
+        delays = rng.uniform(0, 2 * 24 * 3600, size)
+        confidence = rng.beta(5, 2, size) if is_ai else np.zeros(size)
+        data_points = rng.integers(1, 20, size)
+        sentences = zip(rng.integers(len(SUBJECTS), size=size), rng.integers(len(VERDICTS), size=size), rng.integers(len(DETAILS), size=size))
+
+        tasks = []
+        for i, (subject, verdict, detail) in enumerate(sentences):
+            created_at = min(cluster.created_at + datetime.timedelta(seconds=float(delays[i])), self.end)
+            fully_labelled = voted[i].all()
+            task = Task(
+                cluster=cluster,
+                group_id=cluster.project_id,
+                user_id=cluster.created_by_id,
+                task_type=cluster.task_type,
+                data=f"{SUBJECTS[subject]} {VERDICTS[verdict]}{DETAILS[detail]}",
+                ai_confidence=round(float(confidence[i]), 4),
+                processing_status="COMPLETED" if fully_labelled else ("REVIEW_NEEDED" if labelled[i] or not is_ai else "PENDING"),
+                review_status="COMPLETED" if fully_labelled else None,
+                human_reviewed=bool(labelled[i]),
+                used_data_points=int(data_points[i]),
+                created_at=created_at,
+                updated_at=created_at,
+            )
+            if is_file_cluster:
+                task.data = ""
+                task.file_name = f"image_{cluster.id}_{i}.png"
+                task.file_type = "png"
+                task.file_url = f"https://example.com/images/{cluster.id}/{i}.png"
+                task.file_size_bytes = float(rng.integers(20_000, 5_000_000))
+            tasks.append(task)
+
+        # the batches are only inserted together, so they are checked against each other's numbers too
+        used_serial_numbers = set()
+        for start in range(0, len(tasks), self.batch_size):
+            assign_serial_numbers(tasks[start:start + self.batch_size], used=used_serial_numbers)
+        self.counts["tasks"] += len(tasks)
+        return self.insert(Task, tasks, copy=True)
+
+    def create_labels(self, cluster, tasks, labellers, order, voted, votes):
+        # labels trickle in over the week after the task was submitted
+        task_indexes, columns = np.nonzero(voted)
+        delays = self.rng.exponential(24 * 3600, len(task_indexes))
+        labels = []
+        for task_index, column, delay in zip(task_indexes.tolist(), columns.tolist(), delays.tolist()):
+            task = tasks[task_index]
+            created_at = min(task.created_at + datetime.timedelta(seconds=delay), self.end)
+            labels.append(TaskLabel(
+                task_id=task.id,
+                labeller_id=labellers[order[task_index, column]].id,
+                label=LABEL_CHOICES[votes[task_index, column]],
+                created_at=created_at,
+                updated_at=created_at,
+            ))
+        self.counts["labels"] += len(labels)
+        self.insert(TaskLabel, labels, copy=True)
+
+    def create_earnings(self, reviewers):
+        end = self.end.date()
+        months = sorted({(day.year, day.month) for day in (end - datetime.timedelta(days=offset) for offset in range(self.options["days"] + 1))})
+        earnings = []
+        for reviewer in reviewers:
+            amounts = self.rng.gamma(2, 40, len(months))
+            for (year, month), amount in zip(months, amounts):
+                if datetime.date(year, month, 1) < reviewer.date_joined.date().replace(day=1):
+                    continue
+                current = (year, month) == (end.year, end.month)
+                created_at = timezone.make_aware(datetime.datetime(year, month, 1))
+                earnings.append(MonthlyReviewerEarnings(
+                    reviewer=reviewer,
+                    year=year,
+                    month=month,
+                    total_earnings_usd=round(float(amount), 4),
+                    usd_balance=round(float(amount), 4) if current else 0,
+                    release_status=MonthlyEarningsReleaseStatusChoices.PENDING if current else MonthlyEarningsReleaseStatusChoices.RELEASED,
+                    created_at=created_at,
+                    updated_at=created_at,
+                ))
+        self.insert(MonthlyReviewerEarnings, earnings)
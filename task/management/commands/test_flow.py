@@ -14,6 +14,39 @@ import websocket
 
 from account.models import User
 
+# the steps of the flow, shared with the load_test command
+FLOW_ENDPOINTS = {
+    "register": "/api/v1/account/register/",
+    "login": "/api/v1/account/login/",
+    "project_list": "/api/v1/account/organization/project/list/",
+    "create_project": "/api/v1/account/organization/project/",
+    "create_task": "/api/v1/tasks/",
+    "subscription_plans": "/api/v1/subscription/plans",
+    "initialize_subscription": "/api/v1/subscription/initialize/",
+    "generate_production_key": "/api/v1/keys/generate/production/",
+    "task_websocket": "/ws/task/",
+}
+
+
+def register_payload(user_data):
+    return {"role": "organization", **user_data}
+
+
+def project_payload(user_data):
+    return {
+        "name": f"Project-{user_data.get('username')}",
+        "Description": f"A project created during testing for {user_data.get('username')}",
+    }
+
+
+def task_payload(project_id):
+    return {
+        "task_type": "TEXT",
+        "data": "You are very very stupid",
+        "priority": "NORMAL",
+        "group": project_id,
+    }
+
 
 class FlowTest:
     def __init__(self, user_data, base_url="http://localhost:8080") -> None:
@@ -39,8 +72,8 @@ class FlowTest:
 
     def register(self):
         """Register a new user"""
-        url = f"{self.base_url}/api/v1/account/register/"
-        req_data = {"role": "organization", **self.user_data}
+        url = f"{self.base_url}{FLOW_ENDPOINTS['register']}"
+        req_data = register_payload(self.user_data)
         response = self.session.post(url, json=req_data)
 
         if response.status_code == 201:
@@ -58,7 +91,7 @@ class FlowTest:
 
     def login(self):
         """Login user and store auth token"""
-        url = f"{self.base_url}/api/v1/account/login/"
+        url = f"{self.base_url}{FLOW_ENDPOINTS['login']}"
         login_data = {
             "username": self.user_data["username"],
             "password": self.user_data["password"],
@@ -86,7 +119,7 @@ class FlowTest:
 
     def get_user_projects(self):
         self.log("Getting user project list")
-        url = f"{self.base_url}/api/v1/account/organization/project/list/"
+        url = f"{self.base_url}{FLOW_ENDPOINTS['project_list']}"
         response = self.session.get(url)
         if response.status_code == 200:
             self.log("Successfully retrieved users projects")
@@ -181,16 +214,11 @@ class FlowTest:
     def create_user_task(self):
         user_projects = self.get_user_projects()
         if len(user_projects) > 0:
-            url = f"{self.base_url}/api/v1/tasks/"
+            url = f"{self.base_url}{FLOW_ENDPOINTS['create_task']}"
             selected_project = user_projects[0]
             self.log(f"Creating dummy task for project {selected_project.get('name')}")
 
-            req_data = {
-                "task_type": "TEXT",
-                "data": "You are very very stupid",
-                "priority": "NORMAL",
-                "group": selected_project.get("id"),
-            }
+            req_data = task_payload(selected_project.get("id"))
             response = self.session.post(url, json=req_data)
             if response.status_code == 200 or response.status_code == 201:
                 self.log("Successfully created dummy task")
@@ -215,11 +243,8 @@ class FlowTest:
 
     def create_project(self):
         self.log("Creating project")
-        url = f"{self.base_url}/api/v1/account/organization/project/"
-        req_data = {
-            "name": f"Project-{self.user_data.get('username')}",
-            "Description": f"A project created during testing for {self.user_data.get('username')}",
-        }
+        url = f"{self.base_url}{FLOW_ENDPOINTS['create_project']}"
+        req_data = project_payload(self.user_data)
         response = self.session.post(url, req_data)
         if response.status_code == 200 or response.status_code == 201:
             self.log("Project created successfully")
@@ -233,7 +258,7 @@ class FlowTest:
 
     def get_subscriptions_plans(self):
         self.log("Getting plans lit")
-        url = f"{self.base_url}/api/v1/subscription/plans"
+        url = f"{self.base_url}{FLOW_ENDPOINTS['subscription_plans']}"
         response = self.session.get(url)
 
         if response.status_code == 200:
@@ -255,7 +280,7 @@ class FlowTest:
             self.log(
                 f"Generating stripe url for payment for plan {selected_plan.get('name')}"
             )
-            url = f"{self.base_url}/api/v1/subscription/initialize/"
+            url = f"{self.base_url}{FLOW_ENDPOINTS['initialize_subscription']}"
             req_data = {"subscription_plan": selected_plan.get("id")}
             response = self.session.post(url, req_data)
             if response.status_code == 200:
@@ -273,7 +298,7 @@ class FlowTest:
 
     def generate_production_key(self):
         self.log("Generating api key..")
-        url = f"{self.base_url}/api/v1/keys/generate/production/"
+        url = f"{self.base_url}{FLOW_ENDPOINTS['generate_production_key']}"
         req_data = {"key_name": {f"{self.user_data.get('username')}-prod-key"}}
         response = self.session.post(url, req_data)
         if response.status_code == 200 or response.status_code == 201:
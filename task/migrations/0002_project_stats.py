@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_project_stats(apps, schema_editor):
+    Project = apps.get_model('account', 'Project')
+    ProjectStats = apps.get_model('task', 'ProjectStats')
+
+    projects = Project.objects.annotate(
+        total_clusters=Count('clusters'),
+        pending_clusters=Count('clusters', filter=Q(clusters__status='pending')),
+        in_review_clusters=Count('clusters', filter=Q(clusters__status='in_review')),
+        completed_clusters=Count('clusters', filter=Q(clusters__status='completed')),
+        completion_percentage_sum=Sum('clusters__completion_percentage'),
+    )
+    ProjectStats.objects.bulk_create([
+        ProjectStats(
+            project_id=project.id,
+            total_clusters=project.total_clusters,
+            pending_clusters=project.pending_clusters,
+            in_review_clusters=project.in_review_clusters,
+            completed_clusters=project.completed_clusters,
+            completion_percentage_sum=project.completion_percentage_sum or 0,
+        )
+        for project in projects.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_add_project_member_and_invitation_models'),
+        ('task', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_clusters', models.IntegerField(default=0)),
+                ('pending_clusters', models.IntegerField(default=0)),
+                ('in_review_clusters', models.IntegerField(default=0)),
+                ('completed_clusters', models.IntegerField(default=0)),
+                ('completion_percentage_sum', models.FloatField(default=0, help_text='Sum of the completion percentage of every cluster in the project')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='account.project')),
+            ],
+        ),
+        migrations.RunPython(backfill_project_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_project_daily_stats(apps, schema_editor):
+    Task = apps.get_model('task', 'Task')
+    TaskCluster = apps.get_model('task', 'TaskCluster')
+    ProjectDailyStats = apps.get_model('task', 'ProjectDailyStats')
+
+    days = {}
+    task_totals = Task.objects.annotate(date=TruncDate('created_at')).values('group_id', 'date').annotate(
+        task_count=Count('id'),
+        total_data_points=Sum('used_data_points'),
+        human_reviewed_count=Count('id', filter=Q(human_reviewed=True)),
+        ai_confidence_sum=Sum('ai_confidence'),
+    ).order_by()
+    for totals in task_totals:
+        day = days.setdefault((totals.pop('group_id'), totals.pop('date')), {})
+        day.update({field: value or 0 for field, value in totals.items()})
+
+    cluster_totals = TaskCluster.objects.annotate(date=TruncDate('created_at')).values('project_id', 'date').annotate(
+        pending_clusters=Count('id', filter=Q(status='pending')),
+        in_review_clusters=Count('id', filter=Q(status='in_review')),
+        completed_clusters=Count('id', filter=Q(status='completed')),
+    ).order_by()
+    for totals in cluster_totals:
+        days.setdefault((totals.pop('project_id'), totals.pop('date')), {}).update(totals)
+
+    ProjectDailyStats.objects.bulk_create(
+        [ProjectDailyStats(project_id=project_id, date=date, **totals) for (project_id, date), totals in days.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_add_project_member_and_invitation_models'),
+        ('task', '0002_project_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('task_count', models.IntegerField(default=0)),
+                ('total_data_points', models.IntegerField(default=0)),
+                ('human_reviewed_count', models.IntegerField(default=0)),
+                ('ai_confidence_sum', models.FloatField(default=0, help_text="Sum of the ai confidence of the day's tasks, divide by task_count for the average")),
+                ('pending_clusters', models.IntegerField(default=0)),
+                ('in_review_clusters', models.IntegerField(default=0)),
+                ('completed_clusters', models.IntegerField(default=0)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='account.project')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('project', 'date'), name='unique_project_daily_stats')],
+            },
+        ),
+        migrations.RunPython(backfill_project_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0003_project_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='consensus',
+            field=models.JSONField(blank=True, help_text="How the labellers' votes were reduced to the final label: votes per label, agreement and whether the top labels tied", null=True),
+        ),
+        migrations.CreateModel(
+            name='ClusterConsensus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_totals', models.JSONField(default=dict, help_text='Number of votes per label across the cluster')),
+                ('agreement_sum', models.FloatField(default=0, help_text='Sum of the agreement of every task with at least two votes')),
+                ('scored_tasks', models.IntegerField(default=0, help_text='Number of tasks with at least two votes')),
+                ('labelled_tasks', models.IntegerField(default=0, help_text='Number of tasks with at least one vote')),
+                ('kappa', models.FloatField(blank=True, help_text="Fleiss' kappa of the cluster", null=True)),
+                ('computed_at', models.DateTimeField(blank=True, null=True)),
+                ('cluster', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='consensus', to='task.taskcluster')),
+            ],
+        ),
+    ]
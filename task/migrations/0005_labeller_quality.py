@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewer', '0001_initial'),
+        ('task', '0004_cluster_consensus'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabellerQuality',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scored_votes', models.IntegerField(default=0, help_text='Votes on tasks with a clear majority label')),
+                ('agreeing_votes', models.IntegerField(default=0, help_text='Votes that match the majority label of their task')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('domain', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='labeller_quality', to='reviewer.labelerdomain')),
+                ('labeller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quality_scores', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('labeller', 'domain'), name='unique_labeller_quality_per_domain'), models.UniqueConstraint(condition=models.Q(('domain__isnull', True)), fields=('labeller',), name='unique_labeller_quality_without_domain')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0005_labeller_quality'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterIngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(blank=True, null=True, upload_to='cluster_ingestion/')),
+                ('file_format', models.CharField(choices=[('jsonl', 'JSONL'), ('csv', 'CSV')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('processed_rows', models.IntegerField(default=0, help_text='Rows of the file read so far, including invalid ones')),
+                ('created_tasks', models.IntegerField(default=0)),
+                ('failed_rows', models.IntegerField(default=0)),
+                ('row_errors', models.JSONField(blank=True, default=list, help_text='The first invalid rows and why they were skipped')),
+                ('error', models.TextField(blank=True, help_text='Why the job failed', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('cluster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='task.taskcluster')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cluster_ingestion_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_add_project_member_and_invitation_models'),
+        ('task', '0006_cluster_ingestion_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AICallTelemetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(choices=[('classification', 'Classification'), ('human_review', 'Human review')], max_length=20)),
+                ('model', models.CharField(max_length=100)),
+                ('latency_ms', models.FloatField()),
+                ('input_tokens', models.IntegerField(blank=True, help_text='Billed input tokens, when the response reports them', null=True)),
+                ('output_tokens', models.IntegerField(blank=True, help_text='Billed output tokens, when the response reports them', null=True)),
+                ('retries', models.IntegerField(default=0)),
+                ('breaker_state', models.CharField(blank=True, help_text='State of the circuit breaker guarding the client, null when there is none', max_length=20, null=True)),
+                ('outcome', models.CharField(choices=[('success', 'Success'), ('no_json', 'No JSON'), ('parse_failure', 'Parse failure'), ('error', 'Error')], max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cluster', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_calls', to='task.taskcluster')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_calls', to='account.project')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_calls', to='task.task')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['project', 'created_at'], name='task_aicall_project_f54e0a_idx'), models.Index(fields=['cluster', 'created_at'], name='task_aicall_cluster_636a15_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:39
+
+from django.db import migrations, models
+
+
+def move_labeller_agreement(apps, schema_editor):
+    Task = apps.get_model('task', 'Task')
+
+    tasks = []
+    for task in Task.objects.filter(consensus__has_key='labeller_agreement').only('id', 'consensus').iterator(chunk_size=1000):
+        task.labeller_agreement = task.consensus.pop('labeller_agreement')
+        tasks.append(task)
+    Task.objects.bulk_update(tasks, ['consensus', 'labeller_agreement'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0007_ai_call_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='labeller_agreement',
+            field=models.JSONField(blank=True, help_text='Whether each labeller agreed with the majority label, kept apart from consensus as it is not shown to the project', null=True),
+        ),
+        migrations.RunPython(move_labeller_agreement, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_unfinished_uploads(apps, schema_editor):
+    """Move the files of the jobs that still have rows to read into the database"""
+    ClusterIngestionJob = apps.get_model('task', 'ClusterIngestionJob')
+    ClusterIngestionChunk = apps.get_model('task', 'ClusterIngestionChunk')
+
+    for job in ClusterIngestionJob.objects.filter(status__in=['pending', 'processing']).exclude(file=''):
+        try:
+            with job.file.open('rb') as file:
+                for index, data in enumerate(file.chunks(1024 * 1024)):
+                    ClusterIngestionChunk.objects.create(job=job, index=index, data=data)
+        except OSError:
+            # written by another container, the job fails when it finds no rows
+            pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0008_task_labeller_agreement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterIngestionChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='task.clusteringestionjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'index'), name='unique_cluster_ingestion_chunk')],
+            },
+        ),
+        migrations.RunPython(copy_unfinished_uploads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='clusteringestionjob',
+            name='file',
+        ),
+    ]
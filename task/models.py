@@ -1,8 +1,13 @@
-from django.db import models
+import datetime
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 import string
 import random
 from account.models import User, Project, ProjectLog
-from task.choices import AnnotationMethodChoices, ManualReviewSessionStatusChoices, TaskClusterStatusChoices, TaskInputTypeChoices, TaskTypeChoices
+from task.choices import AICallOperationChoices, AICallOutcomeChoices, AnnotationMethodChoices, ClusterIngestionStatusChoices, ManualReviewSessionStatusChoices, TaskClusterStatusChoices, TaskInputTypeChoices, TaskTypeChoices
 from reviewer.models import LabelerDomain
 
 
@@ -27,7 +32,50 @@ def get_default_labeler_domain(as_id=True):
     #     return labeler_domain.id
     return None
 
-class TaskCluster(models.Model):
+
+class StatsSourceMixin:
+    """
+    For models whose STATS_FIELDS feed the project statistics and daily rollups. Saving any of those fields
+    runs in a transaction in which the task.signals handlers lock the stored row. A save that changes none of
+    them since the instance was loaded leaves them out of its UPDATE instead. It then needs no lock and cannot
+    write back values another writer changed in the meantime.
+    """
+    STATS_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stats = instance._stats_values()
+        return instance
+
+    def _stats_values(self):
+        # deferred fields are not loaded, they count as changed
+        return {field: self.__dict__.get(field, models.DEFERRED) for field in self.STATS_FIELDS}
+
+    def _saves_stats(self, update_fields):
+        return update_fields is None or any(field in update_fields or field.removesuffix("_id") in update_fields for field in self.STATS_FIELDS)
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, "_loaded_stats", None)
+        if (
+            not args and kwargs.get("update_fields") is None and not self._state.adding
+            and loaded is not None and models.DEFERRED not in loaded.values() and loaded == self._stats_values()
+        ):
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in self.STATS_FIELDS and field.attname not in deferred
+            ]
+
+        if not args and not self._saves_stats(kwargs.get("update_fields")):
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_stats = self._stats_values()
+
+
+class TaskCluster(StatsSourceMixin, models.Model):
     """
     A TaskCluster represents a batch of related tasks that share common properties and are assigned to the same group of reviewers.
     
@@ -37,6 +85,9 @@ class TaskCluster(models.Model):
     - Support for both manual and AI-automated annotation methods
     Each cluster can contain multiple tasks and can be assigned to multiple reviewers simultaneously.
     """
+    # the project statistics and the daily rollups are derived from these, see task.signals
+    STATS_FIELDS = ("project_id", "status", "completion_percentage", "created_at")
+
     name= models.CharField(max_length=100, default="Default")
     description= models.TextField(default="Default")
     input_type = models.CharField(max_length=25, help_text="The type of input the labeller is to provide for the tasks in this cluster", choices=TaskInputTypeChoices.choices, default=TaskInputTypeChoices.TEXT)
@@ -73,6 +124,7 @@ class TaskCluster(models.Model):
             self.status = TaskClusterStatusChoices.PENDING
             
         self.save()
+
     
     def __str__(self):
         return f"{self.name} ({self.task_type}) - {self.project.name}"
@@ -80,6 +132,197 @@ class TaskCluster(models.Model):
     class Meta:
         ordering = ["-created_at"]
 
+
+class ProjectStats(models.Model):
+    """
+    Cluster statistics of a project, kept up to date incrementally by the TaskCluster signals
+    so listing projects does not have to count clusters for every project.
+    Use `rebuild` (or the rebuild_project_stats command) to recompute it from scratch; `reconcile_project_stats`
+    does so every night to repair drift from bulk writes.
+    """
+    STATUS_FIELDS = {
+        TaskClusterStatusChoices.PENDING: "pending_clusters",
+        TaskClusterStatusChoices.IN_REVIEW: "in_review_clusters",
+        TaskClusterStatusChoices.COMPLETED: "completed_clusters",
+    }
+
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name="stats")
+    total_clusters = models.IntegerField(default=0)
+    pending_clusters = models.IntegerField(default=0)
+    in_review_clusters = models.IntegerField(default=0)
+    completed_clusters = models.IntegerField(default=0)
+    completion_percentage_sum = models.FloatField(default=0, help_text="Sum of the completion percentage of every cluster in the project")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def completion_percentage(self):
+        return self.completion_percentage_sum / self.total_clusters if self.total_clusters else 0
+
+    def as_task_stats(self):
+        return {
+            "total_tasks": self.total_clusters,
+            "completed_tasks": self.completed_clusters,
+            "pending_review": self.pending_clusters,
+            "in_progress": self.in_review_clusters,
+            "completion_percentage": round(self.completion_percentage, 2),
+        }
+
+    @classmethod
+    def rebuild(cls, project_id):
+        """
+        Recompute the statistics of a project from its clusters. Rebuilds of a project are serialized on its
+        statistics row, and wait for the cluster saves holding it, so an older count never overwrites a newer one.
+        """
+        with transaction.atomic():
+            locked = bool(list(cls.objects.select_for_update().filter(project_id=project_id).values_list("id", flat=True)))
+            totals = TaskCluster.objects.filter(project_id=project_id).aggregate(
+                total_clusters=Count("id"),
+                completion_percentage_sum=Sum("completion_percentage"),
+                **{field: Count("id", filter=Q(status=status)) for status, field in cls.STATUS_FIELDS.items()},
+            )
+            totals["completion_percentage_sum"] = totals["completion_percentage_sum"] or 0
+            if locked:
+                cls.objects.filter(project_id=project_id).update(**totals)
+                return cls.objects.get(project_id=project_id)
+        try:
+            with transaction.atomic():
+                return cls.objects.create(project_id=project_id, **totals)
+        except IntegrityError:
+            if not cls.objects.filter(project_id=project_id).exists():
+                # not a concurrent create, e.g. the project is gone
+                raise
+            # created concurrently, count again under its lock
+            return cls.rebuild(project_id)
+
+    @classmethod
+    def apply_delta(cls, project_id, total_clusters=0, completion_percentage=0, statuses=None):
+        """
+        Add to the statistics of a project in one UPDATE, `statuses` maps cluster statuses to count changes.
+        Returns False when the project has no statistics row yet.
+        """
+        changes = {}
+        if total_clusters:
+            changes["total_clusters"] = F("total_clusters") + total_clusters
+        if completion_percentage:
+            changes["completion_percentage_sum"] = F("completion_percentage_sum") + completion_percentage
+        for status, count in (statuses or {}).items():
+            field = cls.STATUS_FIELDS.get(status)
+            if field and count:
+                changes[field] = F(field) + count
+        if not changes:
+            return True
+        return cls.objects.filter(project_id=project_id).update(**changes) > 0
+
+    def __str__(self):
+        return f"Stats for {self.project_id}"
+
+
+class ProjectDailyStats(models.Model):
+    """
+    Per-project, per-day rollup of task and cluster activity used by the project charts.
+
+    Rows are updated incrementally by the Task and TaskCluster signals and recomputed every night for the
+    last few days by `reconcile_project_daily_stats`, which also repairs drift from bulk writes.
+    Tasks are counted on the day they were created, clusters on the day they were created with their current status.
+    """
+    STATUS_FIELDS = ProjectStats.STATUS_FIELDS
+    COUNTER_FIELDS = [
+        "task_count", "total_data_points", "human_reviewed_count", "ai_confidence_sum",
+        "pending_clusters", "in_review_clusters", "completed_clusters",
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="daily_stats")
+    date = models.DateField()
+    task_count = models.IntegerField(default=0)
+    total_data_points = models.IntegerField(default=0)
+    human_reviewed_count = models.IntegerField(default=0)
+    ai_confidence_sum = models.FloatField(default=0, help_text="Sum of the ai confidence of the day's tasks, divide by task_count for the average")
+    pending_clusters = models.IntegerField(default=0)
+    in_review_clusters = models.IntegerField(default=0)
+    completed_clusters = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["date"]
+        constraints = [
+            models.UniqueConstraint(fields=["project", "date"], name="unique_project_daily_stats"),
+        ]
+
+    @classmethod
+    def apply_delta(cls, project_id, date, create=True, statuses=None, **deltas):
+        """
+        Add to the counters of one project day in a single UPDATE, creating the row when it does not exist yet.
+        `statuses` maps cluster statuses to count changes, the other keyword arguments are counter fields.
+        """
+        changes = {field: F(field) + amount for field, amount in deltas.items() if amount}
+        for status, count in (statuses or {}).items():
+            field = cls.STATUS_FIELDS.get(status)
+            if field and count:
+                changes[field] = F(field) + count
+        if not changes:
+            return
+
+        if cls.objects.filter(project_id=project_id, date=date).update(**changes) or not create:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(project_id=project_id, date=date)
+        except IntegrityError:
+            # created concurrently
+            pass
+        cls.objects.filter(project_id=project_id, date=date).update(**changes)
+
+    @classmethod
+    def rebuild(cls, since, until=None, project_ids=None):
+        """Recompute the rows from `since` to `until` (dates, inclusive) from the tasks and clusters, returns the number of rows"""
+        until = until or timezone.localdate()
+        start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+        end = timezone.make_aware(datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time.min))
+
+        tasks = Task.objects.filter(created_at__gte=start, created_at__lt=end)
+        clusters = TaskCluster.objects.filter(created_at__gte=start, created_at__lt=end)
+        rows = cls.objects.filter(date__gte=since, date__lte=until)
+        if project_ids is not None:
+            tasks = tasks.filter(group_id__in=project_ids)
+            clusters = clusters.filter(project_id__in=project_ids)
+            rows = rows.filter(project_id__in=project_ids)
+
+        with transaction.atomic():
+            # deltas to the existing rows wait until the totals below are written, and the ones that ran
+            # before are already part of them
+            existing = {(project_id, date): row_id for row_id, project_id, date in rows.select_for_update().values_list("id", "project_id", "date")}
+
+            days = {}
+            task_totals = tasks.annotate(date=TruncDate("created_at")).values("group_id", "date").annotate(
+                task_count=Count("id"),
+                total_data_points=Sum("used_data_points"),
+                human_reviewed_count=Count("id", filter=Q(human_reviewed=True)),
+                ai_confidence_sum=Sum("ai_confidence"),
+            ).order_by()
+            for totals in task_totals:
+                day = days.setdefault((totals.pop("group_id"), totals.pop("date")), {})
+                day.update({field: value or 0 for field, value in totals.items()})
+
+            cluster_totals = clusters.annotate(date=TruncDate("created_at")).values("project_id", "date").annotate(
+                **{field: Count("id", filter=Q(status=status)) for status, field in cls.STATUS_FIELDS.items()}
+            ).order_by()
+            for totals in cluster_totals:
+                days.setdefault((totals.pop("project_id"), totals.pop("date")), {}).update(totals)
+
+            cls.objects.filter(id__in=[row_id for key, row_id in existing.items() if key not in days]).delete()
+            # rows created by a delta since the lock was taken are overwritten rather than conflicting
+            cls.objects.bulk_create(
+                [cls(project_id=project_id, date=date, **totals) for (project_id, date), totals in days.items()],
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=["project", "date"],
+                update_fields=cls.COUNTER_FIELDS,
+            )
+        return len(days)
+
+    def __str__(self):
+        return f"{self.project_id} - {self.date}"
+
+
 class MultiChoiceOption(models.Model):
     """
     MultiChoiceOption represents predefined label choices for tasks within a cluster.
@@ -100,10 +343,12 @@ class MultiChoiceOption(models.Model):
         return f"{self.option_text} ({self.cluster.name})"
     
 
-class Task(models.Model):
+class Task(StatsSourceMixin, models.Model):
     """
     A task is a single object to be annotated, it can be a text, a single image, video, csv file, e.t.c
     """
+    # the daily rollups are derived from these, see task.signals
+    STATS_FIELDS = ("group_id", "created_at", "used_data_points", "human_reviewed", "ai_confidence")
    
     PRIORITY_LEVELS = (
         ("URGENT", "Urgent"),
@@ -154,6 +399,14 @@ class Task(models.Model):
         null=True, blank=True, help_text="Human-reviewed final label"
     )
 
+    consensus = models.JSONField(
+        null=True, blank=True, help_text="How the labellers' votes were reduced to the final label: votes per label, agreement and whether the top labels tied"
+    )
+
+    labeller_agreement = models.JSONField(
+        null=True, blank=True, help_text="Whether each labeller agreed with the majority label, kept apart from consensus as it is not shown to the project"
+    )
+
     # Task status and review tracking
     processing_status = models.CharField(
         max_length=17, choices=PROCESSING_STATUS_CHOICES, default="PENDING"
@@ -266,6 +519,174 @@ class TaskLabel(models.Model):
     def __str__(self):
         return f"{self.task.serial_no} - {self.labeller.username}"
 
+class ClusterConsensus(models.Model):
+    """
+    Cluster-level consensus between labellers, maintained by `task.consensus.update_cluster_consensus`.
+
+    The running totals (votes per label and the sum of per-task agreement) are what Fleiss' kappa is computed
+    from, so a run only has to reprocess the tasks that received labels since `computed_at`.
+    """
+    cluster = models.OneToOneField(TaskCluster, on_delete=models.CASCADE, related_name="consensus")
+    category_totals = models.JSONField(default=dict, help_text="Number of votes per label across the cluster")
+    agreement_sum = models.FloatField(default=0, help_text="Sum of the agreement of every task with at least two votes")
+    scored_tasks = models.IntegerField(default=0, help_text="Number of tasks with at least two votes")
+    labelled_tasks = models.IntegerField(default=0, help_text="Number of tasks with at least one vote")
+    kappa = models.FloatField(null=True, blank=True, help_text="Fleiss' kappa of the cluster")
+    computed_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def mean_agreement(self):
+        return self.agreement_sum / self.scored_tasks if self.scored_tasks else None
+
+    def __str__(self):
+        return f"Consensus for cluster {self.cluster_id}"
+
+
+class LabellerQuality(models.Model):
+    """
+    Running agreement between a labeller's votes and the consensus of the tasks they labelled, per domain.
+
+    Maintained by `task.consensus.update_cluster_consensus`: a vote counts once its task has at least two votes
+    and a majority label that is not tied, and agrees when it matches that label. Clusters without a domain
+    are counted under a null domain.
+    """
+    # an unproven labeller is ranked as if they had this many votes at PRIOR_AGREEMENT
+    PRIOR_VOTES = 10
+    PRIOR_AGREEMENT = 0.75
+
+    labeller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="quality_scores")
+    domain = models.ForeignKey(LabelerDomain, on_delete=models.CASCADE, null=True, blank=True, related_name="labeller_quality")
+    scored_votes = models.IntegerField(default=0, help_text="Votes on tasks with a clear majority label")
+    agreeing_votes = models.IntegerField(default=0, help_text="Votes that match the majority label of their task")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["labeller", "domain"], name="unique_labeller_quality_per_domain"),
+            models.UniqueConstraint(fields=["labeller"], condition=Q(domain__isnull=True), name="unique_labeller_quality_without_domain"),
+        ]
+
+    @property
+    def agreement_rate(self):
+        return self.agreeing_votes / self.scored_votes if self.scored_votes else None
+
+    @property
+    def score(self):
+        """Agreement rate smoothed towards PRIOR_AGREEMENT, so a handful of votes cannot dominate the ranking"""
+        return (self.agreeing_votes + self.PRIOR_VOTES * self.PRIOR_AGREEMENT) / (self.scored_votes + self.PRIOR_VOTES)
+
+    @classmethod
+    def score_expression(cls, prefix=""):
+        """The `score` property as a database expression over the fields found at `prefix`"""
+        return ExpressionWrapper(
+            (F(f"{prefix}agreeing_votes") + cls.PRIOR_VOTES * cls.PRIOR_AGREEMENT) * 1.0
+            / (F(f"{prefix}scored_votes") + cls.PRIOR_VOTES),
+            output_field=models.FloatField(),
+        )
+
+    @classmethod
+    def apply_deltas(cls, domain_id, deltas):
+        """
+        Add {labeller_id: (scored_votes, agreeing_votes)} deltas to the rows of a domain, creating missing rows.
+        """
+        deltas = {labeller_id: delta for labeller_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        cls.objects.bulk_create(
+            [cls(labeller_id=labeller_id, domain_id=domain_id) for labeller_id in deltas],
+            ignore_conflicts=True,
+        )
+        for labeller_id, (scored, agreeing) in deltas.items():
+            cls.objects.filter(labeller_id=labeller_id, domain_id=domain_id).update(
+                scored_votes=F("scored_votes") + scored,
+                agreeing_votes=F("agreeing_votes") + agreeing,
+                updated_at=timezone.now(),
+            )
+
+    def __str__(self):
+        return f"{self.labeller_id} - {self.domain_id}: {self.agreeing_votes}/{self.scored_votes}"
+
+
+class ClusterIngestionJob(models.Model):
+    """
+    A JSONL or CSV file of tasks being added to a cluster by `task.ingestion.ingest_cluster_file`.
+
+    Rows are turned into tasks in batches, and each batch is committed together with the counters below,
+    so a job picked up again after a worker dies resumes after the last committed row. The file itself is
+    kept in ClusterIngestionChunk rows, as the worker does not share a file system with the web process.
+    """
+    FORMAT_CHOICES = (
+        ("jsonl", "JSONL"),
+        ("csv", "CSV"),
+    )
+
+    cluster = models.ForeignKey(TaskCluster, on_delete=models.CASCADE, related_name="ingestion_jobs")
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cluster_ingestion_jobs")
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=ClusterIngestionStatusChoices.choices, default=ClusterIngestionStatusChoices.PENDING)
+    processed_rows = models.IntegerField(default=0, help_text="Rows of the file read so far, including invalid ones")
+    created_tasks = models.IntegerField(default=0)
+    failed_rows = models.IntegerField(default=0)
+    row_errors = models.JSONField(default=list, blank=True, help_text="The first invalid rows and why they were skipped")
+    error = models.TextField(null=True, blank=True, help_text="Why the job failed")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Ingestion {self.id} for cluster {self.cluster_id} ({self.status})"
+
+
+class ClusterIngestionChunk(models.Model):
+    """A consecutive piece of the file of a ClusterIngestionJob, deleted once the job has turned it into tasks"""
+    job = models.ForeignKey(ClusterIngestionJob, on_delete=models.CASCADE, related_name="chunks")
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["job", "index"], name="unique_cluster_ingestion_chunk"),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.index} of ingestion {self.job_id}"
+
+
+class AICallTelemetry(models.Model):
+    """
+    One call to the LLM made by `task.ai_processor`, recorded by `task.ai_telemetry.CallTelemetry`.
+
+    Retries of a call are part of the same row, so `latency_ms` is the wall time the caller waited, backoff
+    included. Rows are aggregated per project or cluster by `task.ai_telemetry.get_ai_usage`.
+    """
+    operation = models.CharField(max_length=20, choices=AICallOperationChoices.choices)
+    model = models.CharField(max_length=100)
+    task = models.ForeignKey(Task, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_calls")
+    cluster = models.ForeignKey(TaskCluster, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_calls")
+    project = models.ForeignKey(Project, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_calls")
+    latency_ms = models.FloatField()
+    input_tokens = models.IntegerField(null=True, blank=True, help_text="Billed input tokens, when the response reports them")
+    output_tokens = models.IntegerField(null=True, blank=True, help_text="Billed output tokens, when the response reports them")
+    retries = models.IntegerField(default=0)
+    breaker_state = models.CharField(max_length=20, null=True, blank=True, help_text="State of the circuit breaker guarding the client, null when there is none")
+    outcome = models.CharField(max_length=20, choices=AICallOutcomeChoices.choices)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["project", "created_at"]),
+            models.Index(fields=["cluster", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.operation} call {self.id} ({self.outcome}, {self.latency_ms:.0f}ms)"
+
+
 class ManualReviewSession(models.Model):
     """
     This model is used to track the progress of a human reviewer on the tasks in a task cluster
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.utils import timezone
+
+from account.models import Project
+
+from .models import ProjectDailyStats, ProjectStats
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def reconcile_project_daily_stats(days=None):
+    """
+    Nightly task that recomputes the daily project rollups of the last few days from the tasks and clusters,
+    repairing any drift from bulk writes or failed incremental updates.
+    """
+    days = days or settings.PROJECT_DAILY_STATS_RECONCILE_DAYS
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = ProjectDailyStats.rebuild(since)
+    logger.info(f"Reconciled {rows} project daily stats rows since {since}")
+    return rows
+
+
+@shared_task
+def reconcile_project_stats():
+    """
+    Nightly task that recomputes the cluster statistics of every project, repairing any drift from bulk writes
+    or failed incremental updates.
+    """
+    rebuilt = 0
+    for project_id in Project.objects.values_list("id", flat=True).iterator():
+        ProjectStats.rebuild(project_id)
+        rebuilt += 1
+    logger.info(f"Reconciled the statistics of {rebuilt} projects")
+    return rebuilt
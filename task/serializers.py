@@ -7,7 +7,7 @@ from reviewer.models import LabelerDomain
 from subscription.models import UserDataPoints
 from task.choices import AnnotationMethodChoices, ManualReviewSessionStatusChoices, TaskInputTypeChoices, TaskTypeChoices
 from task.utils import calculate_required_data_points
-from .models import ManualReviewSession, MultiChoiceOption, Task, TaskClassificationChoices, TaskCluster, TaskLabel, get_default_labeler_domain
+from .models import ClusterIngestionJob, LabellerQuality, ManualReviewSession, MultiChoiceOption, Task, TaskClassificationChoices, TaskCluster, TaskLabel, get_default_labeler_domain
 
 
 
@@ -124,7 +124,7 @@ class FullTaskSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = Task
-        fields = "__all__"
+        exclude = ["labeller_agreement"]
 
 class FileItemSerializer(serializers.Serializer):
     """
@@ -198,22 +198,12 @@ class TaskClusterCreateSerializer(serializers.ModelSerializer):
         Raises:
             ValidationError: For various validation failures
         """
-        attrs = super().validate(attrs)
+        attrs = self.validate_cluster_settings(super().validate(attrs))
         task_type = attrs.get('task_type')
 
-        if attrs.get('annotation_method') == AnnotationMethodChoices.AI_AUTOMATED and task_type != TaskTypeChoices.TEXT:
-            raise serializers.ValidationError("AI annotation is currently only supported for text-based tasks.")
-
         tasks_data = attrs.get("tasks", [])
         if len(tasks_data) == 0:
             raise serializers.ValidationError("Cannot create an empty cluster")
-        
-        labelling_choices = attrs.get('labelling_choices', [])
-        if attrs.get('input_type') == TaskInputTypeChoices.MULTIPLE_CHOICE and len(labelling_choices) ==0:
-            raise serializers.ValidationError(f"Must specify at least one labelling choice for a Multiple choice labelling input type")
-        
-        if attrs.get("labeller_per_item_count") < 15:
-            raise serializers.ValidationError("The number of labellers must be 15 or greater")
 
         #TODO: remove this later if not needed
         total_required_dp = 0
@@ -244,6 +234,23 @@ class TaskClusterCreateSerializer(serializers.ModelSerializer):
         attrs['required_data_points'] = total_required_dp
         return attrs
     
+    def validate_cluster_settings(self, attrs):
+        """
+        Validate the settings of the cluster itself, independently of how its tasks are submitted.
+        """
+        task_type = attrs.get('task_type')
+
+        if attrs.get('annotation_method') == AnnotationMethodChoices.AI_AUTOMATED and task_type != TaskTypeChoices.TEXT:
+            raise serializers.ValidationError("AI annotation is currently only supported for text-based tasks.")
+
+        labelling_choices = attrs.get('labelling_choices', [])
+        if attrs.get('input_type') == TaskInputTypeChoices.MULTIPLE_CHOICE and len(labelling_choices) ==0:
+            raise serializers.ValidationError(f"Must specify at least one labelling choice for a Multiple choice labelling input type")
+        
+        if attrs.get("labeller_per_item_count") < 15:
+            raise serializers.ValidationError("The number of labellers must be 15 or greater")
+        return attrs
+    
     def create(self, validated_data):
         """
         Create a new task cluster with the validated data.
@@ -267,6 +274,43 @@ class TaskClusterCreateSerializer(serializers.ModelSerializer):
             validated_data['labeler_domain'] = default_domain
         return super().create(validated_data)
     
+class TaskClusterIngestSerializer(TaskClusterCreateSerializer):
+    """
+    Serializer for creating a task cluster whose tasks are uploaded as a JSONL or CSV file.
+
+    The cluster settings are validated like in TaskClusterCreateSerializer, the rows of the file
+    are only read later by `task.ingestion.ingest_cluster_file`.
+    """
+    tasks = None
+    file = serializers.FileField(write_only=True)
+    labelling_choices = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+
+    def validate_file(self, file):
+        extension = file.name.rsplit(".", 1)[-1].lower()
+        if extension not in ["jsonl", "csv"]:
+            raise serializers.ValidationError("Only .jsonl and .csv files are supported")
+        return file
+
+    def validate(self, attrs):
+        attrs = self.validate_cluster_settings(attrs)
+        attrs['file_format'] = attrs['file'].name.rsplit(".", 1)[-1].lower()
+        attrs['required_data_points'] = 0
+        return attrs
+
+    def create(self, validated_data):
+        for field in ['file', 'file_format']:
+            validated_data.pop(field)
+        validated_data['tasks'] = []
+        validated_data.setdefault('labelling_choices', [])
+        return super().create(validated_data)
+
+
+class ClusterIngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ClusterIngestionJob
+        fields = "__all__"
+
+
 class MultipleChoicesSerializer(serializers.ModelSerializer):
     class Meta:
         fields = "__all__"
@@ -285,9 +329,20 @@ class TaskClusterListSerializer(serializers.ModelSerializer):
         model = TaskCluster
 
 
+class LabellerQualitySerializer(serializers.ModelSerializer):
+    domain_id = serializers.IntegerField(read_only=True)
+    domain = serializers.CharField(source="domain.domain", default=None, read_only=True)
+    agreement_rate = serializers.FloatField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+    class Meta:
+        model = LabellerQuality
+        fields = ["domain_id", "domain", "scored_votes", "agreeing_votes", "agreement_rate", "score", "updated_at"]
+
+
 class ListReviewersWithClustersSerializer(serializers.ModelSerializer):
     assigned_clusters = TaskClusterListSerializer(many=True, read_only=True)
     completed_clusters = serializers.SerializerMethodField() #the number of clusters this reviewer has completed
+    quality_scores = LabellerQualitySerializer(many=True, read_only=True) #agreement with consensus per domain
     class Meta:
         model = User
         fields = [
@@ -297,7 +352,7 @@ class ListReviewersWithClustersSerializer(serializers.ModelSerializer):
             "is_active",
             "assigned_clusters",
             "completed_clusters",
-            
+            "quality_scores",
         ]
     
     def get_completed_clusters(self, obj):
@@ -1,8 +1,13 @@
-from django.core.cache import cache
+from common.caching import invalidate_cache_tags
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 
-from task.models import Task, TaskCluster, TaskLabel
+from account.models import Project
+from django.utils import timezone
+
+from task.models import ProjectDailyStats, ProjectStats, Task, TaskCluster, TaskLabel
+from task.utils import clear_cluster_label_histogram, record_cluster_label
 
 
 @receiver([post_save, post_delete], sender=Task)
@@ -10,7 +15,7 @@ def invalidate_task_cache(sender, instance, **kwargs):
     """Invalidate all cache data for the task"""
     try:
         if hasattr(instance, 'user') and instance.user:
-            cache.delete_pattern(f"*task_completion_stats_{instance.user.id}*")
+            invalidate_cache_tags(f"task_completion_stats_{instance.user.id}")
     except Exception:
         pass
     
@@ -19,10 +24,9 @@ def invalidate_task_cluster_cache(sender, instance, **kwargs):
     """Invalidate all cache data for the task cluster"""
     try:
         if getattr(instance, "created_by", None) and instance.created_by_id:
-            cache.delete_pattern(f"*task_completion_stats_{instance.created_by_id}*")
-            cache.delete_pattern(f"*created_clusters_{instance.created_by_id}*")
+            invalidate_cache_tags(f"task_completion_stats_{instance.created_by_id}", f"created_clusters_{instance.created_by_id}")
 
-        cache.delete_pattern("*available_clusters*")
+        invalidate_cache_tags("available_clusters")
     except Exception:
         pass
 
@@ -33,11 +37,215 @@ def invalidate_task_label_cache(sender, instance, **kwargs):
     try:
         # Check if the task and cluster still exist before accessing them
         if hasattr(instance, 'task') and instance.task and hasattr(instance.task, 'cluster') and instance.task.cluster:
-            cache.delete_pattern(f"*cluster_annotation_progress_{instance.labeller.id}_GET_/api/v1/tasks/cluster/{instance.task.cluster.id}/progress/*")
+            invalidate_cache_tags(f"cluster_annotation_progress_{instance.labeller_id}_{instance.task.cluster_id}")
     except Exception:
         # This prevents errors during bulk delete operations
         pass
-    
-    
-    
-    
\ No newline at end of file
+
+
+@receiver(post_save, sender=TaskLabel)
+def count_label_in_cluster_histogram(sender, instance, created, **kwargs):
+    if not created:
+        return
+    cluster_id = instance.task.cluster_id
+    if cluster_id:
+        # after commit, so a histogram built concurrently from the database cannot already contain it
+        transaction.on_commit(lambda: record_cluster_label(cluster_id, instance.label, instance.labeller_id))
+
+
+@receiver(post_delete, sender=TaskLabel)
+def clear_cluster_label_histogram_on_delete(sender, instance, **kwargs):
+    try:
+        cluster_id = instance.task.cluster_id
+    except Task.DoesNotExist:
+        # the task is being deleted as well
+        return
+    if cluster_id:
+        transaction.on_commit(lambda: clear_cluster_label_histogram(cluster_id))
+
+# fields of a cluster the project statistics and the daily rollups are derived from, locked together
+CLUSTER_STATS_FIELDS = ("project_id", "status", "completion_percentage")
+CLUSTER_DAILY_FIELDS = ("project_id", "created_at", "status")
+CLUSTER_LOCKED_FIELDS = TaskCluster.STATS_FIELDS
+# fields of a task the daily rollups are derived from
+TASK_DAILY_FIELDS = Task.STATS_FIELDS
+
+
+def _saves_any(fields, update_fields):
+    """Whether a save with `update_fields` writes any of `fields` (attnames, update_fields may use field names)"""
+    return update_fields is None or any(field in update_fields or field.removesuffix("_id") in update_fields for field in fields)
+
+
+def _locked_values(sender, instance, fields):
+    """
+    The stored {field: value} of the row being saved or deleted, read with SELECT ... FOR UPDATE so no other
+    writer can change them before this transaction commits (TaskCluster and Task save in a transaction for
+    this). None for a new row.
+
+    In-memory values cannot be used: two requests that loaded the same row would both count the move from
+    the same old values.
+    """
+    if instance._state.adding or instance.pk is None:
+        return None
+    return sender.objects.select_for_update().filter(pk=instance.pk).values(*fields).first()
+
+
+def _saved_values(instance, fields, previous, update_fields):
+    """The values of `fields` once the instance is saved, fields left out of `update_fields` keep their stored value"""
+    if previous is None or update_fields is None:
+        return {field: getattr(instance, field) for field in fields}
+    return {field: getattr(instance, field) if _saves_any([field], update_fields) else previous[field] for field in fields}
+
+
+def _pick(values, fields):
+    return None if values is None else {field: values[field] for field in fields}
+
+
+def _deleted_values(sender, instance, fields, origin):
+    # a cascade loads the rows it deletes itself, only an instance deleted directly may hold stale values
+    if origin is instance:
+        return _locked_values(sender, instance, fields)
+    return {field: getattr(instance, field) for field in fields}
+
+
+def _apply_cluster_stats(project_id, removed=None, added=None):
+    """Apply the change from the `removed` cluster values to the `added` ones in a single UPDATE"""
+    total_clusters, completion_percentage, statuses = 0, 0, {}
+    for values, sign in ((removed, -1), (added, 1)):
+        if values:
+            total_clusters += sign
+            completion_percentage += sign * (values["completion_percentage"] or 0)
+            statuses[values["status"]] = statuses.get(values["status"], 0) + sign
+
+    if not ProjectStats.apply_delta(project_id, total_clusters, completion_percentage, statuses):
+        ProjectStats.rebuild(project_id)
+
+
+@receiver(pre_save, sender=TaskCluster)
+def lock_cluster_stats(sender, instance, update_fields=None, **kwargs):
+    if _saves_any(CLUSTER_LOCKED_FIELDS, update_fields):
+        instance._previous_stats = _locked_values(sender, instance, CLUSTER_LOCKED_FIELDS)
+
+
+@receiver(post_save, sender=TaskCluster)
+def update_project_stats(sender, instance, created, update_fields=None, **kwargs):
+    """Move the cluster's previous status and completion out of the project statistics and its current ones in"""
+    if not _saves_any(CLUSTER_STATS_FIELDS, update_fields):
+        return
+    previous = None if created else _pick(instance._previous_stats, CLUSTER_STATS_FIELDS)
+    current = _saved_values(instance, CLUSTER_STATS_FIELDS, previous, update_fields)
+
+    if not created and previous is None:
+        # the row was gone when it was locked, recount the project
+        ProjectStats.rebuild(current["project_id"])
+    elif previous is None:
+        _apply_cluster_stats(current["project_id"], added=current)
+    elif previous != current:
+        if previous["project_id"] == current["project_id"]:
+            _apply_cluster_stats(current["project_id"], removed=previous, added=current)
+        else:
+            # moved to another project
+            _apply_cluster_stats(previous["project_id"], removed=previous)
+            _apply_cluster_stats(current["project_id"], added=current)
+
+
+@receiver(pre_delete, sender=TaskCluster)
+def lock_deleted_cluster_stats(sender, instance, origin=None, **kwargs):
+    instance._previous_stats = _deleted_values(sender, instance, CLUSTER_LOCKED_FIELDS, origin)
+
+
+@receiver(post_delete, sender=TaskCluster)
+def remove_cluster_from_project_stats(sender, instance, **kwargs):
+    previous = instance._previous_stats
+    if previous is None:
+        return
+    # no row to update means the project itself is being deleted along with its statistics
+    ProjectStats.apply_delta(
+        previous["project_id"],
+        total_clusters=-1,
+        completion_percentage=-(previous["completion_percentage"] or 0),
+        statuses={previous["status"]: -1},
+    )
+
+
+@receiver(post_save, sender=Project)
+def create_project_stats(sender, instance, created, **kwargs):
+    if created:
+        ProjectStats.objects.get_or_create(project=instance)
+
+
+def _task_daily_deltas(values, sign):
+    return (values["group_id"], timezone.localdate(values["created_at"])), {
+        "task_count": sign,
+        "total_data_points": sign * (values["used_data_points"] or 0),
+        "human_reviewed_count": sign if values["human_reviewed"] else 0,
+        "ai_confidence_sum": sign * (values["ai_confidence"] or 0),
+    }
+
+
+def _cluster_daily_deltas(values, sign):
+    return (values["project_id"], timezone.localdate(values["created_at"])), {"statuses": {values["status"]: sign}}
+
+
+def _apply_daily_deltas(*changes, create=True):
+    """Apply (project day, deltas) changes, merging those that hit the same row into one UPDATE"""
+    merged = {}
+    for day, deltas in changes:
+        totals = merged.setdefault(day, {"statuses": {}})
+        for field, amount in deltas.items():
+            if field == "statuses":
+                for status, count in amount.items():
+                    totals["statuses"][status] = totals["statuses"].get(status, 0) + count
+            else:
+                totals[field] = totals.get(field, 0) + amount
+    for (project_id, date), totals in merged.items():
+        ProjectDailyStats.apply_delta(project_id, date, create=create, **totals)
+
+
+def _update_daily_stats(instance, created, update_fields, fields, to_deltas):
+    """Take the locked previous values of the instance out of the daily rollup and add its saved ones"""
+    if not _saves_any(fields, update_fields):
+        return
+    previous = None if created else _pick(instance._previous_stats, fields)
+    current = _saved_values(instance, fields, previous, update_fields)
+    if previous == current:
+        return
+    changes = [to_deltas(current, 1)]
+    if previous:
+        changes.insert(0, to_deltas(previous, -1))
+    _apply_daily_deltas(*changes)
+
+
+@receiver(pre_save, sender=Task)
+def lock_task_daily_stats(sender, instance, update_fields=None, **kwargs):
+    if _saves_any(TASK_DAILY_FIELDS, update_fields):
+        instance._previous_stats = _locked_values(sender, instance, TASK_DAILY_FIELDS)
+
+
+@receiver(post_save, sender=Task)
+def update_task_daily_stats(sender, instance, created, update_fields=None, **kwargs):
+    _update_daily_stats(instance, created, update_fields, TASK_DAILY_FIELDS, _task_daily_deltas)
+
+
+@receiver(pre_delete, sender=Task)
+def lock_deleted_task_daily_stats(sender, instance, origin=None, **kwargs):
+    instance._previous_stats = _deleted_values(sender, instance, TASK_DAILY_FIELDS, origin)
+
+
+@receiver(post_delete, sender=Task)
+def remove_task_daily_stats(sender, instance, **kwargs):
+    if instance._previous_stats:
+        # never recreate rows here, the project may be getting deleted
+        _apply_daily_deltas(_task_daily_deltas(instance._previous_stats, -1), create=False)
+
+
+@receiver(post_save, sender=TaskCluster)
+def update_cluster_daily_stats(sender, instance, created, update_fields=None, **kwargs):
+    _update_daily_stats(instance, created, update_fields, CLUSTER_DAILY_FIELDS, _cluster_daily_deltas)
+
+
+@receiver(post_delete, sender=TaskCluster)
+def remove_cluster_daily_stats(sender, instance, **kwargs):
+    previous = _pick(instance._previous_stats, CLUSTER_DAILY_FIELDS)
+    if previous:
+        _apply_daily_deltas(_cluster_daily_deltas(previous, -1), create=False)
@@ -7,6 +7,8 @@ from datasets.models import CohereDataset
 from task.utils import push_realtime_update
 
 from .ai_processor import submit_human_review, text_classification
+# registers the consensus task with workers, which only autodiscover this module
+from .consensus import recompute_cluster_consensus  # noqa: F401
 from .models import Task, UserReviewChatHistory
 from .utils import assign_reviewer, dispatch_review_response_message
 
@@ -32,7 +34,7 @@ def process_task(task_id):
         task.processing_status = "PROCESSING"
         task.save()
 
-        push_realtime_update(task, action="task_status_changed")
+        push_realtime_update(task, action="task_status_changed", batch=True)
         logger.info(f"Updated task {task_id} status to PROCESSING")
 
         # Get priority with fallback to 'NORMAL'
@@ -73,7 +75,7 @@ def route_task_to_processing(task_id):
         task.processing_status = "PROCESSING"
         task.save()
 
-        push_realtime_update(task, action="task_status_changed")
+        push_realtime_update(task, action="task_status_changed", batch=True)
         logger.info(f"Updated task {task_id} status to PROCESSING")
 
         # Call AI processing
@@ -123,7 +125,7 @@ def process_with_ai_model(task_id):
 
         # Only update if still in PROCESSING state
         if task.processing_status == "PROCESSING":
-            classification = text_classification(task.data)
+            classification = text_classification(task.data, task=task)
             logger.info(f"AI classification result: {classification}")
 
             task.processing_status = "AI_REVIEWED"
@@ -143,7 +145,7 @@ def process_with_ai_model(task_id):
                 task.review_status = "PENDING_REVIEW"
                 task.save()
                 task.create_log(f"Task {task.id} status changed to REVIEW_NEEDED ")
-                push_realtime_update(task, action="task_status_changed")
+                push_realtime_update(task, action="task_status_changed", batch=True)
             else:
                 task.processing_status = "COMPLETED"
                 task.final_label = classification.get("classification", None)
@@ -151,7 +153,7 @@ def process_with_ai_model(task_id):
                 task.save()
                 task.create_log(f"Task {task.id} successfully reviewed by AI status: COMPLETED")
                 
-                push_realtime_update(task, action="task_status_changed")
+                push_realtime_update(task, action="task_status_changed", batch=True)
                 logger.info(f"Task {task_id} completed automatically")
                 
                 # cohere_dataset, created = CohereDataset.objects.get_or_create(task=task)
@@ -194,6 +196,7 @@ def submit_human_review_history(
                 last_human_review.ai_output.get("corrected_classification"),
                 classification,
                 justification,
+                task=task,
             )
         else:
             success, ai_response = submit_human_review(
@@ -201,6 +204,7 @@ def submit_human_review_history(
                 task.ai_output.get("classification"),
                 classification,
                 justification,
+                task=task,
             )
 
         if success:
@@ -228,7 +232,7 @@ def provide_feedback_to_ai_model(task_id, review):
         task = Task.objects.select_related("user").get(id=task_id)
         # strinify the review before sending to the api
         json_string = json.dumps(review, indent=2)
-        classification = text_classification(json_string)
+        classification = text_classification(json_string, task=task)
         task.processing_status = "COMPLETED"
         task.review_status = "PENDING_APPROVAL"
         task.human_reviewed = True
@@ -0,0 +1,212 @@
+"""
+Query-count budgets and latency ceilings of the hot endpoints.
+
+Every endpoint is measured on data seeded at each of SIZES. A run fails when an endpoint makes more queries
+than its budget, when its number of queries grows with the size of the data (an N+1), or when its median
+latency is above its ceiling. Query failures print the queries that differ between the smallest and largest
+size. The suite is tagged `benchmark`: run only it with `python manage.py test --tag benchmark`, or skip it
+with `--exclude-tag benchmark`.
+"""
+import difflib
+import re
+import statistics
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from account.models import Project
+from common.caching import invalidate_cache_tags
+from reviewer.models import LabelerDomain
+from task.choices import AnnotationMethodChoices, TaskInputTypeChoices, TaskTypeChoices
+from .models import MultiChoiceOption, Task, TaskCluster, TaskLabel
+from .utils import assign_serial_numbers
+
+User = get_user_model()
+
+# number of projects, clusters, tasks per cluster and project logs seeded for a run
+SIZES = [5, 20, 50]
+# requests timed per endpoint and size, the median is held to the ceiling
+REPEATS = 3
+# the queries each endpoint makes today, raise a budget only together with the change that needs it
+QUERY_BUDGETS = {
+    "annotate": 30,
+    "list_projects": 4,
+    "my_assigned_clusters": 3,
+    "project_detail": 14,
+    "available_clusters": 4,
+    "export_cluster": 3,
+}
+# generous on purpose, these catch order-of-magnitude regressions rather than noise
+LATENCY_CEILINGS_MS = {
+    "annotate": 500,
+    "list_projects": 500,
+    "my_assigned_clusters": 500,
+    "project_detail": 500,
+    "available_clusters": 500,
+    "export_cluster": 1000,
+}
+LABEL_CHOICES = ["positive", "negative", "neutral"]
+
+
+def normalize_sql(sql):
+    """Queries with their literals replaced, so the same query against different rows compares equal"""
+    return re.sub(r"'[^']*'|\b\d+\b", "?", sql)
+
+
+@tag("benchmark")
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class EndpointBenchmarkTestCase(APITestCase):
+    def seed(self, size):
+        """
+        A project owner and a reviewer with `size` projects, `size` multiple choice clusters of `size` tasks
+        in the first project, every other one assigned to the reviewer, the first cluster fully labelled by
+        another reviewer and `size` logs on the first project.
+        """
+        domain = LabelerDomain.objects.create(domain=f"benchmark {size}")
+        owner = User.objects.create_user(username=f"owner_{size}", email=f"owner_{size}@example.com", password="Testp@ssword123")
+        reviewer = User.objects.create_user(username=f"reviewer_{size}", email=f"reviewer_{size}@example.com",
+                                            password="Testp@ssword123", is_reviewer=True)
+        other_reviewer = User.objects.create_user(username=f"other_reviewer_{size}", email=f"other_reviewer_{size}@example.com",
+                                                  password="Testp@ssword123", is_reviewer=True)
+        reviewer.domains.add(domain)
+
+        projects = [Project.objects.create(name=f"Benchmark {size} project {i}", created_by=owner) for i in range(size)]
+        project = projects[0]
+        clusters = []
+        for i in range(size):
+            cluster = TaskCluster.objects.create(
+                project=project,
+                created_by=owner,
+                input_type=TaskInputTypeChoices.MULTIPLE_CHOICE,
+                task_type=TaskTypeChoices.TEXT,
+                annotation_method=AnnotationMethodChoices.MANUAL,
+                labeller_per_item_count=3,
+                labeler_domain=domain,
+            )
+            cluster.assigned_reviewers.add(other_reviewer, *([reviewer] if i % 2 == 0 else []))
+            clusters.append(cluster)
+        MultiChoiceOption.objects.bulk_create([
+            MultiChoiceOption(cluster=cluster, option_text=choice) for cluster in clusters for choice in LABEL_CHOICES
+        ])
+
+        tasks = [
+            Task(cluster=cluster, group=project, user=owner, task_type=TaskTypeChoices.TEXT, data=f"Item {i} of cluster {cluster.id}",
+                 processing_status="REVIEW_NEEDED")
+            for cluster in clusters for i in range(size)
+        ]
+        assign_serial_numbers(tasks)
+        tasks = Task.objects.bulk_create(tasks)
+        TaskLabel.objects.bulk_create([
+            TaskLabel(task=task, labeller=other_reviewer, label=LABEL_CHOICES[task.id % len(LABEL_CHOICES)])
+            for task in tasks if task.cluster_id == clusters[0].id
+        ])
+        for i in range(size):
+            project.create_log(f"Benchmark log {i}", task=tasks[i] if i % 2 else None)
+
+        return {
+            "size": size,
+            "owner": owner,
+            "reviewer": reviewer,
+            "project": project,
+            "export_cluster": clusters[0],
+            # tasks of a cluster assigned to the reviewer, one labelled per timed request
+            "annotation_tasks": [task for task in tasks if task.cluster_id == clusters[0].id][:REPEATS],
+        }
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+
+    def measure(self, make_request):
+        """The queries of the first request and the median latency of REPEATS requests; make_request gets the repeat index"""
+        latencies, captured = [], None
+        for repeat in range(REPEATS):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = make_request(repeat)
+                latencies.append((time.perf_counter() - started) * 1000)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, getattr(response, "data", None))
+            if captured is None:
+                captured = [query["sql"] for query in queries.captured_queries]
+        return captured, statistics.median(latencies)
+
+    def benchmark(self, endpoint, make_request):
+        """Measure an endpoint at every size and hold it to its budget; make_request gets the seeded data and the repeat index"""
+        results = {}
+        for size in SIZES:
+            data = self.seed(size)
+            results[size] = self.measure(lambda repeat: make_request(data, repeat))
+
+        smallest, largest = results[SIZES[0]][0], results[SIZES[-1]][0]
+        diff = "\n".join(difflib.unified_diff(
+            [normalize_sql(sql) for sql in smallest], [normalize_sql(sql) for sql in largest],
+            fromfile=f"size {SIZES[0]}", tofile=f"size {SIZES[-1]}", lineterm="",
+        ))
+        for size, (queries, latency) in results.items():
+            self.assertLessEqual(
+                len(queries), QUERY_BUDGETS[endpoint],
+                f"{endpoint} made {len(queries)} queries at size {size}, the budget is {QUERY_BUDGETS[endpoint]}:\n" + "\n".join(queries),
+            )
+            self.assertLessEqual(
+                latency, LATENCY_CEILINGS_MS[endpoint],
+                f"{endpoint} took {latency:.1f}ms at size {size}, the ceiling is {LATENCY_CEILINGS_MS[endpoint]}ms",
+            )
+        self.assertEqual(len(largest), len(smallest), f"{endpoint} queries grow with the size of the data:\n{diff}")
+
+    def test_annotate(self):
+        def make_request(data, repeat):
+            self.authenticate(data["reviewer"])
+            # fresh tasks of the fully labelled cluster, so the review session check sees a large cluster
+            task = data["annotation_tasks"][repeat]
+            return self.client.post(reverse("task:task_annotation"), {"task_id": task.id, "labels": ["positive"]}, format="json")
+
+        with patch("task.apis.credit_labeller_monthly_payment.delay"), \
+                patch("task.apis.schedule_cluster_progress_update"), \
+                patch("task.apis.schedule_cluster_consensus_update"):
+            self.benchmark("annotate", make_request)
+
+    def test_list_projects(self):
+        def make_request(data, repeat):
+            self.authenticate(data["owner"])
+            return self.client.get(reverse("account:list-project"))
+
+        self.benchmark("list_projects", make_request)
+
+    def test_my_assigned_clusters(self):
+        def make_request(data, repeat):
+            self.authenticate(data["reviewer"])
+            return self.client.get(reverse("task:my_assigned_clusters"))
+
+        self.benchmark("my_assigned_clusters", make_request)
+
+    def test_project_detail(self):
+        def make_request(data, repeat):
+            self.authenticate(data["owner"])
+            # the uncached response is what is being measured
+            invalidate_cache_tags(f"project_detail_{data['project'].id}")
+            return self.client.get(reverse("account:project-detail-view", kwargs={"id": data["project"].id}))
+
+        self.benchmark("project_detail", make_request)
+
+    def test_available_clusters(self):
+        def make_request(data, repeat):
+            self.authenticate(data["reviewer"])
+            return self.client.get(reverse("task:get-available-clusters"))
+
+        self.benchmark("available_clusters", make_request)
+
+    def test_export_cluster(self):
+        def make_request(data, repeat):
+            self.authenticate(data["owner"])
+            response = self.client.get(reverse("task:export-cluster-to-csv", kwargs={"cluster_id": data["export_cluster"].id}))
+            self.assertEqual(response.content.decode().count("\n"), data["size"] + 1)
+            return response
+
+        self.benchmark("export_cluster", make_request)
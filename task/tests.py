@@ -5,11 +5,39 @@ from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+import asyncio
+import datetime
+import io
+import os
+import tempfile
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db.models import Sum
+from django.test import override_settings
+from django_redis import get_redis_connection
 
-from account.models import Project
+from account.models import Project, UserAPIKey
+from reviewer.models import LabelerDomain
+from account.utils import create_api_key_for_uer, invalidate_verified_api_key
 from subscription.models import SubscriptionPlan, UserDataPoints, UserSubscription
-from task.choices import AnnotationMethodChoices, TaskInputTypeChoices, TaskTypeChoices
-from .models import Task, TaskCluster
+from task.choices import AICallOutcomeChoices, AnnotationMethodChoices, ClusterIngestionStatusChoices, TaskInputTypeChoices, TaskTypeChoices
+import numpy as np
+import httpx
+from cohere.core import ApiError
+
+from .consensus import fleiss_kappa, score_tasks, update_cluster_consensus
+from .ai_processor import submit_human_review, text_classification
+from .ai_telemetry import get_ai_usage
+from . import ingestion
+from .ingestion import ingest_cluster_file, item_data_points
+from .management.commands.load_test import LoadStats
+from .models import AICallTelemetry, ClusterConsensus, ClusterIngestionJob, LabellerQuality, ProjectDailyStats, ProjectStats, Task, TaskCluster, TaskLabel
+from .serializers import FullTaskSerializer
+from .utils import assign_reviewers_to_cluster, assign_serial_numbers, calculate_labelling_required_data_points, clear_cluster_label_histogram, record_cluster_label, flush_task_notifications, push_realtime_update
 
 User = get_user_model()
 
@@ -72,6 +100,24 @@ class TaskSubmissionTestCase(APITestCase):
         print(response.data)
 
 
+    def test_submit_task_with_api_key_verifies_key_once(self):
+        """Test that api key requests run the key hasher once and reuse the verification afterwards"""
+        api_key, key = create_api_key_for_uer(self.user)
+        invalidate_verified_api_key(api_key.prefix)
+        self.client.credentials(HTTP_X_API_KEY=key)
+
+        with patch.object(UserAPIKey.objects, 'get_from_key', wraps=UserAPIKey.objects.get_from_key) as get_from_key:
+            for _ in range(2):
+                response = self.client.post(self.task_create_url, self.text_task_data, format='json')
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(get_from_key.call_count, 1)
+
+        api_key.revoked = True
+        api_key.save()
+        response = self.client.post(self.task_create_url, self.text_task_data, format='json')
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
     def test_submit_task_without_auth(self):
         """Test submitting without authentication"""
         self.client.credentials()  # Remove auth credentials
@@ -500,4 +546,729 @@ class RequestAdditionalLabellersTestCase(APITestCase):
     def tearDown(self):
         TaskCluster.objects.all().delete()
         Project.objects.all().delete()
-        User.objects.all().delete()
\ No newline at end of file
+        User.objects.all().delete()
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    WS_NOTIFICATION_BATCH_WINDOW_MS=250,
+)
+class BatchedTaskNotificationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='Testp@ssword123'
+        )
+        self.project = Project.objects.create(name='testproject', created_by=self.user)
+        self.cluster = TaskCluster.objects.create(
+            project=self.project,
+            input_type=TaskInputTypeChoices.TEXT,
+            task_type=TaskTypeChoices.TEXT,
+            annotation_method=AnnotationMethodChoices.AI_AUTOMATED,
+            created_by=self.user
+        )
+        self.tasks = [
+            Task.objects.create(task_type='TEXT', data=f'item {i}', cluster=self.cluster, group=self.project, user=self.user)
+            for i in range(3)
+        ]
+
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(f"user_tasks_{self.user.id}", self.channel_name)
+
+    def test_events_are_coalesced_into_one_frame(self):
+        """Test that events buffered within a window are flushed as a single batch"""
+        with patch('task.utils.flush_task_notifications.apply_async') as schedule_flush:
+            for task in self.tasks:
+                task.processing_status = 'PROCESSING'
+                task.save()
+                push_realtime_update(task, action='task_status_changed', batch=True)
+            # the same task moving on again inside the window replaces its previous event
+            self.tasks[0].processing_status = 'COMPLETED'
+            self.tasks[0].save()
+            push_realtime_update(self.tasks[0], action='task_status_changed', batch=True)
+
+        # only the first event of the window schedules a flush
+        schedule_flush.assert_called_once()
+
+        self.assertEqual(flush_task_notifications(self.user.id), 4)
+        # nothing left to send once the buffer is drained
+        self.assertEqual(flush_task_notifications(self.user.id), 0)
+
+        message = async_to_sync(self.channel_layer.receive)(self.channel_name)
+        batch = message['text']
+        self.assertEqual(batch['action'], 'task_batch')
+        self.assertEqual(batch['event_count'], 4)
+        self.assertEqual(len(batch['tasks']), 3)
+        self.assertEqual(batch['status_counts'], {'PROCESSING': 2, 'COMPLETED': 1})
+
+        cluster_progress = batch['clusters'][self.cluster.id]
+        self.assertEqual(cluster_progress['total'], 3)
+        self.assertEqual(cluster_progress['completion_percentage'], 33.33)
+
+    def tearDown(self):
+        get_redis_connection("default").delete(
+            f"task_notification_buffer_{self.user.id}", f"task_notification_window_{self.user.id}"
+        )
+
+
+class ClusterLabelsSummaryTestCase(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.reviewers = [
+            User.objects.create_user(username=f'reviewer{i}', email=f'reviewer{i}@example.com', password='Testp@ssword123', is_reviewer=True)
+            for i in range(2)
+        ]
+        self.project = Project.objects.create(name='testproject', created_by=self.owner)
+        self.cluster = TaskCluster.objects.create(
+            project=self.project,
+            annotation_method=AnnotationMethodChoices.MANUAL,
+            created_by=self.owner,
+        )
+        self.cluster.assigned_reviewers.add(*self.reviewers)
+        self.tasks = [
+            Task.objects.create(task_type='TEXT', data=f'item {i}', cluster=self.cluster, group=self.project, user=self.owner)
+            for i in range(3)
+        ]
+        clear_cluster_label_histogram(self.cluster.id)
+
+        for task, label in zip(self.tasks[:2], ['positive', 'negative']):
+            for reviewer in self.reviewers:
+                TaskLabel.objects.create(task=task, label=label, labeller=reviewer)
+        TaskLabel.objects.create(task=self.tasks[0], label='positive', labeller=self.reviewers[0])
+
+        self.url = reverse('task:cluster_labels_summary', kwargs={'cluster_id': self.cluster.id})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.reviewers[0])}")
+
+    def test_summary_is_aggregated(self):
+        """Test that the summary reports label and labeller counts"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data['total_tasks'], 3)
+        self.assertEqual(data['labeled_tasks'], 2)
+        self.assertEqual(data['total_labels'], 5)
+        self.assertEqual(data['unique_labels'], 2)
+        self.assertEqual(list(data['label_frequency'].items()), [('positive', 3), ('negative', 2)])
+        self.assertEqual(data['labeller_contributions'], {'reviewer0': 3, 'reviewer1': 2})
+
+    def test_new_labels_update_the_cached_histogram(self):
+        """Test that labels created after the histogram is built are counted without rebuilding it"""
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TaskLabel.objects.create(task=self.tasks[2], label='neutral', labeller=self.reviewers[1])
+
+        with patch('task.utils._hydrate_cluster_label_histogram') as hydrate:
+            data = self.client.get(self.url).data['data']
+        hydrate.assert_not_called()
+        self.assertEqual(data['label_frequency']['neutral'], 1)
+        self.assertEqual(data['labeller_contributions']['reviewer1'], 3)
+        self.assertEqual(data['labeled_tasks'], 3)
+
+    def test_histograms_created_after_an_empty_build_expire(self):
+        """Test that a histogram first created by a new label expires along with the ready marker"""
+        TaskLabel.objects.filter(task__cluster=self.cluster).delete()
+        clear_cluster_label_histogram(self.cluster.id)
+        self.client.get(self.url)
+
+        record_cluster_label(self.cluster.id, 'neutral', self.reviewers[1].id)
+
+        redis = get_redis_connection("default")
+        for key in [f"cluster_label_histogram_{self.cluster.id}", f"cluster_labeller_histogram_{self.cluster.id}"]:
+            self.assertGreater(redis.ttl(key), 0)
+
+    def test_top_limits_the_labels_returned(self):
+        """Test that top=K returns only the K most frequent labels while still counting every label"""
+        data = self.client.get(self.url, {'top': 1}).data['data']
+
+        self.assertEqual(data['label_frequency'], {'positive': 3})
+        self.assertEqual(data['unique_labels'], 2)
+
+        response = self.client.get(self.url, {'top': 'all'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def tearDown(self):
+        clear_cluster_label_histogram(self.cluster.id)
+
+
+class ClusterConsensusTestCase(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='Testp@ssword123')
+        self.labellers = [
+            User.objects.create_user(username=f'labeller{i}', email=f'labeller{i}@example.com', password='Testp@ssword123', is_reviewer=True)
+            for i in range(4)
+        ]
+        self.project = Project.objects.create(name='testproject', created_by=self.owner)
+        self.cluster = TaskCluster.objects.create(
+            project=self.project,
+            input_type=TaskInputTypeChoices.MULTIPLE_CHOICE,
+            annotation_method=AnnotationMethodChoices.MANUAL,
+            created_by=self.owner,
+            labeller_per_item_count=4,
+        )
+        self.tasks = [
+            Task.objects.create(task_type='TEXT', data=f'item {i}', cluster=self.cluster, group=self.project, user=self.owner)
+            for i in range(3)
+        ]
+        self.url = reverse('task:cluster_consensus', kwargs={'cluster_id': self.cluster.id})
+
+    def label(self, task, labels):
+        for labeller, label in zip(self.labellers, labels):
+            TaskLabel.objects.create(task=task, label=label, labeller=labeller)
+
+    def test_fleiss_kappa_matches_reference_example(self):
+        """Test the kappa of the classic 10 subject, 14 rater example (0.210)"""
+        counts = np.array([
+            [0, 0, 0, 0, 14], [0, 2, 6, 4, 2], [0, 0, 3, 5, 6], [0, 3, 9, 2, 0], [2, 2, 8, 1, 1],
+            [7, 7, 0, 0, 0], [3, 2, 6, 3, 0], [2, 5, 3, 2, 2], [6, 5, 2, 1, 0], [0, 2, 2, 3, 7],
+        ])
+        majority, agreement, tied = score_tasks(counts)
+
+        self.assertEqual(majority[0], 4)
+        self.assertAlmostEqual(agreement[1], 0.253, places=3)
+        self.assertTrue(tied[5])
+        kappa = fleiss_kappa(dict(enumerate(counts.sum(axis=0))), agreement.sum(), len(counts))
+        self.assertAlmostEqual(kappa, 0.210, places=3)
+
+    def test_majority_label_is_stored_on_task(self):
+        """Test that each task gets the majority label and its votes"""
+        self.label(self.tasks[0], ['Cat', 'cat', 'cat ', 'dog'])
+        self.label(self.tasks[1], ['dog', 'dog'])
+
+        update_cluster_consensus(self.cluster.id)
+
+        self.tasks[0].refresh_from_db()
+        self.assertEqual(self.tasks[0].final_label, 'cat')
+        self.assertEqual(self.tasks[0].consensus['votes'], {'cat': 3, 'dog': 1})
+        self.assertAlmostEqual(self.tasks[0].consensus['agreement'], 0.5)
+        self.tasks[2].refresh_from_db()
+        self.assertIsNone(self.tasks[2].consensus)
+
+    def test_incremental_update_matches_full_recompute(self):
+        """Test that reprocessing only the touched tasks gives the same totals as starting over"""
+        self.label(self.tasks[0], ['cat', 'cat'])
+        self.label(self.tasks[1], ['dog', 'cat', 'dog'])
+        update_cluster_consensus(self.cluster.id)
+
+        TaskLabel.objects.create(task=self.tasks[0], label='dog', labeller=self.labellers[2])
+        self.label(self.tasks[2], ['bird', 'bird', 'cat'])
+        incremental = update_cluster_consensus(self.cluster.id)
+        incremental_values = (dict(incremental.category_totals), incremental.agreement_sum, incremental.scored_tasks, incremental.kappa)
+
+        full = update_cluster_consensus(self.cluster.id, full=True)
+
+        self.assertEqual(incremental_values[0], full.category_totals)
+        self.assertAlmostEqual(incremental_values[1], full.agreement_sum)
+        self.assertEqual(incremental_values[2], full.scored_tasks)
+        self.assertAlmostEqual(incremental_values[3], full.kappa)
+        self.assertEqual(full.category_totals, {'cat': 4, 'dog': 3, 'bird': 2})
+
+    def test_consensus_endpoint_requires_project_access(self):
+        """Test that the project owner gets the consensus and outsiders are refused"""
+        self.label(self.tasks[0], ['cat', 'cat', 'dog'])
+        update_cluster_consensus(self.cluster.id)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.stranger)}")
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.owner)}")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data['labelled_tasks'], 1)
+        self.assertEqual(data['tasks'][0]['final_label'], 'cat')
+
+    def test_consensus_endpoint_hides_labeller_agreement(self):
+        """Test that the project owner does not see which labeller agreed with the majority"""
+        self.label(self.tasks[0], ['cat', 'cat', 'dog'])
+        update_cluster_consensus(self.cluster.id)
+        self.tasks[0].refresh_from_db()
+        self.assertEqual(self.tasks[0].labeller_agreement, {str(labeller.id): agreed for labeller, agreed in zip(self.labellers, [True, True, False])})
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.owner)}")
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data['data']['tasks'][0]['consensus']['votes'], {'cat': 2, 'dog': 1})
+        self.assertNotIn('labeller_agreement', response.data['data']['tasks'][0]['consensus'])
+        self.assertNotIn('labeller_agreement', response.content.decode())
+        self.assertNotIn('labeller_agreement', FullTaskSerializer(self.tasks[0]).data)
+
+    @patch('task.apis.schedule_cluster_consensus_update')
+    def test_first_request_schedules_the_consensus(self, schedule):
+        """Test that a cluster without a consensus gets it computed by a worker instead of during the request"""
+        self.label(self.tasks[0], ['cat', 'cat', 'dog'])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.owner)}")
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        schedule.assert_called_once_with(self.cluster.id)
+        self.assertFalse(ClusterConsensus.objects.filter(cluster=self.cluster).exists())
+
+    def test_consensus_tasks_are_paginated(self):
+        """Test that the labelled tasks come a page at a time"""
+        for task in self.tasks:
+            self.label(task, ['cat', 'dog', 'cat'])
+        update_cluster_consensus(self.cluster.id)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.owner)}")
+
+        data = self.client.get(self.url, {'page_size': 2}).data['data']
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([task['id'] for task in data['tasks']], [self.tasks[0].id, self.tasks[1].id])
+        self.assertIsNotNone(data['next'])
+
+        data = self.client.get(self.url, {'page_size': 2, 'page': 2}).data['data']
+        self.assertEqual([task['id'] for task in data['tasks']], [self.tasks[2].id])
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['labelled_tasks'], 3)
+
+
+class LabellerQualityTestCase(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='Testp@ssword123', is_staff=True)
+        self.domain = LabelerDomain.objects.create(domain='animals')
+        self.labellers = [
+            User.objects.create_user(username=f'labeller{i}', email=f'labeller{i}@example.com', password='Testp@ssword123', is_reviewer=True)
+            for i in range(3)
+        ]
+        for labeller in self.labellers:
+            labeller.domains.add(self.domain)
+        self.project = Project.objects.create(name='testproject', created_by=self.owner)
+        self.cluster = TaskCluster.objects.create(
+            project=self.project,
+            input_type=TaskInputTypeChoices.TEXT,
+            annotation_method=AnnotationMethodChoices.MANUAL,
+            created_by=self.owner,
+            labeller_per_item_count=3,
+            labeler_domain=self.domain,
+        )
+        self.tasks = [
+            Task.objects.create(task_type='TEXT', data=f'item {i}', cluster=self.cluster, group=self.project, user=self.owner)
+            for i in range(2)
+        ]
+
+    def label(self, task, labels):
+        for labeller, label in zip(self.labellers, labels):
+            TaskLabel.objects.create(task=task, label=label, labeller=labeller)
+
+    def quality(self, labeller):
+        return LabellerQuality.objects.get(labeller=labeller, domain=self.domain)
+
+    def test_agreement_with_majority_is_counted(self):
+        """Test that votes on tasks with a clear majority count, and only majority votes agree"""
+        self.label(self.tasks[0], ['cat', 'cat', 'dog'])
+        # a tie has no majority to agree with
+        self.label(self.tasks[1], ['cat', 'dog'])
+
+        update_cluster_consensus(self.cluster.id)
+
+        self.assertEqual((self.quality(self.labellers[0]).scored_votes, self.quality(self.labellers[0]).agreeing_votes), (1, 1))
+        self.assertEqual((self.quality(self.labellers[2]).scored_votes, self.quality(self.labellers[2]).agreeing_votes), (1, 0))
+
+    def test_changed_majority_is_reflected_incrementally(self):
+        """Test that a task's old contribution is replaced and full recomputes do not double count"""
+        self.label(self.tasks[0], ['cat', 'dog'])
+        self.label(self.tasks[1], ['dog', 'dog'])
+        update_cluster_consensus(self.cluster.id)
+        self.assertEqual(self.quality(self.labellers[1]).agreeing_votes, 1)
+
+        # the third vote breaks the tie on the first task in favour of cat
+        TaskLabel.objects.create(task=self.tasks[0], label='cat', labeller=self.labellers[2])
+        update_cluster_consensus(self.cluster.id)
+        update_cluster_consensus(self.cluster.id, full=True)
+
+        second = self.quality(self.labellers[1])
+        self.assertEqual((second.scored_votes, second.agreeing_votes), (2, 1))
+        third = self.quality(self.labellers[2])
+        self.assertEqual((third.scored_votes, third.agreeing_votes), (1, 1))
+
+    def test_unreliable_reviewers_are_assigned_last(self):
+        """Test that cluster assignment skips reviewers who keep disagreeing with consensus"""
+        LabellerQuality.objects.create(labeller=self.labellers[0], domain=self.domain, scored_votes=50, agreeing_votes=10)
+        LabellerQuality.objects.create(labeller=self.labellers[1], domain=self.domain, scored_votes=50, agreeing_votes=45)
+        cluster = TaskCluster.objects.create(
+            project=self.project,
+            annotation_method=AnnotationMethodChoices.MANUAL,
+            created_by=self.owner,
+            labeller_per_item_count=2,
+            labeler_domain=self.domain,
+        )
+
+        assign_reviewers_to_cluster(cluster.id)
+
+        self.assertEqual(set(cluster.assigned_reviewers.all()), {self.labellers[1], self.labellers[2]})
+
+    def test_reviewers_list_includes_quality(self):
+        """Test that the reviewers list reports each reviewer's agreement per domain"""
+        self.label(self.tasks[0], ['cat', 'cat', 'dog'])
+        update_cluster_consensus(self.cluster.id)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.admin)}")
+        response = self.client.get(reverse('account:get-reviewers-view'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reviewers = {reviewer['username']: reviewer for reviewer in response.data}
+        quality = reviewers['labeller2']['quality_scores'][0]
+        self.assertEqual(quality['domain'], 'animals')
+        self.assertEqual(quality['agreement_rate'], 0)
+
+
+@override_settings(CLUSTER_INGESTION_BATCH_SIZE=2)
+class ClusterIngestionTestCase(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.media_override.enable()
+
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.other_user = User.objects.create_user(username='other', email='other@example.com', password='Testp@ssword123')
+        UserDataPoints.objects.get_or_create(user=self.user)[0].topup_data_points(4000)
+        self.project = Project.objects.create(name='testproject', created_by=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.url = reverse('task:task-cluster-ingest')
+
+    def upload(self, name, content, **data):
+        payload = {
+            "name": "uploaded",
+            "description": "uploaded cluster",
+            "project": self.project.id,
+            "task_type": "TEXT",
+            "input_type": "text",
+            "annotation_method": "manual",
+            "labeller_per_item_count": 15,
+            "file": SimpleUploadedFile(name, content.encode()),
+            **data,
+        }
+        # run the ingestion job inline instead of on a worker
+        with patch('task.apis.ingest_cluster_file.delay', side_effect=ingest_cluster_file), \
+                patch('task.ingestion.dispatch_task_message'), self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, payload, format='multipart')
+
+    def test_jsonl_rows_become_tasks_in_batches(self):
+        """Test that every valid line becomes a task and invalid lines are reported"""
+        lines = [
+            '{"text": "The movie was fantastic!", "label": "positive"}',
+            '{"text": "I hated every minute of it.", "label": "negative"}',
+            'not json',
+            '',
+            '{"data": "Absolutely loved the performance."}',
+            '{"label": "missing text"}',
+        ]
+        response = self.upload('dataset.jsonl', "\n".join(lines))
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        self.assertEqual(job.status, ClusterIngestionStatusChoices.COMPLETED)
+        self.assertEqual((job.processed_rows, job.created_tasks, job.failed_rows), (5, 3, 2))
+        self.assertEqual([error['line'] for error in job.row_errors], [3, 6])
+        self.assertFalse(job.chunks.exists())
+
+        tasks = Task.objects.filter(cluster=job.cluster)
+        self.assertEqual(set(tasks.values_list('data', flat=True)), {"The movie was fantastic!", "I hated every minute of it.", "Absolutely loved the performance."})
+        self.assertEqual(len(set(tasks.values_list('serial_no', flat=True))), 3)
+        self.assertEqual(set(tasks.values_list('processing_status', flat=True)), {'REVIEW_NEEDED'})
+        self.assertEqual(ProjectDailyStats.objects.get(project=self.project).task_count, 3)
+
+    def test_csv_file_tasks(self):
+        """Test that file tasks are read from csv columns"""
+        rows = [
+            "file_name,file_type,file_url,file_size_bytes",
+            "cat.png,png,https://example.com/cat.png,1024",
+            "dog.png,png,not-a-url,2048",
+        ]
+        response = self.upload('images.csv', "\n".join(rows), task_type="IMAGE", input_type="text")
+
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        self.assertEqual((job.created_tasks, job.failed_rows), (1, 1))
+        task = Task.objects.get(cluster=job.cluster)
+        self.assertEqual((task.file_name, task.file_url, task.file_size_bytes), ("cat.png", "https://example.com/cat.png", 1024))
+
+    def test_interrupted_job_resumes_after_committed_rows(self):
+        """Test that a job picked up again does not create the tasks of committed batches twice"""
+        with patch('task.apis.transaction.on_commit'):
+            response = self.upload('dataset.jsonl', "\n".join(f'{{"text": "item {i}"}}' for i in range(5)))
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        Task.objects.bulk_create([Task(cluster=job.cluster, group=self.project, data=f"item {i}", serial_no=f"DONE0{i}") for i in range(2)])
+        ClusterIngestionJob.objects.filter(id=job.id).update(status=ClusterIngestionStatusChoices.PROCESSING, processed_rows=2, created_tasks=2)
+
+        with patch('task.ingestion.dispatch_task_message'):
+            self.assertEqual(ingest_cluster_file(job.id), 5)
+
+        self.assertEqual(sorted(Task.objects.filter(cluster=job.cluster).values_list('data', flat=True)), [f"item {i}" for i in range(5)])
+
+    def test_created_tasks_are_charged(self):
+        """Test that every created task is charged the data points of a cluster item, and only those"""
+        response = self.upload('dataset.jsonl', "\n".join(['{"text": "item 1"}', '{"text": "item 2"}', 'not json']))
+
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        cost = item_data_points(job.cluster)
+        self.assertEqual(set(Task.objects.filter(cluster=job.cluster).values_list('used_data_points', flat=True)), {cost})
+        data_points = UserDataPoints.objects.get(user=self.user)
+        self.assertEqual((data_points.data_points_balance, data_points.used_data_points), (4000 - 2 * cost, 2 * cost))
+        self.assertEqual(ProjectDailyStats.objects.get(project=self.project).total_data_points, 2 * cost)
+
+    @override_settings(CLUSTER_INGESTION_BATCH_SIZE=2)
+    def test_job_stops_when_data_points_run_out(self):
+        """Test that the batches the uploader cannot pay for are not created"""
+        cost = calculate_labelling_required_data_points({"input_type": "text", "task_type": "TEXT", "labeller_per_item_count": 15})
+        data_points = UserDataPoints.objects.get(user=self.user)
+        UserDataPoints.objects.filter(id=data_points.id).update(data_points_balance=3 * cost)
+
+        response = self.upload('dataset.jsonl', "\n".join(f'{{"text": "item {i}"}}' for i in range(4)))
+
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        self.assertEqual(job.status, ClusterIngestionStatusChoices.FAILED)
+        self.assertIn("Not enough data points", job.error)
+        self.assertEqual(Task.objects.filter(cluster=job.cluster).count(), 2)
+        data_points.refresh_from_db()
+        self.assertEqual(data_points.data_points_balance, cost)
+
+    def test_worker_does_not_need_the_web_file_system(self):
+        """Test that a worker with its own file system reads the upload, which the web process kept in the database"""
+        with patch('task.apis.transaction.on_commit'):
+            response = self.upload('dataset.jsonl', "\n".join(f'{{"text": "item {i}"}}' for i in range(3)))
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        self.assertEqual(os.listdir(self.media_root.name), [])
+
+        with tempfile.TemporaryDirectory() as worker_media_root, override_settings(MEDIA_ROOT=worker_media_root), \
+                patch('task.ingestion.dispatch_task_message'):
+            self.assertEqual(ingest_cluster_file(job.id), 3)
+
+    def test_lines_spanning_chunks_are_read_whole(self):
+        """Test that rows split across the stored chunks of an upload are put back together"""
+        rows = ["data", "first item", "second, quoted item", "thïrd item"]
+        with patch('task.ingestion.UPLOAD_CHUNK_SIZE', 5):
+            response = self.upload('dataset.csv', "\r\n".join(f'"{row}"' if "," in row else row for row in rows))
+
+        job = ClusterIngestionJob.objects.get(id=response.data['data']['job']['id'])
+        self.assertEqual(sorted(Task.objects.filter(cluster=job.cluster).values_list('data', flat=True)), sorted(rows[1:]))
+
+    @override_settings(CLUSTER_INGESTION_BATCH_SIZE=2, CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_progress_reaches_the_uploader_during_the_job(self):
+        """Test that the progress of every batch is sent while the celery task is still running"""
+        with patch('task.apis.transaction.on_commit'):
+            response = self.upload('dataset.jsonl', "\n".join(f'{{"text": "item {i}"}}' for i in range(4)))
+        job_id = response.data['data']['job']['id']
+
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f"user_tasks_{self.user.id}", channel_name)
+
+        async def receive_now():
+            return await asyncio.wait_for(channel_layer.receive(channel_name), timeout=1)
+
+        received_during_run = []
+        save_batch = ingestion._save_batch
+
+        def save_batch_and_receive(*args):
+            save_batch(*args)
+            received_during_run.append(async_to_sync(receive_now)()["text"]["processed_rows"])
+
+        with patch('task.ingestion._save_batch', side_effect=save_batch_and_receive):
+            ingest_cluster_file.apply(args=[job_id])
+
+        self.assertEqual(received_during_run, [2, 4])
+
+    def test_unsupported_file_is_rejected(self):
+        """Test that only jsonl and csv uploads are accepted"""
+        response = self.upload('dataset.json', '[]')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TaskCluster.objects.exists())
+
+    def test_job_status_is_private(self):
+        """Test that only the uploader sees the progress of a job"""
+        response = self.upload('dataset.jsonl', '{"text": "item"}')
+        url = reverse('task:cluster-ingestion-job', kwargs={'job_id': response.data['data']['job']['id']})
+
+        self.assertEqual(self.client.get(url).data['data']['created_tasks'], 1)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.other_user)}")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def tearDown(self):
+        self.media_override.disable()
+        self.media_root.cleanup()
+
+
+class SeedLoadDatasetTestCase(APITestCase):
+    def seed(self, **options):
+        call_command(
+            'seed_load_dataset', seed=7, reviewers=6, domains=2, projects=2, clusters_per_project=3, tasks_per_cluster=8,
+            labellers_per_cluster=3, end_date=datetime.date(2025, 6, 30), days=30, stdout=io.StringIO(), **options,
+        )
+
+    def snapshot(self):
+        return (
+            list(Task.objects.order_by('id').values_list('cluster__name', 'data', 'created_at', 'processing_status')),
+            list(TaskLabel.objects.order_by('id').values_list('task__data', 'labeller__username', 'label')),
+        )
+
+    def test_same_seed_gives_same_dataset(self):
+        """Test that regenerating with the same seed reproduces every task and label"""
+        self.seed()
+        first = self.snapshot()
+        self.assertTrue(first[0] and first[1])
+
+        self.seed(flush=True)
+
+        self.assertEqual(self.snapshot(), first)
+
+    def test_materialized_stats_match_generated_rows(self):
+        """Test that the stats the bulk inserts bypass are rebuilt for the generated projects"""
+        self.seed()
+
+        for project in Project.objects.filter(name__startswith='load '):
+            stats = ProjectStats.objects.get(project=project)
+            self.assertEqual(stats.total_clusters, TaskCluster.objects.filter(project=project).count())
+            daily_task_count = ProjectDailyStats.objects.filter(project=project).aggregate(total=Sum('task_count'))['total']
+            self.assertEqual(daily_task_count, Task.objects.filter(group=project).count())
+        self.assertFalse(TaskCluster.objects.exclude(assigned_reviewers__username__startswith='load_reviewer_').exists())
+
+    def test_serial_numbers_are_unique_across_batches(self):
+        """Test that a number given out in one batch is not given out again in the next"""
+        tasks = [Task(data=f"item {i}") for i in range(2)]
+        used = set()
+        with patch('task.utils.generate_serial_no', side_effect=['AAAAAA', 'AAAAAA', 'BBBBBB']):
+            assign_serial_numbers(tasks[:1], used=used)
+            assign_serial_numbers(tasks[1:], used=used)
+
+        self.assertEqual([task.serial_no for task in tasks], ['AAAAAA', 'BBBBBB'])
+
+    def test_existing_data_is_not_overwritten(self):
+        """Test that seeding again with the same prefix requires --flush"""
+        self.seed()
+
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class LoadTestTestCase(APITestCase):
+    def test_report_per_endpoint(self):
+        """Test that latency percentiles, errors and rejections are reported per endpoint"""
+        stats = LoadStats()
+        for latency in range(1, 101):
+            stats.record('create_task', latency, 201)
+        stats.record('login', 10, 401)
+        stats.record('login', 20, 500)
+        stats.record('login', 30)
+
+        report = stats.summary(duration_seconds=10)
+
+        self.assertEqual(report['create_task']['requests'], 100)
+        self.assertEqual(report['create_task']['throughput'], 10)
+        self.assertEqual(report['create_task']['errors'], 0)
+        self.assertAlmostEqual(report['create_task']['p50_ms'], 50.5)
+        self.assertAlmostEqual(report['create_task']['p99_ms'], 99.0)
+        self.assertEqual(report['create_task']['max_ms'], 100)
+        self.assertEqual(report['login']['rejected'], 1)
+        self.assertEqual(report['login']['errors'], 2)
+
+    @override_settings(STUB_EXTERNAL_SERVICES=True, STUB_EXTERNAL_SERVICES_LATENCY_MS=0)
+    def test_stubbed_ai_classification(self):
+        """Test that the stand-in AI client answers the classification prompt the same way every time"""
+        result = text_classification("The checkout kept crashing")
+
+        self.assertIn(result['classification'], ['Safe', 'Mildly Offensive', 'Highly Offensive'])
+        self.assertEqual(result['requires_human_review'], result['confidence'] < 0.8)
+        self.assertEqual(text_classification("The checkout kept crashing"), result)
+
+
+class AICallTelemetryTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='Testp@ssword123')
+        self.project = Project.objects.create(name='testproject', created_by=self.user)
+        self.cluster = TaskCluster.objects.create(project=self.project, created_by=self.user, task_type=TaskTypeChoices.TEXT)
+        self.task = Task.objects.create(cluster=self.cluster, group=self.project, user=self.user, task_type=TaskTypeChoices.TEXT, data="The checkout kept crashing")
+
+    def answer(self, text, input_tokens=120, output_tokens=40):
+        return SimpleNamespace(text=text, meta=SimpleNamespace(billed_units=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens)))
+
+    @override_settings(STUB_EXTERNAL_SERVICES=True, STUB_EXTERNAL_SERVICES_LATENCY_MS=0)
+    def test_classification_calls_are_recorded_against_the_cluster(self):
+        """Test that a call is stored with its model, tokens and the cluster and project of its task"""
+        with self.assertLogs('task.ai_telemetry', level='INFO'):
+            text_classification(self.task.data, task=self.task)
+
+        call = AICallTelemetry.objects.get()
+        self.assertEqual(call.outcome, AICallOutcomeChoices.SUCCESS)
+        self.assertEqual(call.model, 'command-a-03-2025')
+        self.assertEqual((call.task, call.cluster, call.project), (self.task, self.cluster, self.project))
+        self.assertGreater(call.input_tokens, 0)
+        self.assertGreater(call.output_tokens, 0)
+        self.assertEqual(call.retries, 0)
+        self.assertIsNone(call.breaker_state)
+
+    def test_unparseable_answers_are_recorded(self):
+        """Test that answers without JSON, or with invalid JSON, are told apart from successful calls"""
+        answers = [self.answer("I cannot classify this"), self.answer("```json\n{not json}\n```")]
+        with patch('task.ai_processor.get_ai_client') as get_ai_client:
+            get_ai_client.return_value.chat.side_effect = answers
+            self.assertTrue(text_classification(self.task.data, task=self.task)['requires_human_review'])
+            self.assertTrue(text_classification(self.task.data, task=self.task)['requires_human_review'])
+
+        self.assertEqual(
+            sorted(AICallTelemetry.objects.values_list('outcome', flat=True)),
+            [AICallOutcomeChoices.NO_JSON, AICallOutcomeChoices.PARSE_FAILURE],
+        )
+
+    def test_retries_are_counted(self):
+        """Test that a call that succeeds after the client's timeout and server errors is one call with retries"""
+        answers = [
+            httpx.ReadTimeout("read timed out"),
+            ApiError(status_code=503, body="unavailable"),
+            self.answer('```json\n{"learning_summary": "noted"}\n```'),
+        ]
+        with patch('task.ai_processor.get_ai_client') as get_ai_client, patch('task.ai_processor.time.sleep'):
+            get_ai_client.return_value.chat.side_effect = answers
+            success, ai_response = submit_human_review(self.task.data, "Safe", "Highly Offensive", "slur", task=self.task)
+
+        self.assertTrue(success)
+        call = AICallTelemetry.objects.get()
+        self.assertEqual((call.operation, call.outcome, call.retries), ('human_review', AICallOutcomeChoices.SUCCESS, 2))
+
+    def test_connection_errors_are_retried_until_the_last_attempt(self):
+        """Test that a classification whose connection keeps failing is given up after max_retries attempts"""
+        with patch('task.ai_processor.get_ai_client') as get_ai_client, patch('task.ai_processor.time.sleep') as sleep:
+            get_ai_client.return_value.chat.side_effect = httpx.ConnectError("connection refused")
+            result = text_classification(self.task.data, task=self.task)
+
+        self.assertTrue(result['requires_human_review'])
+        self.assertEqual(get_ai_client.return_value.chat.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        call = AICallTelemetry.objects.get()
+        self.assertEqual((call.outcome, call.retries), (AICallOutcomeChoices.ERROR, 2))
+
+    def test_client_errors_are_not_retried(self):
+        """Test that an API error that would fail again, like a bad request, is not retried"""
+        with patch('task.ai_processor.get_ai_client') as get_ai_client, patch('task.ai_processor.time.sleep') as sleep:
+            get_ai_client.return_value.chat.side_effect = ApiError(status_code=400, body="invalid request")
+            result = text_classification(self.task.data, task=self.task)
+
+        self.assertTrue(result['requires_human_review'])
+        self.assertEqual(get_ai_client.return_value.chat.call_count, 1)
+        sleep.assert_not_called()
+        self.assertEqual(AICallTelemetry.objects.get().retries, 0)
+
+    @override_settings(AI_COST_PER_MILLION_INPUT_TOKENS=2, AI_COST_PER_MILLION_OUTPUT_TOKENS=10)
+    def test_usage_is_aggregated_per_project_and_cluster(self):
+        """Test that calls, failures, tokens and cost add up per project and cluster"""
+        answers = [self.answer('```json\n{"classification": "Safe"}\n```', 500_000, 100_000), self.answer("no json", 500_000, 0)]
+        with patch('task.ai_processor.get_ai_client') as get_ai_client:
+            get_ai_client.return_value.chat.side_effect = answers
+            text_classification(self.task.data, task=self.task)
+            text_classification(self.task.data, task=self.task)
+
+        project_usage, = get_ai_usage('project')
+        self.assertEqual(project_usage['id'], self.project.id)
+        self.assertEqual((project_usage['calls'], project_usage['failed_calls'], project_usage['parse_failures']), (2, 1, 1))
+        self.assertEqual((project_usage['input_tokens'], project_usage['output_tokens']), (1_000_000, 100_000))
+        self.assertEqual(project_usage['estimated_cost'], 3.0)
+        self.assertEqual(get_ai_usage('cluster')[0]['id'], self.cluster.id)
+
+        output = io.StringIO()
+        call_command('ai_usage', '--by', 'cluster', stdout=output)
+        self.assertIn(f"{self.cluster.id} ", output.getvalue())
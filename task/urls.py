@@ -15,6 +15,8 @@ urlpatterns = [
     path('review/complete/', apis.CompleteTaskReviewView.as_view(), name='complete-task-review'),
     path('completion-stats/', apis.TaskCompletionStatsView.as_view(), name='task_completion_stats'),
     path('cluster/', apis.TaskClusterCreateView.as_view(), name='task-cluster-create'),
+    path('cluster/ingest/', apis.TaskClusterIngestView.as_view(), name='task-cluster-ingest'),
+    path('cluster/ingest/<int:job_id>/', apis.ClusterIngestionJobView.as_view(), name='cluster-ingestion-job'),
     path('my-assigned-clusters/', apis.MyAssignedClustersView.as_view(), name='my_assigned_clusters'),
     
     # Annotation endpoints
@@ -25,6 +27,7 @@ urlpatterns = [
     # Label management endpoints
     path('labels/<int:task_id>/', apis.TaskLabelsView.as_view(), name='task_labels'),
     path('cluster/<int:cluster_id>/labels-summary/', apis.ClusterLabelsSummaryView.as_view(), name='cluster_labels_summary'),
+    path('cluster/<int:cluster_id>/consensus/', apis.ClusterConsensusView.as_view(), name='cluster_consensus'),
     path('cluster/assign-to-self/', apis.AssignClusterToSelf.as_view(), name='assign-cluster-to-self'),
     path('cluster/user/list/', apis.CreatedClusterListView.as_view(), name='get-created-clusters'),
     path('cluster/<int:id>/', apis.GetClusterDetailView.as_view(), name='get-cluster-details'),
@@ -1,7 +1,6 @@
+import json
 import logging
 from celery import shared_task
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.db import models
 from django.utils import timezone
 from datetime import timedelta
@@ -9,6 +8,7 @@ from task.choices import TaskClusterStatusChoices, TaskTypeChoices
 from account.models import User, MonthlyReviewerEarnings
 import math
 from task.models import TaskCluster
+from common.realtime import publisher, record_user_event
 from common.utils import get_dp_cost_settings
 import random
 from django.db.models import Count, Q
@@ -16,10 +16,14 @@ from datetime import datetime
 from decimal import Decimal
 from django.db import models
 from django.utils import timezone
-from django.db.models import Count, Sum, F
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from account.models import MonthlyReviewerEarnings
 from account.choices import MonthlyEarningsReleaseStatusChoices
-from task.models import Task
+from task.models import LabellerQuality, Task, TaskLabel, generate_serial_no
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django_redis import get_redis_connection
 
 logger = logging.getLogger(__name__)
 
@@ -30,28 +34,189 @@ def serialize_task(task):
     return FullTaskSerializer(task).data
 
 
-def dispatch_task_message(receiver_id, payload, action="notification"):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
+def dispatch_task_message(receiver_id, payload, action="notification", immediate=False):
+    message = {"action": action, **payload}
+    # every event is also kept in the user's stream so a reconnecting client can replay what it missed
+    message["event_id"] = record_user_event(receiver_id, message)
+
+    publisher.group_send(
         f"user_tasks_{receiver_id}",
-        {"type": "task.message", "text": {"action": action, **payload}},
+        {"type": "task.message", "text": message},
+        immediate=immediate,
     )
-    print("dispatched ws message")
+    logger.debug(f"Dispatched {action} message to user {receiver_id}")
 
 
 def dispatch_review_response_message(receiver_id, payload):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
+    publisher.group_send(
         f"reviewer_group_{receiver_id}",
         {"type": "response.message", "text": {"action": "review_response", **payload}},
     )
-    print("dispatched ws message")    
+    logger.debug(f"Dispatched review response message to reviewer {receiver_id}")
 
 
-def push_realtime_update(task: Task, action="notification"):
+def push_realtime_update(task: Task, action="notification", batch=False):
     serialized = serialize_task(task)
     if task.user:
-        dispatch_task_message(task.user.id, serialized, action=action)
+        if batch:
+            queue_task_notification(task.user.id, serialized, action=action)
+        else:
+            dispatch_task_message(task.user.id, serialized, action=action)
+
+
+def _notification_buffer_key(receiver_id):
+    return f"task_notification_buffer_{receiver_id}"
+
+
+def _notification_window_key(receiver_id):
+    return f"task_notification_window_{receiver_id}"
+
+
+def queue_task_notification(receiver_id, payload, action="notification"):
+    """
+    Buffer a task notification instead of sending it straight away.
+
+    Events for the same user are coalesced for WS_NOTIFICATION_BATCH_WINDOW_MS; the first
+    event of a window schedules `flush_task_notifications`, which ships everything buffered
+    so far as a single `task_batch` frame.
+    """
+    window_ms = settings.WS_NOTIFICATION_BATCH_WINDOW_MS
+    redis = get_redis_connection("default")
+
+    pipe = redis.pipeline()
+    pipe.rpush(
+        _notification_buffer_key(receiver_id),
+        json.dumps({"action": action, **payload}, cls=DjangoJSONEncoder),
+    )
+    # the buffer should never outlive a few windows, this only guards against a lost flush
+    pipe.expire(_notification_buffer_key(receiver_id), 60)
+    pipe.set(_notification_window_key(receiver_id), 1, nx=True, px=window_ms)
+    _, _, window_opened = pipe.execute()
+
+    if window_opened:
+        flush_task_notifications.apply_async(args=[receiver_id], countdown=window_ms / 1000)
+
+
+def build_task_batch(events):
+    """
+    Collapse buffered task events into a single batch payload.
+
+    Only the latest event per task is kept, and the payload carries aggregate status counts
+    plus the current progress of every cluster touched by the batch.
+    """
+    latest_events = {}
+    for index, event in enumerate(events):
+        latest_events[event.get("id", f"event_{index}")] = event
+    tasks = list(latest_events.values())
+
+    status_counts = {}
+    for event in tasks:
+        status = event.get("processing_status")
+        if status:
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    cluster_ids = {event["cluster"] for event in tasks if event.get("cluster")}
+    clusters = {}
+    if cluster_ids:
+        rows = (
+            Task.objects.filter(cluster_id__in=cluster_ids)
+            .values("cluster_id", "processing_status")
+            .annotate(count=Count("id"))
+        )
+        for row in rows:
+            cluster = clusters.setdefault(row["cluster_id"], {"total": 0, "status_counts": {}})
+            cluster["total"] += row["count"]
+            cluster["status_counts"][row["processing_status"]] = row["count"]
+
+        for cluster in clusters.values():
+            completed = cluster["status_counts"].get("COMPLETED", 0)
+            cluster["completion_percentage"] = round(completed / cluster["total"] * 100, 2)
+
+    return {
+        "event_count": len(events),
+        "tasks": tasks,
+        "status_counts": status_counts,
+        "clusters": clusters,
+    }
+
+
+@shared_task
+def flush_task_notifications(receiver_id):
+    """
+    Drain the notification buffer of a user and send it as one `task_batch` frame
+    """
+    redis = get_redis_connection("default")
+
+    # drain the buffer and close the window atomically, any event pushed after this opens a new window
+    pipe = redis.pipeline(transaction=True)
+    pipe.lrange(_notification_buffer_key(receiver_id), 0, -1)
+    pipe.delete(_notification_buffer_key(receiver_id))
+    pipe.delete(_notification_window_key(receiver_id))
+    raw_events, _, _ = pipe.execute()
+
+    if not raw_events:
+        return 0
+
+    events = [json.loads(raw_event) for raw_event in raw_events]
+    dispatch_task_message(receiver_id, build_task_batch(events), action="task_batch")
+    return len(events)
+
+
+def build_cluster_progress_snapshot(cluster):
+    """
+    Current labelling progress of a cluster, as pushed on its `cluster_progress_{id}` channel
+    """
+    label_stats = TaskLabel.objects.filter(task__cluster=cluster).aggregate(
+        total_labels=Count("id"),
+        labelled_tasks=Count("task_id", distinct=True),
+        active_labellers=Count("labeller_id", distinct=True),
+    )
+    total_tasks = cluster.tasks.count()
+
+    return {
+        "cluster_id": cluster.id,
+        "status": cluster.status,
+        "completion_percentage": cluster.completion_percentage,
+        "total_tasks": total_tasks,
+        "labelled_tasks": label_stats["labelled_tasks"],
+        "pending_tasks": total_tasks - label_stats["labelled_tasks"],
+        "total_labels": label_stats["total_labels"],
+        "required_labels": cluster.labeller_per_item_count * total_tasks,
+        "active_labellers": label_stats["active_labellers"],
+    }
+
+
+@shared_task
+def publish_cluster_progress(cluster_id):
+    """
+    Push a fresh progress snapshot to everyone watching a cluster
+    """
+    try:
+        cluster = TaskCluster.objects.get(id=cluster_id)
+    except TaskCluster.DoesNotExist:
+        return False
+
+    publisher.group_send(
+        f"cluster_progress_{cluster_id}",
+        {"type": "cluster.progress", "snapshot": build_cluster_progress_snapshot(cluster)},
+    )
+    return True
+
+
+def schedule_cluster_progress_update(cluster_id):
+    """
+    Throttle progress snapshots for a cluster to one per WS_CLUSTER_PROGRESS_THROTTLE_MS.
+
+    The first label of an interval publishes straight away, later ones only make sure a single
+    trailing snapshot goes out at the end of the interval so watchers always end on the latest numbers.
+    """
+    interval_ms = settings.WS_CLUSTER_PROGRESS_THROTTLE_MS
+    redis = get_redis_connection("default")
+
+    if redis.set(f"cluster_progress_throttle_{cluster_id}", 1, nx=True, px=interval_ms):
+        publish_cluster_progress.delay(cluster_id)
+    elif redis.set(f"cluster_progress_trailing_{cluster_id}", 1, nx=True, px=interval_ms):
+        publish_cluster_progress.apply_async(args=[cluster_id], countdown=interval_ms / 1000)
 
 
 def assign_reviewer(task):
@@ -106,12 +271,51 @@ def assign_reviewers_to_cluster(cluster_id):
     
     domain = cluster.labeler_domain
     
-    #get reviewers in this domain and order them by the ones that have the least assigned clusters (i.e the less busy ones)
-    matching_reviewers = list(User.objects.filter(domains=domain, is_reviewer=True).annotate(assigned_count=Count('assigned_clusters', filter=~Q(assigned_clusters__status=TaskClusterStatusChoices.COMPLETED))).order_by('assigned_count'))    
+    #the reviewer's agreement with consensus in this domain, unproven reviewers get the prior
+    quality_score = Coalesce(
+        Subquery(
+            LabellerQuality.objects.filter(labeller=OuterRef('pk'), domain=domain)
+            .annotate(score=LabellerQuality.score_expression())
+            .values('score')[:1]
+        ),
+        Value(LabellerQuality.PRIOR_AGREEMENT),
+    )
+    
+    #get reviewers in this domain and order them by the ones that have the least assigned clusters (i.e the less busy ones),
+    #reviewers who keep disagreeing with consensus only get picked once the reliable ones are used up
+    matching_reviewers = list(
+        User.objects.filter(domains=domain, is_reviewer=True)
+        .annotate(
+            assigned_count=Count('assigned_clusters', filter=~Q(assigned_clusters__status=TaskClusterStatusChoices.COMPLETED)),
+            quality_score=quality_score,
+        )
+        .annotate(unreliable=Case(When(quality_score__lt=settings.LABELLER_QUALITY_MIN_SCORE, then=Value(True)), default=Value(False)))
+        .order_by('unreliable', 'assigned_count', '-quality_score')
+    )
     cluster.assigned_reviewers.add(*matching_reviewers[:cluster.labeller_per_item_count]) #since matching_reviewers is already ordered by the least busy ones, we can just add the first cluster.labeller_per_item_count ones
     cluster.save()
     return True
 
+def assign_serial_numbers(tasks, used=None):
+    """
+    Give every task a serial number that no existing task or other task of the batch has.
+    Batches of tasks that are inserted together share a `used` set, which collects the numbers given out.
+    """
+    used = set() if used is None else used
+    pending = tasks
+    while pending:
+        for task in pending:
+            task.serial_no = generate_serial_no()
+        taken = set(Task.objects.filter(serial_no__in=[task.serial_no for task in pending]).values_list("serial_no", flat=True))
+        retry = []
+        for task in pending:
+            if task.serial_no in taken or task.serial_no in used:
+                retry.append(task)
+            else:
+                used.add(task.serial_no)
+        pending = retry
+
+
 def calculate_labelling_required_data_points(cluster_data: dict) -> int:
     """
     Calculate the total data points required for a cluster item.
@@ -342,3 +546,95 @@ def get_labeller_monthly_history(labeler: User, months_back: int = 6):
         "history": history,
     }
 
+
+
+def _cluster_label_histogram_key(cluster_id):
+    return f"cluster_label_histogram_{cluster_id}"
+
+
+def _cluster_labeller_histogram_key(cluster_id):
+    return f"cluster_labeller_histogram_{cluster_id}"
+
+
+def _cluster_histogram_ready_key(cluster_id):
+    return f"cluster_label_histogram_ready_{cluster_id}"
+
+
+def _hydrate_cluster_label_histogram(cluster_id):
+    """Build the label and labeller histograms of a cluster from two GROUP BY queries and store them in redis"""
+    label_counts = (
+        TaskLabel.objects.filter(task__cluster_id=cluster_id, label__isnull=False)
+        .values("label").annotate(count=Count("id")).order_by()
+    )
+    labeller_counts = (
+        TaskLabel.objects.filter(task__cluster_id=cluster_id)
+        .values("labeller_id").annotate(count=Count("id")).order_by()
+    )
+    timeout = settings.CLUSTER_LABEL_HISTOGRAM_TIMEOUT
+
+    pipe = get_redis_connection("default").pipeline()
+    pipe.delete(_cluster_label_histogram_key(cluster_id), _cluster_labeller_histogram_key(cluster_id))
+    label_mapping = {row["label"]: row["count"] for row in label_counts}
+    labeller_mapping = {row["labeller_id"]: row["count"] for row in labeller_counts}
+    if label_mapping:
+        pipe.zadd(_cluster_label_histogram_key(cluster_id), label_mapping)
+        pipe.expire(_cluster_label_histogram_key(cluster_id), timeout)
+    if labeller_mapping:
+        pipe.zadd(_cluster_labeller_histogram_key(cluster_id), labeller_mapping)
+        pipe.expire(_cluster_labeller_histogram_key(cluster_id), timeout)
+    pipe.set(_cluster_histogram_ready_key(cluster_id), 1, ex=timeout)
+    pipe.execute()
+
+
+def record_cluster_label(cluster_id, label, labeller_id):
+    """
+    Count a newly created label in the cluster's cached histograms.
+
+    Only histograms that are already loaded are updated, a missing one is built from the database on its next
+    read. Every key carries CLUSTER_LABEL_HISTOGRAM_TIMEOUT, which bounds any drift from a label created while
+    the histogram was being built: a histogram created here (the cluster had no labels when it was built)
+    gets the remaining lifetime of the ready marker, so it expires together with it.
+    """
+    redis = get_redis_connection("default")
+    ttl = redis.ttl(_cluster_histogram_ready_key(cluster_id))
+    if ttl <= 0:
+        # missing (or, never set by this code, without an expiry)
+        return
+
+    pipe = redis.pipeline()
+    if label is not None:
+        pipe.zincrby(_cluster_label_histogram_key(cluster_id), 1, label)
+        pipe.expire(_cluster_label_histogram_key(cluster_id), ttl)
+    pipe.zincrby(_cluster_labeller_histogram_key(cluster_id), 1, labeller_id)
+    pipe.expire(_cluster_labeller_histogram_key(cluster_id), ttl)
+    pipe.execute()
+
+
+def clear_cluster_label_histogram(cluster_id):
+    get_redis_connection("default").delete(
+        _cluster_histogram_ready_key(cluster_id),
+        _cluster_label_histogram_key(cluster_id),
+        _cluster_labeller_histogram_key(cluster_id),
+    )
+
+
+def get_cluster_label_histogram(cluster_id, top=None):
+    """
+    Return (label_frequency, unique_labels, labeller_counts) for a cluster, most frequent labels first.
+
+    With `top`, only the `top` most frequent labels are returned, while `unique_labels` still counts every
+    distinct label. `labeller_counts` maps labeller ids to the number of labels they submitted.
+    """
+    redis = get_redis_connection("default")
+    if not redis.exists(_cluster_histogram_ready_key(cluster_id)):
+        _hydrate_cluster_label_histogram(cluster_id)
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.zrevrange(_cluster_label_histogram_key(cluster_id), 0, (top or 0) - 1, withscores=True)
+    pipe.zcard(_cluster_label_histogram_key(cluster_id))
+    pipe.zrevrange(_cluster_labeller_histogram_key(cluster_id), 0, -1, withscores=True)
+    labels, unique_labels, labellers = pipe.execute()
+
+    label_frequency = {label.decode(): int(count) for label, count in labels}
+    labeller_counts = {int(labeller_id): int(count) for labeller_id, count in labellers}
+    return label_frequency, unique_labels, labeller_counts